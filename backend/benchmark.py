@@ -0,0 +1,160 @@
+"""
+离线基准测试：录制一次真实的规划(高德MCP工具调用结果和LLM回复)，之后回放录制数据测量
+流水线自身开销、解析耗时和并发扩展性，不需要网络和密钥，结果可重复。
+
+用法:
+    python benchmark.py record [请求JSON文件]          录制(需要高德和LLM密钥)，保存到 TRIP_FIXTURE
+    python benchmark.py [运行次数] [LLM延迟秒数] [工具延迟秒数]   回放并输出基准测试结果
+
+录制和回放的请求相同(回放时使用录制文件里保存的请求)。回放时 LLM 回复按输入消息匹配，
+修改提示词或规划逻辑后输入变化，需要重新录制。
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+# 不读写持久化缓存，每次都完整执行规划
+os.environ.setdefault("TRIP_CACHE_PATH", "")
+os.environ.setdefault("TOOL_CACHE_PATH", "")
+os.environ.setdefault("TRIP_REPLAY_MODE", "record" if sys.argv[1:2] == ["record"] else "replay")
+import main
+from replay import get_fixture
+from stream_parser import StreamingJsonParser
+
+REQUEST = {
+    "city": "北京",
+    "start_date": "2025-12-20",
+    "end_date": "2025-12-22",
+    "travel_days": 3,
+    "transportation": "公共交通",
+    "accommodation": "经济型",
+    "preferences": ["历史文化"],
+    "free_text_input": "",
+    "bypass_cache": True
+}
+CONCURRENCY_LEVELS = (1, 2, 4, 8, 16)
+
+
+def quiet():
+    """规划过程的日志会淹没测试结果，也会计入耗时，运行期间不输出"""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def record(request_path=None):
+    request = REQUEST
+    if request_path:
+        with open(request_path, encoding="utf-8") as file:
+            request = json.load(file)
+    request = main.TripRequest(**request)
+    fixture = get_fixture()
+    start = time.perf_counter()
+    async with main.build_mcp_client().session(main.MCP_SERVER_NAME) as session:
+        planner = main.MultiAgentTripPlanner(await main.get_tools(session), main.build_llm())
+        try:
+            await planner.plan_trip(request)
+        except main.TripPlanningError as e:
+            raise RuntimeError("规划失败，录制数据不完整") from e
+    fixture.data["request"] = request.model_dump(mode="json")
+    fixture.save()
+    print(f"✅ 已录制到 {fixture.path}，用时 {time.perf_counter() - start:.1f}s，"
+          f"{len(fixture.data['tool_calls'])} 次工具调用，{len(fixture.data['llm_calls'])} 次LLM调用")
+
+
+async def build_planner(llm_latency=0.0, tool_latency=0.0):
+    """按指定的合成延迟创建回放用的多智能体系统"""
+    os.environ["TRIP_REPLAY_LLM_LATENCY"] = str(llm_latency)
+    os.environ["TRIP_REPLAY_TOOL_LATENCY"] = str(tool_latency)
+    return main.MultiAgentTripPlanner(await main.get_tools(), main.build_llm())
+
+
+async def run_once(planner, request):
+    start = time.perf_counter()
+    try:
+        await planner.plan_trip(request)
+    except main.TripPlanningError as e:
+        raise RuntimeError("回放失败，录制数据可能已过期，请重新录制") from e
+    return time.perf_counter() - start
+
+
+async def benchmark_overhead(request, runs):
+    """零延迟回放：耗时全部是流水线自身的开销(Agent框架、解析、聚类、预算计算等)"""
+    with quiet():
+        planner = await build_planner()
+        await run_once(planner, request)  # 预热
+        durations = [await run_once(planner, request) for _ in range(runs)]
+    print(f"\n流水线开销(零延迟，{runs} 次): 平均 {statistics.mean(durations) * 1000:.1f}ms，"
+          f"p50 {percentile(durations, 50) * 1000:.1f}ms，p95 {percentile(durations, 95) * 1000:.1f}ms")
+    return planner
+
+
+def benchmark_parse(planner, request, runs):
+    """录制的行程规划输出的解析耗时：一次性解析(_parse_response) 与 流式逐段解析(StreamingJsonParser)"""
+    if planner.planner_prompt_format == "compact":
+        model, item_models = main.PlannerOutput, {"days": main.PlannedDay}
+    else:
+        model, item_models = main.TripPlan, {"days": main.DayPlan, "weather_info": main.WeatherInfo}
+    texts = [entry["message"]["data"]["content"] for entry in get_fixture().data["llm_calls"].values()]
+    texts = [text for text in texts if isinstance(text, str) and '"days"' in text]
+    if not texts:
+        print("\n解析耗时: 录制数据中没有完整的行程规划输出(PLANNER_MODE=per_day 时按天生成)，跳过")
+        return
+    batch_start = time.perf_counter()
+    with quiet():
+        for _ in range(runs):
+            for text in texts:
+                planner._parse_response(text, "```json", request, model)
+    batch = (time.perf_counter() - batch_start) / (runs * len(texts))
+    stream_start = time.perf_counter()
+    for _ in range(runs):
+        for text in texts:
+            parser = StreamingJsonParser(item_models)
+            for i in range(0, len(text), 16):
+                parser.feed(text[i:i + 16])
+    streaming = (time.perf_counter() - stream_start) / (runs * len(texts))
+    print(f"解析耗时(平均 {statistics.mean(len(text) for text in texts):.0f} 字符): "
+          f"一次性解析 {batch * 1000:.2f}ms，流式解析 {streaming * 1000:.2f}ms")
+
+
+async def benchmark_concurrency(request, llm_latency, tool_latency):
+    """带合成延迟回放，并发数逐步增加：总用时应接近单个请求的用时，吞吐量随并发数增加"""
+    with quiet():
+        planner = await build_planner(llm_latency, tool_latency)
+    print(f"\n并发扩展性(LLM延迟 {llm_latency}s，工具延迟 {tool_latency}s):")
+    print(f"{'并发数':>6} {'总用时':>9} {'p50':>9} {'p95':>9} {'吞吐量(次/秒)':>14}")
+    for concurrency in CONCURRENCY_LEVELS:
+        start = time.perf_counter()
+        with quiet():
+            durations = await asyncio.gather(*(run_once(planner, request) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        print(f"{concurrency:>6} {elapsed:>8.2f}s {percentile(durations, 50):>8.2f}s "
+              f"{percentile(durations, 95):>8.2f}s {concurrency / elapsed:>14.2f}")
+
+
+async def replay(runs=20, llm_latency=0.2, tool_latency=0.05):
+    fixture = get_fixture()
+    if fixture.data["request"] is None:
+        raise RuntimeError(f"{fixture.path} 不是有效的录制文件，请先运行 python benchmark.py record")
+    request = main.TripRequest(**fixture.data["request"])
+    planner = await benchmark_overhead(request, runs)
+    benchmark_parse(planner, request, runs)
+    await benchmark_concurrency(request, llm_latency, tool_latency)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args and args[0] == "record":
+        asyncio.run(record(args[1] if len(args) > 1 else None))
+    else:
+        asyncio.run(replay(int(args[0]) if args else 20,
+                           float(args[1]) if len(args) > 1 else 0.2,
+                           float(args[2]) if len(args) > 2 else 0.05))
@@ -0,0 +1,112 @@
+from typing import List, Optional, Tuple
+
+from cluster import haversine_distance
+from data_model import Budget, DayPlan, Hotel, Location, RouteLeg, TripPlan, TripRequest
+from parse_info import HOTEL_PRICE_CONFIG
+
+# 各交通方式的费用估算：每段行程的固定费用(起步价/单程票) + 每公里费用(元)
+TRANSPORT_COST_CONFIG = {
+    "公共交通": {"per_leg": 2, "per_km": 0.3},
+    "自驾": {"per_leg": 0, "per_km": 0.8},
+    "出租车": {"per_leg": 13, "per_km": 2.5},
+    "步行": {"per_leg": 0, "per_km": 0},
+}
+# 实际道路距离约为球面直线距离的 1.3 倍
+ROUTE_DETOUR_FACTOR = 1.3
+
+
+def _distance_km(origin: Optional[Location], destination: Optional[Location]) -> float:
+    if origin is None or destination is None:
+        return 0.0
+    distance = haversine_distance(origin.latitude, origin.longitude, destination.latitude, destination.longitude)
+    return float(distance) / 1000 * ROUTE_DETOUR_FACTOR
+
+
+def day_route(day_plan: DayPlan, start_hotel: Optional[Hotel], end_hotel: Optional[Hotel]) -> List[Location]:
+    """
+    单日的移动路线：从前一晚的酒店出发，按顺序游览景点，需要住宿时回到当天的酒店
+    Args:
+        day_plan: 单日行程
+        start_hotel: 出发的酒店，第一天为当天的酒店
+        end_hotel: 当晚入住的酒店，最后一天为 None
+    Returns:
+        路线上依次经过的坐标
+    """
+    route = []
+    if start_hotel is not None and start_hotel.location is not None:
+        route.append(start_hotel.location)
+    route.extend(attraction.location for attraction in day_plan.attractions if attraction.location is not None)
+    if end_hotel is not None and end_hotel.location is not None:
+        route.append(end_hotel.location)
+    return route
+
+
+def day_hotels(days: List[DayPlan]) -> List[Tuple[Optional[Hotel], Optional[Hotel]]]:
+    """
+    每天出发和结束的酒店：从前一晚的酒店出发(第一天为当天的酒店)，回到当晚入住的酒店(最后一天为 None)；
+    当天没有酒店时沿用前一晚的酒店
+    Args:
+        days: 按 day_index 排好序的每日行程
+    Returns:
+        [(出发的酒店, 结束的酒店)]
+    """
+    hotels = []
+    previous_hotel = None
+    for i, day in enumerate(days):
+        hotel = day.hotel or previous_hotel
+        hotels.append((previous_hotel or hotel, None if i == len(days) - 1 else hotel))
+        previous_hotel = hotel
+    return hotels
+
+
+def transportation_cost(route: List[Location], transportation: str) -> float:
+    config = TRANSPORT_COST_CONFIG.get(transportation, TRANSPORT_COST_CONFIG["公共交通"])
+    cost = 0.0
+    for origin, destination in zip(route, route[1:]):
+        distance = _distance_km(origin, destination)
+        if distance > 0:
+            cost += config["per_leg"] + config["per_km"] * distance
+    return cost
+
+
+def route_legs_cost(legs: List[RouteLeg], transportation: str) -> float:
+    """按路线规划(route.py)得到的每段距离计算交通费用"""
+    config = TRANSPORT_COST_CONFIG.get(transportation, TRANSPORT_COST_CONFIG["公共交通"])
+    return sum(config["per_leg"] + config["per_km"] * leg.distance / 1000 for leg in legs if leg.distance > 0)
+
+
+def compute_budget(trip_plan: TripPlan, request: TripRequest) -> Budget:
+    """
+    根据最终的每日行程在本地计算预算，不再由 LLM 汇总：
+    - 景点: 所有景点门票之和
+    - 餐饮: 所有餐饮预估费用之和
+    - 酒店: 住宿晚数(天数 - 1) × 当晚酒店的每晚价格，没有酒店时按住宿类型的价格估算
+    - 交通: 每天 酒店 → 各景点 → 酒店 的距离按交通方式估算，有路线规划结果(DayPlan.route)时按每段的实际距离
+    """
+    days = sorted(trip_plan.days, key=lambda day: day.day_index)
+    default_rate = HOTEL_PRICE_CONFIG.get(request.accommodation, HOTEL_PRICE_CONFIG["舒适型"])["estimated_cost"]
+
+    total_attractions = sum(attraction.ticket_price for day in days for attraction in day.attractions)
+    total_meals = sum(meal.estimated_cost for day in days for meal in day.meals)
+
+    total_hotels = 0
+    total_transportation = 0.0
+    for day, (start_hotel, end_hotel) in zip(days, day_hotels(days)):
+        if end_hotel is not None:
+            total_hotels += end_hotel.estimated_cost if end_hotel.estimated_cost else default_rate
+        elif day is not days[-1]:
+            total_hotels += default_rate
+        if day.route:
+            total_transportation += route_legs_cost(day.route, request.transportation)
+        else:
+            route = day_route(day, start_hotel, end_hotel)
+            total_transportation += transportation_cost(route, request.transportation)
+
+    total_transportation = round(total_transportation)
+    return Budget(
+        total_attractions=total_attractions,
+        total_hotels=total_hotels,
+        total_meals=total_meals,
+        total_transportation=total_transportation,
+        total=total_attractions + total_hotels + total_meals + total_transportation,
+    )
@@ -0,0 +1,173 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from data_model import TripPlan
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+class LRUCache:
+    """进程内 LRU 缓存，条目带过期时间"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any, expires_at: float) -> int:
+        """写入条目，返回因容量限制被淘汰的条目数"""
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        evicted = 0
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def pop(self, key: str):
+        self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteStore:
+    """
+    SQLite 持久化键值存储，条目带过期时间，超过容量时淘汰最久未访问的条目。
+    方法都是同步的，在事件循环中请通过 asyncio.to_thread 调用。
+    """
+
+    def __init__(self, path: str, max_entries: int, table: str = "entries"):
+        self.path = path
+        self.max_entries = max_entries
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ("
+                               "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                               "expires_at REAL NOT NULL, last_access REAL NOT NULL)")
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_access ON {table}(last_access)")
+
+    def get(self, key: str) -> Optional[tuple]:
+        """返回 (value, expires_at)，不存在或已过期时返回 None"""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at <= now:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return None
+            self._conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key))
+            return value, expires_at
+
+    def put(self, key: str, value: str, expires_at: float) -> int:
+        """写入条目，先清理过期条目，再按最近访问时间淘汰超出容量的条目，返回淘汰的条目数"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, last_access) "
+                               "VALUES (?, ?, ?, ?)", (key, value, expires_at, now))
+            self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,))
+            count = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow <= 0:
+                return 0
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key IN ("
+                               f"SELECT key FROM {self.table} ORDER BY last_access LIMIT ?)", (overflow,))
+            return overflow
+
+    def delete(self, key: str):
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TripPlanCache:
+    """
+    完整旅行计划的两级缓存：进程内 LRU + SQLite 持久化（重启后仍然有效）。
+    键为 TripRequest.normalized_key()，有效期为 TRIP_CACHE_TTL：计划都包含天气预报，几小时就会过时，
+    按内容分别设置有效期再取最短的一个，结果总是天气的有效期，因此只用一个设置。
+    两级缓存都保存序列化后的 JSON，每次读取都还原为新的对象，调用方修改计划(预算、路线等)不会影响缓存的内容。
+    """
+
+    def __init__(self, path=None, memory_size=None, disk_size=None):
+        path = path if path is not None else os.getenv("TRIP_CACHE_PATH", "trip_cache.sqlite3")
+        self.memory = LRUCache(int(memory_size if memory_size is not None
+                                   else os.getenv("TRIP_CACHE_MEMORY_SIZE", 128)))
+        disk_size = int(disk_size if disk_size is not None else os.getenv("TRIP_CACHE_DISK_SIZE", 5000))
+        # TRIP_CACHE_PATH 为空时只使用进程内缓存
+        self.disk = SqliteStore(path, disk_size, table="trip_plans") if path else None
+        self.ttl = float(os.getenv("TRIP_CACHE_TTL", 6 * HOUR))
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "bypasses": 0,
+            "stores": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+
+    async def get(self, key: str) -> Optional[TripPlan]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.counters["memory_hits"] += 1
+            return TripPlan.model_validate_json(value)
+        if self.disk is not None:
+            entry = await asyncio.to_thread(self.disk.get, key)
+            if entry is not None:
+                value, expires_at = entry
+                self.counters["disk_hits"] += 1
+                # 提升到进程内缓存
+                self.counters["memory_evictions"] += self.memory.put(key, value, expires_at)
+                return TripPlan.model_validate_json(value)
+        self.counters["misses"] += 1
+        return None
+
+    async def put(self, key: str, trip_plan: TripPlan):
+        expires_at = time.time() + self.ttl
+        value = trip_plan.model_dump_json()
+        self.counters["stores"] += 1
+        self.counters["memory_evictions"] += self.memory.put(key, value, expires_at)
+        if self.disk is not None:
+            self.counters["disk_evictions"] += await asyncio.to_thread(self.disk.put, key, value, expires_at)
+
+    def stats(self) -> dict:
+        lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        return {
+            **self.counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "disk_entries": len(self.disk) if self.disk is not None else 0,
+            "ttl_seconds": self.ttl,
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
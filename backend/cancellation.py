@@ -0,0 +1,52 @@
+import asyncio
+from typing import Awaitable, Callable, Dict
+
+
+class ClientDisconnected(Exception):
+    """客户端已断开连接"""
+
+
+class CancellationStats:
+    """记录因客户端断开或超过截止时间而取消的规划次数"""
+
+    def __init__(self):
+        self.counters: Dict[str, int] = {"client_disconnected": 0, "deadline_exceeded": 0}
+
+    def record(self, reason: str):
+        self.counters[reason] = self.counters.get(reason, 0) + 1
+
+    def stats(self) -> dict:
+        return dict(self.counters)
+
+
+cancellation_stats = CancellationStats()
+
+
+async def run_until_disconnected(awaitable: Awaitable, is_disconnected: Callable[[], Awaitable[bool]],
+                                 poll_interval: float = 1.0):
+    """
+    执行 awaitable，同时每隔 poll_interval 秒检查一次客户端是否已断开；
+    断开时取消执行(正在进行的 LLM 调用、工具调用和未完成的阶段都会收到 CancelledError)
+
+    Args:
+        awaitable: 要执行的协程
+        is_disconnected: 检查客户端是否断开的协程函数，如 starlette Request.is_disconnected
+        poll_interval: 检查间隔秒数
+
+    Raises:
+        ClientDisconnected: 客户端已断开，执行已被取消
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await is_disconnected():
+                cancellation_stats.record("client_disconnected")
+                print("🛑 客户端已断开，取消规划")
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
@@ -31,15 +31,336 @@ def haversine_distance(lat1, lon1, lat2, lon2):
 
 
 # ---------------------- 构建距离矩阵 ----------------------
-def build_distance_matrix(points):
+# 分块计算时每块的行数，限制临时数组的大小（每块约 chunk_size × n 个元素）
+DISTANCE_CHUNK_SIZE = 1024
+
+
+EARTH_RADIUS = 6371000
+
+
+def to_unit_vectors(points):
+    """
+    经纬度转为单位球面上的三维坐标：两点的直线(弦)距离 d 与球面距离一一对应，
+    球面距离 = 2R·arcsin(d/2)，与 Haversine 公式结果相同，但不需要对每一对点做三角函数运算
+    :param points: 经纬度列表，格式[[lon1, lat1], [lon2, lat2], ...]
+    :return: n×3 数组
+    """
+    coords = np.radians(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+    lon, lat = coords[:, 0], coords[:, 1]
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def chord_to_meters(chord):
+    """单位球面上的弦长(可以是数组)转为球面距离（米）"""
+    return 2 * EARTH_RADIUS * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def _distance_block(rows, columns):
+    """一组点(行)到另一组点(列)的球面距离矩阵，一次广播计算，原地运算减少临时数组"""
+    block = (rows[:, 0, None] - columns[None, :, 0]) ** 2
+    block += (rows[:, 1, None] - columns[None, :, 1]) ** 2
+    block += (rows[:, 2, None] - columns[None, :, 2]) ** 2
+    np.sqrt(block, out=block)
+    block *= 0.5
+    # 浮点误差可能使弦长的一半略大于 1
+    np.clip(block, 0, 1, out=block)
+    np.arcsin(block, out=block)
+    block *= 2 * EARTH_RADIUS
+    return block
+
+
+def build_distance_matrix(points, condensed=False, dtype=np.float64, chunk_size=DISTANCE_CHUNK_SIZE):
+    """
+    构建n个点的距离矩阵：在单位球面坐标上按行分块广播计算，不逐对调用 haversine_distance
+    :param points: 经纬度列表，格式[[lon1, lat1], [lon2, lat2], ...]
+    :param condensed: 为 True 时只返回上三角(不含对角线)，按行展开为长度 n*(n-1)/2 的一维数组，
+                      与 scipy.spatial.distance.pdist 的顺序相同，i<j 的距离在下标 n*i - i*(i+1)/2 + (j-i-1)
+    :param dtype: 输出类型，np.float32 时内存减半(米级精度足够)
+    :param chunk_size: 每块的行数
+    :return: 距离矩阵（n×n 二维数组，或压缩的一维数组）
+    """
+    vectors = to_unit_vectors(points)
+    n = len(vectors)
+    if condensed:
+        result = np.empty(n * (n - 1) // 2, dtype=dtype)
+        offset = 0
+        for start in range(0, n, chunk_size):
+            end = min(n, start + chunk_size)
+            # 只计算当前行块右上方的部分：行 [start, end) × 列 [start, n)
+            block = _distance_block(vectors[start:end], vectors[start:])
+            upper = block[np.arange(n - start)[None, :] > np.arange(end - start)[:, None]]
+            result[offset:offset + len(upper)] = upper
+            offset += len(upper)
+        return result
+
+    dist_matrix = np.empty((n, n), dtype=dtype)
+    for start in range(0, n, chunk_size):
+        end = min(n, start + chunk_size)
+        dist_matrix[start:end] = _distance_block(vectors[start:end], vectors)
+    np.fill_diagonal(dist_matrix, 0)
+    return dist_matrix
+
+
+# ---------------------- 按天分组：恰好 days 组，每组不超过容量，组内距离尽量近 ----------------------
+class PartitionStats:
+    """全部请求中按天分组的累计次数，以及因总容量(每天最多点数 × 天数)不够而没有安排到任何一天的点数"""
+
+    def __init__(self):
+        self.counters = {"partitions": 0, "unassigned": 0}
+
+    def record(self, outcome: str, count: int = 1):
+        self.counters[outcome] += count
+
+    def stats(self) -> dict:
+        return dict(self.counters)
+
+
+partition_stats = PartitionStats()
+
+
+# 按天分组的局部搜索中每个点只尝试与离它最近的这些点交换
+PARTITION_NEIGHBOURS = 16
+# 重新选中心点时只在离组几何中心最近的这些点中选；点数不超过它时与遍历全部点的结果相同
+MEDOID_CANDIDATES = 32
+
+
+def _medoid(vectors, members):
+    """
+    members 中到其他成员距离之和最小的点(相同时取下标最小的)：只计算候选点到全部成员的距离，
+    不需要成员数 × 成员数的距离矩阵
+    """
+    candidates = members
+    if len(members) > MEDOID_CANDIDATES:
+        offsets = vectors[members] - vectors[members].mean(axis=0)
+        nearest = np.argpartition(np.einsum("ij,ij->i", offsets, offsets), MEDOID_CANDIDATES - 1)
+        candidates = np.sort(members[nearest[:MEDOID_CANDIDATES]])
+    return int(candidates[np.argmin(_distance_block(vectors[candidates], vectors[members]).sum(axis=1))])
+
+
+def _capacitated_assign(costs, medoids, capacity):
+    """
+    在容量限制下把每个点分配给一个中心点(costs 为点数 × 中心点数的距离)：按“次优与最优中心点的距离差”(后悔值)
+    从大到小依次分配，距离差大的点先选到最近的中心点；超出总容量的点不分配(-1)。
+    后悔值只在某一组满员时变化，所以每次满员后才重新计算并排序
+    """
+    n = costs.shape[0]
+    labels = np.full(n, -1)
+    loads = np.zeros(len(medoids), dtype=np.int64)
+    # 中心点固定分到自己的组
+    for group, medoid in enumerate(medoids):
+        labels[medoid] = group
+        loads[group] = 1
+    remaining = np.flatnonzero(labels == -1)
+    while len(remaining) and (loads < capacity).any():
+        open_groups = np.flatnonzero(loads < capacity)
+        open_costs = costs[np.ix_(remaining, open_groups)]
+        ordered = np.sort(open_costs, axis=1)
+        regret = ordered[:, 1] - ordered[:, 0] if len(open_groups) > 1 else -ordered[:, 0]
+        choices = open_groups[np.argmin(open_costs, axis=1)]
+        order = np.argsort(-regret, kind="stable")
+        for position, row in enumerate(order.tolist()):
+            group = choices[row]
+            labels[remaining[row]] = group
+            loads[group] += 1
+            if loads[group] >= capacity:
+                break
+        remaining = np.delete(remaining, order[:position + 1])
+    return labels
+
+
+def _reverse_neighbours(neighbours):
     """
-    构建n个点的距离矩阵（n×n）
+    近邻关系的反向索引：owners[starts[i]:starts[i + 1]] 为近邻列表中包含点 i 的点
+    """
+    flat = neighbours.ravel()
+    order = np.argsort(flat, kind="stable")
+    owners = order // max(1, neighbours.shape[1])
+    starts = np.searchsorted(flat[order], np.arange(len(neighbours) + 1))
+    return owners, starts
+
+
+def _improve_by_swaps(costs, neighbours, medoids, labels, capacity):
+    """
+    局部搜索：点移动到有空位的更近的组，或与近邻候选(neighbours，KD 树查询的 k 近邻)中另一组的点交换，
+    直到总距离不再减少。每一轮用数组运算评估移动(点数 × 组数)和近邻交换(点数 × 近邻数)，每个点取减少量最大的一个，
+    按减少量从大到小执行互不涉及同一个点的改动(每个改动的减少量只取决于它自己的点)；
+    下一轮只重新评估改动过或被跳过的点和它们的近邻，有组从满员变为有空位时才重新评估全部点
+    """
+    loads = np.bincount(labels[labels >= 0], minlength=costs.shape[1])
+    # 中心点固定在自己的组，未分配的点不参与
+    movable = labels >= 0
+    movable[medoids] = False
+    points = np.flatnonzero(movable)
+    owners, starts = _reverse_neighbours(neighbours)
+    active = points
+    while len(active):
+        rows = np.arange(len(active))
+        groups = labels[active]
+        current = costs[active, groups]
+        full = loads >= capacity
+        # 移动：当前距离 - 到其他有空位的组的距离
+        move_gain = current[:, None] - costs[active]
+        move_gain[:, full] = -np.inf
+        move_gain[rows, groups] = -np.inf
+        # 交换：与近邻中可以移动且在另一组的点交换所属的组
+        partners = neighbours[active]
+        partner_groups = labels[partners]
+        swap_gain = (current[:, None] + costs[partners, partner_groups]
+                     - costs[active[:, None], partner_groups] - costs[partners, groups[:, None]])
+        swap_gain[~movable[partners] | (partner_groups == groups[:, None])] = -np.inf
+
+        best_moves = np.argmax(move_gain, axis=1)
+        best_swaps = np.argmax(swap_gain, axis=1)
+        is_move = move_gain[rows, best_moves] >= swap_gain[rows, best_swaps]
+        gains = np.where(is_move, move_gain[rows, best_moves], swap_gain[rows, best_swaps])
+        targets = np.where(is_move, best_moves, partners[rows, best_swaps])
+        order = np.flatnonzero(gains > 1e-9)
+        order = order[np.argsort(-gains[order], kind="stable")]
+
+        touched = np.zeros(len(labels), dtype=bool)
+        skipped = np.zeros(len(labels), dtype=bool)
+        for point, target, move in zip(active[order].tolist(), targets[order].tolist(), is_move[order].tolist()):
+            if touched[point] or (loads[target] >= capacity if move else touched[target]):
+                skipped[point] = True
+            elif move:
+                loads[labels[point]] -= 1
+                loads[target] += 1
+                labels[point] = target
+                touched[point] = True
+            else:
+                labels[point], labels[target] = labels[target], labels[point]
+                touched[point] = touched[target] = True
+        if not touched.any():
+            break
+        if (full & (loads < capacity)).any():
+            active = points
+            continue
+        changed = np.flatnonzero(touched)
+        dirty = touched | skipped
+        dirty[np.concatenate([owners[starts[i]:starts[i + 1]] for i in changed.tolist()])] = True
+        active = points[dirty[points]]
+    return labels
+
+
+def partition_days(points, days, capacity=None, max_iterations=20):
+    """
+    带容量限制的均衡 k-medoids：把点分成恰好 days 组(点数少于 days 时每个点一组)，每组最多 capacity 个点，
+    使各点到所在组中心点(medoid)的距离之和尽量小，供每天游览一组景点。
+    只计算各点到中心点的距离(点数 × 组数)和 KD 树给出的近邻，不构建 n×n 距离矩阵，点数上万时也可以使用。
+    1. 初始中心点：整体最中心的点，之后依次取离已选中心点最远的点
+    2. 按后悔值在容量限制下分配，再用移动/近邻交换做局部搜索
+    3. 每组重新选组内距离之和最小的点为中心点，重复 2、3 直到中心点不变
     :param points: 经纬度列表，格式[[lon1, lat1], [lon2, lat2], ...]
-    :return: 距离矩阵（二维数组）
+    :param days: 组数(天数)
+    :param capacity: 每组最多点数，默认 ceil(n/days)(所有点都能分配，各组数量相差不超过1)；
+                     总容量不够时，按后悔值排在最后、容量用完时还没分配的点不分配(不一定是离中心点最远的点)，
+                     记录到 partition_stats 的 unassigned
+    :param max_iterations: 最多迭代次数，至少为 1
+    :return: 分组结果（列表的列表，每组第一个是中心点，其余按到中心点的距离升序）；组的顺序按中心点的下标
     """
+    # spatial_index 导入了本模块的 haversine_distance，在函数内导入避免循环导入
+    from spatial_index import KDTree
+
+    n = len(points)
+    days = min(int(days), n)
+    if days <= 0:
+        return []
+    capacity = max(1, int(capacity)) if capacity else -(-n // days)
+    max_iterations = max(1, int(max_iterations))
+    vectors = to_unit_vectors(points)
+    neighbours = KDTree(vectors).k_nearest(PARTITION_NEIGHBOURS)
+
+    # 初始中心点：最中心的点 + 最远点优先
+    medoids = [_medoid(vectors, np.arange(n))]
+    nearest_medoid = _distance_block(vectors, vectors[medoids])[:, 0]
+    while len(medoids) < days:
+        farthest = nearest_medoid.copy()
+        # 坐标重复时最远距离可能为 0，不能再选到已选的点
+        farthest[medoids] = -1
+        medoids.append(int(np.argmax(farthest)))
+        nearest_medoid = np.minimum(nearest_medoid, _distance_block(vectors, vectors[medoids[-1:]])[:, 0])
+
+    for _ in range(max_iterations):
+        costs = _distance_block(vectors, vectors[medoids])
+        labels = _capacitated_assign(costs, medoids, capacity)
+        labels = _improve_by_swaps(costs, neighbours, medoids, labels, capacity)
+        new_medoids = [_medoid(vectors, np.flatnonzero(labels == group)) for group in range(days)]
+        if new_medoids == medoids:
+            break
+        medoids = new_medoids
+
+    unassigned = int((labels < 0).sum())
+    partition_stats.record("partitions")
+    if unassigned:
+        print(f"⚠️  每天最多 {capacity} 个、共 {days} 天，{unassigned} 个点没有安排到任何一天")
+        partition_stats.record("unassigned", unassigned)
+    # 达到最多迭代次数时中心点已经更新，按新的中心点排序组内的点
+    costs = _distance_block(vectors, vectors[medoids])
+    clusters = []
+    for group, medoid in sorted(enumerate(medoids), key=lambda item: item[1]):
+        members = [int(i) for i in np.flatnonzero(labels == group) if i != medoid]
+        members.sort(key=lambda i: (costs[i, group], i))
+        clusters.append([medoid] + members)
+    return clusters
+
+
+# ---------------------- 餐饮分配：每天三餐按离当天景点/酒店的距离选餐厅 ----------------------
+MEAL_SLOTS = ("breakfast", "lunch", "dinner")
+
+
+def assign_meals(meal_points, day_points, day_hotels=None):
+    """
+    把餐厅分配到每天的早、中、晚三餐：午餐选离当天最近的景点最近的餐厅，早餐和晚餐选离当晚酒店最近的餐厅
+    (没有酒店时也按景点)。餐厅 × (全部景点 + 酒店) 的距离矩阵一次广播计算，
+    再按距离从小到大贪心分配，每家餐厅只用一次；餐厅不够时剩下的餐次选最近的餐厅(可以重复)
+    :param meal_points: 餐厅经纬度列表，格式[[lon1, lat1], [lon2, lat2], ...]
+    :param day_points: 每天景点的经纬度列表，格式[[[lon, lat], ...], ...]
+    :param day_hotels: 每天酒店的经纬度 [lon, lat]，没有酒店时为 None
+    :return: 每天 [早餐, 午餐, 晚餐] 的餐厅下标；没有餐厅时为空列表
+    """
+    days = len(day_points)
+    if not len(meal_points) or not days:
+        return [[] for _ in range(days)]
+    day_hotels = list(day_hotels) if day_hotels is not None else [None] * days
+
+    columns = [point for points in day_points for point in points] + [hotel for hotel in day_hotels if hotel]
+    distances = _distance_block(to_unit_vectors(meal_points), to_unit_vectors(columns)) if columns \
+        else np.empty((len(meal_points), 0))
+    # 餐厅到每天最近景点的距离(餐厅数 × 天数)，没有景点的一天为 inf
+    counts = np.array([len(points) for points in day_points])
+    near_attractions = np.full((len(meal_points), days), np.inf)
+    has_points = counts > 0
+    if has_points.any():
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[has_points]
+        near_attractions[:, has_points] = np.minimum.reduceat(distances[:, :counts.sum()], starts, axis=1)
+    near_hotels = near_attractions.copy()
+    hotel_days = [day for day, hotel in enumerate(day_hotels) if hotel]
+    near_hotels[:, hotel_days] = distances[:, counts.sum():]
+    # 餐次(天 × 3)的代价矩阵：餐厅数 × (天数 * 3)，第 day*3+k 列为第 day 天的第 k 餐
+    costs = np.stack([near_hotels, near_attractions, near_hotels], axis=2).reshape(len(meal_points), days * 3)
+
+    assignment = np.full(days * 3, -1)
+    used = np.zeros(len(meal_points), dtype=bool)
+    for flat in np.argsort(costs, axis=None, kind="stable").tolist():
+        meal, slot = divmod(flat, days * 3)
+        if used[meal] or assignment[slot] >= 0:
+            continue
+        assignment[slot] = meal
+        used[meal] = True
+        if used.all() or (assignment >= 0).all():
+            break
+    unfilled = assignment < 0
+    assignment[unfilled] = np.argmin(costs[:, unfilled], axis=0)
+    return assignment.reshape(days, 3).tolist()
+
+
+# ---------------------- 基准测试：python cluster.py ----------------------
+def _build_distance_matrix_loop(points, rows=None):
+    """原来的实现：逐对调用 haversine_distance，只用于对比；rows 指定时只计算前 rows 行"""
     n = len(points)
     dist_matrix = np.zeros((n, n))
-    for i in range(n):
+    for i in range(n if rows is None else rows):
         lon1, lat1 = points[i]
         for j in range(i + 1, n):
             lon2, lat2 = points[j]
@@ -49,41 +370,60 @@ def build_distance_matrix(points):
     return dist_matrix
 
 
-# ---------------------- 贪心聚类：每组最多3个点，组内距离最近 ----------------------
-def greedy_cluster(points, max_group_size=3):
-    """
-    贪心聚类算法：
-    1. 从未分组的点中选一个点作为种子
-    2. 找该点最近的k个点（k=max_group_size-1），组成一组
-    3. 重复直到所有点分组完成
-    :param points: 经纬度列表
-    :param max_group_size: 每组最大数量（默认3）
-    :return: 聚类结果（列表的列表，每个子列表是一组的点索引）
-    """
-    n = len(points)
-    if n == 0:
-        return []
+def _benchmark_distance_matrix(sizes=(10, 1000, 10000)):
+    import time
+
+    rng = np.random.default_rng(0)
+    print(f"{'n':>6} {'逐对循环':>12} {'向量化':>10} {'压缩上三角':>10} {'float32':>10} {'内存(float64/压缩float32)':>24}")
+    for n in sizes:
+        points = np.column_stack([rng.uniform(115.7, 117.4, n), rng.uniform(39.4, 41.0, n)]).tolist()
+        # 点数多时逐对循环太慢，只算前若干行，按计算量(上三角元素数)估算全部用时
+        rows = n if n <= 1000 else 100
+        start = time.perf_counter()
+        _build_distance_matrix_loop(points, rows)
+        loop_seconds = (time.perf_counter() - start) * (n * (n - 1) / 2) / (rows * n - rows * (rows + 1) / 2)
+        timings = []
+        for kwargs in ({}, {"condensed": True}, {"dtype": np.float32}):
+            start = time.perf_counter()
+            result = build_distance_matrix(points, **kwargs)
+            timings.append(time.perf_counter() - start)
+        memory = f"{n * n * 8 / 2 ** 20:.1f}MB/{n * (n - 1) / 2 * 4 / 2 ** 20:.1f}MB"
+        print(f"{n:>6} {loop_seconds * 1000:>10.1f}ms{'*' if rows < n else ' '} {timings[0] * 1000:>8.1f}ms "
+              f"{timings[1] * 1000:>8.1f}ms {timings[2] * 1000:>8.1f}ms {memory:>24}")
+        del result
+    print("* 按前100行的用时估算")
+
+
+def _benchmark_partition(sizes=(100, 1000, 10000, 50000), day_counts=(5, 30)):
+    """partition_days 的用时和峰值内存随点数的变化，以及原来的 n×n 距离矩阵需要的内存"""
+    import time
+    import tracemalloc
+
+    from spatial_index import KDTree
+
+    rng = np.random.default_rng(0)
+    print(f"{'n':>6} {'KD树近邻':>10} " + " ".join(f"{f'分组({days}天)':>10}" for days in day_counts)
+          + f" {'峰值内存':>10} {'n×n矩阵':>10}")
+    for n in sizes:
+        points = np.column_stack([rng.uniform(115.7, 117.4, n), rng.uniform(39.4, 41.0, n)]).tolist()
+        start = time.perf_counter()
+        KDTree(to_unit_vectors(points)).k_nearest(PARTITION_NEIGHBOURS)
+        timings = [time.perf_counter() - start]
+        for days in day_counts:
+            start = time.perf_counter()
+            partition_days(points, days)
+            timings.append(time.perf_counter() - start)
+        # tracemalloc 会拖慢运行，单独再分组一次统计峰值内存
+        tracemalloc.start()
+        partition_days(points, day_counts[0])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{n:>6} " + " ".join(f"{seconds * 1000:>10.0f}ms" for seconds in timings)
+              + f" {peak / 2 ** 20:>8.1f}MB {n * n * 8 / 2 ** 20:>8.1f}MB")
+    print(f"峰值内存为分组({day_counts[0]}天)时的统计")
 
-    # 构建距离矩阵
-    dist_matrix = build_distance_matrix(points)
-    # 记录点是否已分组
-    is_assigned = [False] * n
-    clusters = []
 
-    while not all(is_assigned):
-        # 选第一个未分组的点作为种子
-        seed = is_assigned.index(False)
-        # 找种子到所有未分组点的距离
-        unassigned_indices = [i for i in range(n) if not is_assigned[i]]
-        dist_to_seed = [(i, dist_matrix[seed][i]) for i in unassigned_indices]
-        # 按距离升序排序
-        dist_to_seed.sort(key=lambda x: x[1])
-        # 取前max_group_size个点组成组
-        group = [x[0] for x in dist_to_seed[:max_group_size]]
-        # 标记为已分组
-        for idx in group:
-            is_assigned[idx] = True
-        # 添加到聚类结果
-        clusters.append(group)
-
-    return clusters
\ No newline at end of file
+if __name__ == '__main__':
+    _benchmark_distance_matrix()
+    print()
+    _benchmark_partition()
@@ -0,0 +1,160 @@
+"""
+并发检查：N 个 /trip 请求同时发出，总用时应接近单个请求的用时，而不是 N 倍。
+
+所有 Agent 都替换为按固定延迟返回固定消息的假 Agent，不需要高德和 LLM 密钥。
+假 Agent 的同步 invoke 会阻塞线程，如果流水线里还有同步调用，N 个请求的总用时会接近 N 倍。
+
+默认检查按天规划 + 紧凑格式(PLANNER_MODE=per_day, PLANNER_PROMPT_FORMAT=compact，即服务的默认配置)，
+以及一次生成整个行程 + 完整格式(trip/full)两种路径。
+
+用法: python concurrency_check.py [并发数] [单次Agent调用延迟秒数] [per_day/compact,trip/full]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+
+# 不读写持久化缓存，每个请求都完整执行规划
+os.environ.setdefault("TRIP_CACHE_PATH", "")
+import main
+
+REQUEST = {
+    "city": "北京",
+    "start_date": "2025-12-20",
+    "end_date": "2025-12-21",
+    "travel_days": 2,
+    "transportation": "公共交通",
+    "accommodation": "经济型",
+    "preferences": ["历史文化"],
+    "free_text_input": "",
+    "bypass_cache": True
+}
+
+
+def tool_message(content: dict) -> ToolMessage:
+    return ToolMessage(content=[{"type": "text", "text": json.dumps(content, ensure_ascii=False)}],
+                       tool_call_id="fake")
+
+
+ATTRACTIONS = [
+    tool_message({"id": f"A{i}", "name": f"景点{i}", "location": f"{116.39 + i * 0.01:.6f},{39.91 + i * 0.01:.6f}",
+                  "address": f"地址{i}", "type": "风景名胜", "photo": "", "cost": "", "opentime2": "08:00-17:00",
+                  "level": "AAAAA", "rating": "4.8"})
+    for i in range(6)
+]
+WEATHER = [tool_message({"city": "北京市", "forecasts": [
+    {"date": date, "week": "6", "dayweather": "晴", "nightweather": "多云", "daytemp": "5", "nighttemp": "-3",
+     "daywind": "北", "nightwind": "北", "daypower": "1-3", "nightpower": "1-3"}
+    for date in ("2025-12-20", "2025-12-21")]})]
+HOTELS = [tool_message({"id": "H0", "name": "如家酒店", "location": "116.452186,39.871213", "address": "华威南路",
+                        "type": "住宿服务;宾馆酒店;经济型连锁酒店", "rating": "4.6"})]
+MEALS = [tool_message({"id": "M0", "name": "全聚德", "location": "116.398455,39.918509", "address": "前门大街",
+                       "type": "餐饮服务;中餐厅", "rating": "4.5", "meal_ordering": "1"})]
+PLAN = {
+    "city": "北京", "start_date": "2025-12-20", "end_date": "2025-12-21",
+    "days": [{"date": "2025-12-20", "day_index": 0, "description": "第1天", "transportation": "公共交通",
+              "accommodation": "经济型"}],
+    "weather_info": [], "overall_suggestions": "注意保暖"
+}
+DAY_PLAN = {
+    "day_index": 0, "description": "第1天", "hotel_id": "H1", "attraction_ids": ["A1", "A2", "A3"],
+    "meals": [{"type": "lunch", "id": "M1", "description": "烤鸭", "estimated_cost": 150}]
+}
+
+
+class FakeAgent:
+    """按固定延迟返回固定消息的假 Agent"""
+
+    def __init__(self, messages, delay):
+        self.messages = messages
+        self.delay = delay
+
+    def _response(self, input):
+        query = input["messages"][-1]["content"]
+        return {"messages": [HumanMessage(content=query), *self.messages]}
+
+    async def ainvoke(self, input, *args, **kwargs):
+        await asyncio.sleep(self.delay)
+        return self._response(input)
+
+    def invoke(self, input, *args, **kwargs):
+        time.sleep(self.delay)
+        return self._response(input)
+
+    async def astream(self, input, *args, **kwargs):
+        await asyncio.sleep(self.delay)
+        for message in self._response(input)["messages"][1:]:
+            for i in range(0, len(message.content), 16):
+                yield AIMessageChunk(content=message.content[i:i + 16]), {"langgraph_node": "model"}
+
+
+class FakeLLM:
+    """总体建议直接调用 llm.ainvoke"""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        await asyncio.sleep(self.delay)
+        return AIMessage(content="注意保暖")
+
+
+class FakeTripPlanner(main.MultiAgentTripPlanner):
+    def __init__(self, delay, planner_mode="per_day", planner_prompt_format="compact"):
+        self.llm = FakeLLM(delay)
+        self.hotel_search_concurrency = 5
+        self.tool_mode = "agent"
+        self.planner_prompt_format = planner_prompt_format
+        self.planner_token_report = False
+        self.planner_mode = planner_mode
+        self.planner_day_concurrency = 10
+        self.attractions_per_day = None
+        self.route_planner = main.RoutePlanner(main.DirectToolClient([]), main.get_route_leg_cache(), mode="local")
+        self._build_retry_policies()
+        self.attraction_agent = FakeAgent(ATTRACTIONS, delay)
+        self.weather_agent = FakeAgent(WEATHER, delay)
+        self.hotel_agent = FakeAgent(HOTELS, delay)
+        self.meal_agent = FakeAgent(MEALS, delay)
+        plan = PLAN if planner_prompt_format == "full" else {"days": [DAY_PLAN], "overall_suggestions": "注意保暖"}
+        self.planner_agent = FakeAgent([AIMessage(content=f"```json\n{json.dumps(plan, ensure_ascii=False)}\n```")],
+                                       delay)
+        self.day_planner_agent = FakeAgent([AIMessage(content=json.dumps(DAY_PLAN, ensure_ascii=False))], delay)
+
+
+async def run_requests(client, concurrency):
+    start = time.perf_counter()
+    responses = await asyncio.gather(*(client.post("/trip", json=REQUEST) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    assert all(response.status_code == 200 for response in responses), [r.text for r in responses]
+    return elapsed
+
+
+async def check(concurrency=8, delay=0.5, planner_mode="per_day", planner_prompt_format="compact"):
+    print(f"\n=== {planner_mode}/{planner_prompt_format} ===")
+    planner = FakeTripPlanner(delay, planner_mode, planner_prompt_format)
+
+    async def acquire():
+        return planner
+
+    main.registry.acquire = acquire
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        single = await run_requests(client, 1)
+        concurrent = await run_requests(client, concurrency)
+    ratio = concurrent / single
+    print(f"\n单个请求用时: {single:.3f}s")
+    print(f"{concurrency} 个并发请求用时: {concurrent:.3f}s (单个请求的 {ratio:.2f} 倍)")
+    # 允许一定的调度开销，但远小于串行执行的 N 倍
+    assert ratio < 1.5, f"并发请求用时是单个请求的 {ratio:.2f} 倍，事件循环可能被同步调用阻塞"
+    print("✅ 并发检查通过")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    modes = args[2] if len(args) > 2 else "per_day/compact,trip/full"
+    for mode in modes.split(","):
+        asyncio.run(check(int(args[0]) if args else 8, float(args[1]) if len(args) > 1 else 0.5, *mode.split("/")))
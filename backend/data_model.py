@@ -1,3 +1,5 @@
+import hashlib
+import json
 from typing import TypedDict, Annotated, List, Optional
 from pydantic import BaseModel, Field, field_validator
 
@@ -15,6 +17,7 @@ class Attraction(BaseModel):
     rating: float = Field(default=0.0, ge=0, le=5, description="评分，范围0-5")
     image_url: Optional[str] = Field(default=None, description="图片URL")
     ticket_price: int = Field(description="票价")
+    id: Optional[str] = Field(default=None, description="高德POI ID")
 
 
 class Meal(BaseModel):
@@ -26,6 +29,7 @@ class Meal(BaseModel):
     description: Optional[str] = Field(default=None,description="描述")
     estimated_cost: int = Field(default=0,description="预估费用(元)")
     rating: float = Field(default=0.0, ge=0, le=5, description="评分，范围0-5")
+    id: Optional[str] = Field(default=None,description="高德POI ID")
 
 
 class Hotel(BaseModel):
@@ -38,6 +42,7 @@ class Hotel(BaseModel):
     distance: str = Field(default="",description="距离景点距离")
     type: str = Field(default="",description="酒店类型")
     estimated_cost: int = Field(default=0,description="预估费用(元/晚)")
+    id: Optional[str] = Field(default=None,description="高德POI ID")
 
 
 class Budget(BaseModel):
@@ -49,6 +54,15 @@ class Budget(BaseModel):
     total: int = Field(default=0,description="总费用")
 
 
+class RouteLeg(BaseModel):
+    """路线中相邻两站之间的一段"""
+    origin: str = Field(...,description="出发地名称")
+    destination: str = Field(...,description="目的地名称")
+    distance: int = Field(default=0,description="距离(米)")
+    duration: int = Field(default=0,description="预计用时(秒)")
+    source: str = Field(default="estimate",description="amap: 高德路线查询结果；estimate: 按直线距离估算")
+
+
 class DayPlan(BaseModel):
     """单日行程"""
     date: str = Field(...,description="日期")
@@ -59,6 +73,7 @@ class DayPlan(BaseModel):
     hotel: Optional[Hotel] = Field(default=None,description="酒店信息")
     attractions: List[Attraction] = Field(default_factory=list,description="景点列表")
     meals: List[Meal] = Field(default_factory=list,description="餐饮安排")
+    route: List[RouteLeg] = Field(default_factory=list,description="按游览顺序的路线(酒店 → 各景点 → 酒店)，由系统生成")
 
 
 class WeatherInfo(BaseModel):
@@ -93,6 +108,28 @@ class TripRequest(BaseModel):
     accommodation: str = Field(..., description="住宿偏好")
     preferences: List[str] = Field(default=[], description="旅行偏好标签")
     free_text_input: Optional[str] = Field(default="", description="额外要求")
+    bypass_cache: bool = Field(default=False, description="跳过结果缓存重新规划（新结果仍会写入缓存）")
+    deadline_seconds: Optional[float] = Field(default=None, gt=0, description="规划的截止秒数，超过后取消规划，不能超过服务端配置的 TRIP_DEADLINE_SECONDS")
+
+    def normalized_key(self) -> str:
+        """
+        规范化后的请求指纹：忽略首尾空白、大小写、城市名的“市”后缀以及偏好标签的顺序和重复，
+        内容相同的请求得到相同的指纹
+        """
+        city = self.city.strip().lower()
+        if city.endswith("市") and len(city) > 1:
+            city = city[:-1]
+        normalized = {
+            "city": city,
+            "start_date": self.start_date.strip(),
+            "end_date": self.end_date.strip(),
+            "travel_days": self.travel_days,
+            "transportation": self.transportation.strip().lower(),
+            "accommodation": self.accommodation.strip().lower(),
+            "preferences": sorted({preference.strip().lower() for preference in self.preferences if preference.strip()}),
+            "free_text_input": " ".join((self.free_text_input or "").split()),
+        }
+        return hashlib.sha256(json.dumps(normalized, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
 
 
 class TripPlan(BaseModel):
@@ -105,3 +142,38 @@ class TripPlan(BaseModel):
     overall_suggestions: str = Field(...,description="总体建议")
     budget: Optional[Budget] = Field(default=None,description="预算信息")
 
+
+class PlannedMeal(BaseModel):
+    """行程规划Agent输出的餐饮安排(用短ID引用美食)"""
+    type: str = Field(...,description="餐饮类型：breakfast/lunch/dinner/snack")
+    id: str = Field(...,description="美食短ID，如 M1")
+    description: Optional[str] = Field(default=None,description="描述")
+    estimated_cost: int = Field(default=0,description="预估费用(元)")
+
+
+class PlannedDay(BaseModel):
+    """行程规划Agent输出的单日行程(用短ID引用景点、酒店)"""
+    day_index: int = Field(...,description="第几天(从0开始)")
+    description: str = Field(...,description="当日行程描述")
+    hotel_id: Optional[str] = Field(default=None,description="酒店短ID，如 H1")
+    attraction_ids: List[str] = Field(default_factory=list,description="景点短ID列表，按游览顺序")
+    meals: List[PlannedMeal] = Field(default_factory=list,description="餐饮安排")
+
+
+class PlannerOutput(BaseModel):
+    """行程规划Agent的紧凑输出，由 PlannerCatalog.rehydrate 还原为 TripPlan"""
+    days: List[PlannedDay] = Field(default_factory=list,description="每日行程")
+    overall_suggestions: str = Field(default="",description="总体建议")
+    budget: Optional[Budget] = Field(default=None,description="预算信息")
+
+
+class TripJob(BaseModel):
+    """异步旅行规划任务"""
+    job_id: str = Field(...,description="任务ID")
+    status: str = Field(...,description="任务状态：pending/running/succeeded/failed")
+    created_at: float = Field(...,description="创建时间(unix时间戳)")
+    started_at: Optional[float] = Field(default=None,description="开始执行时间(unix时间戳)")
+    finished_at: Optional[float] = Field(default=None,description="结束时间(unix时间戳)")
+    subscribers: int = Field(default=1,description="提交了相同请求并复用该任务的次数")
+    result: Optional[TripPlan] = Field(default=None,description="旅行计划，任务成功后才有")
+    error: Optional[str] = Field(default=None,description="失败原因")
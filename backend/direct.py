@@ -0,0 +1,92 @@
+import asyncio
+import json
+import time
+import uuid
+from typing import Dict, List
+
+from langchain_core.messages import ToolMessage
+
+
+class DirectToolClient:
+    """
+    直接调用高德MCP工具：结构化查询（天气、POI搜索和详情）用构造好的参数直接调用工具，
+    不经过 Agent 的多轮 LLM 决策。返回的 ToolMessage 与 Agent 消息格式相同，可以直接交给 parse_info 中的解析函数。
+    """
+
+    def __init__(self, tools):
+        self.tools = {tool.name: tool for tool in tools}
+
+    def supports(self, *tool_names) -> bool:
+        return all(tool_name in self.tools for tool_name in tool_names)
+
+    async def call(self, tool_name: str, **arguments) -> ToolMessage:
+        tool_call = {"name": tool_name, "args": arguments, "id": f"direct_{uuid.uuid4().hex}", "type": "tool_call"}
+        return await self.tools[tool_name].ainvoke(tool_call)
+
+    @staticmethod
+    def _poi_ids(message: ToolMessage, limit: int) -> List[str]:
+        content = json.loads(message.content[0].get('text'))
+        return [poi["id"] for poi in content.get("pois", []) if poi.get("id")][:limit]
+
+    async def _details(self, poi_ids: List[str]) -> List[ToolMessage]:
+        """并发查询POI详情，单个失败不影响其他"""
+        details = await asyncio.gather(*(self.call("maps_search_detail", id=poi_id) for poi_id in poi_ids),
+                                       return_exceptions=True)
+        messages = []
+        for poi_id, detail in zip(poi_ids, details):
+            if isinstance(detail, Exception):
+                print(f"⚠️  查询POI {poi_id} 详情失败: {str(detail)}")
+                continue
+            messages.append(detail)
+        return messages
+
+    async def search_details(self, keywords: str, city: str, limit: int) -> List[ToolMessage]:
+        """关键字搜索，再查询前 limit 个结果的详情"""
+        search_message = await self.call("maps_text_search", keywords=keywords, city=city)
+        return [search_message, *await self._details(self._poi_ids(search_message, limit))]
+
+    async def weather(self, city: str) -> List[ToolMessage]:
+        return [await self.call("maps_weather", city=city)]
+
+    async def distance(self, origins: List[str], destination: str, type: str) -> ToolMessage:
+        """多个起点到同一终点的距离和用时，一次调用(type: 1 驾车，3 步行)"""
+        return await self.call("maps_distance", origins="|".join(origins), destination=destination, type=type)
+
+    async def transit(self, origin: str, destination: str, city: str) -> ToolMessage:
+        """同城公共交通路线"""
+        return await self.call("maps_direction_transit_integrated", origin=origin, destination=destination,
+                               city=city, cityd=city)
+
+
+class ToolModeStats:
+    """记录直接调用模式和 Agent 模式各阶段的耗时和 LLM token 用量，便于对比"""
+
+    def __init__(self):
+        # (阶段, 模式) -> {"calls", "seconds", "tokens"}
+        self.records: Dict[tuple, Dict[str, float]] = {}
+        # 阶段 -> 直接调用失败后回退到 Agent 的次数
+        self.fallbacks: Dict[str, int] = {}
+
+    def record(self, stage: str, mode: str, seconds: float, tokens: int):
+        record = self.records.setdefault((stage, mode), {"calls": 0, "seconds": 0.0, "tokens": 0})
+        record["calls"] += 1
+        record["seconds"] += seconds
+        record["tokens"] += tokens
+
+    def fallback(self, stage: str):
+        self.fallbacks[stage] = self.fallbacks.get(stage, 0) + 1
+
+    def stats(self) -> dict:
+        stages = {}
+        for (stage, mode), record in self.records.items():
+            stages.setdefault(stage, {})[mode] = {
+                "calls": record["calls"],
+                "avg_seconds": round(record["seconds"] / record["calls"], 3),
+                "avg_tokens": round(record["tokens"] / record["calls"], 1),
+            }
+        for stage, count in self.fallbacks.items():
+            stages.setdefault(stage, {})["fallbacks"] = count
+        return stages
+
+
+tool_mode_stats = ToolModeStats()
@@ -0,0 +1,164 @@
+from datetime import date, timedelta
+from typing import Dict, List
+
+from data_model import Attraction, DayPlan, Hotel, Meal, PlannedDay, PlannerOutput, TripPlan, TripRequest, WeatherInfo
+
+_tiktoken_encoding = None
+_tiktoken_unavailable = False
+
+
+def count_text_tokens(text: str) -> int:
+    """
+    统计文本的 token 数：优先使用 tiktoken(cl100k_base)，
+    无法加载(例如离线环境下载不到编码文件)时按每个中文字符 1 个、其他字符 4 个 1 个估算
+    """
+    global _tiktoken_encoding, _tiktoken_unavailable
+    if _tiktoken_encoding is None and not _tiktoken_unavailable:
+        try:
+            import tiktoken
+            _tiktoken_encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _tiktoken_unavailable = True
+    if _tiktoken_encoding is not None:
+        return len(_tiktoken_encoding.encode(text))
+    cjk = sum(1 for char in text if '一' <= char <= '鿿')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _short_type(type_text: str) -> str:
+    """高德分类 "风景名胜;风景名胜;世界遗产" 只保留最后一级"""
+    parts = [part for part in (type_text or "").split(";") if part]
+    return parts[-1] if parts else ""
+
+
+def _location(location) -> str:
+    # 保留 4 位小数(约 10 米)，足够判断远近
+    return f"{location.longitude:.4f},{location.latitude:.4f}" if location else ""
+
+
+class PlannerCatalog:
+    """
+    行程规划Agent输入的紧凑编码：景点、酒店、美食分配短ID(A1/H1/M1)，每类一个表头 + 每行一条记录，
+    去掉图片URL、开放时间、地址等规划用不到的字段。Agent 的输出只用ID引用，再由 rehydrate 在本地还原为完整的 TripPlan。
+    """
+
+    def __init__(self, attractions: List[Attraction], weathers: List[WeatherInfo], hotels: List[Hotel],
+                 meals: List[Meal]):
+        self.attractions: Dict[str, Attraction] = {f"A{i + 1}": item for i, item in enumerate(attractions)}
+        self.hotels: Dict[str, Hotel] = {f"H{i + 1}": item for i, item in enumerate(hotels)}
+        self.meals: Dict[str, Meal] = {f"M{i + 1}": item for i, item in enumerate(meals)}
+        self.weathers = weathers
+        self._short_ids = {id(item): short_id
+                           for items in (self.attractions, self.hotels, self.meals)
+                           for short_id, item in items.items()}
+
+    def short_id(self, item):
+        """返回景点/酒店/美食对象的短ID，不在目录中时返回 None"""
+        return self._short_ids.get(id(item))
+
+    @staticmethod
+    def _select(items: dict, ids=None) -> dict:
+        return items if ids is None else {short_id: items[short_id] for short_id in ids if short_id in items}
+
+    def encode_attractions(self, ids=None) -> str:
+        lines = ["id|名称|类别|评分|门票|经纬度"]
+        for short_id, attraction in self._select(self.attractions, ids).items():
+            lines.append(f"{short_id}|{attraction.name}|{_short_type(attraction.category)}|{attraction.rating:g}|"
+                         f"{attraction.ticket_price}|{_location(attraction.location)}")
+        return "\n".join(lines)
+
+    def encode_hotels(self, ids=None) -> str:
+        lines = ["id|名称|评分|每晚价格|经纬度"]
+        for short_id, hotel in self._select(self.hotels, ids).items():
+            lines.append(f"{short_id}|{hotel.name}|{hotel.rating}|{hotel.estimated_cost}|{_location(hotel.location)}")
+        return "\n".join(lines)
+
+    def encode_meals(self, ids=None) -> str:
+        lines = ["id|名称|类别|评分|经纬度"]
+        for short_id, meal in self._select(self.meals, ids).items():
+            lines.append(f"{short_id}|{meal.name}|{_short_type(meal.type)}|{meal.rating:g}|{_location(meal.location)}")
+        return "\n".join(lines)
+
+    def encode_weathers(self, dates=None) -> str:
+        lines = ["日期|白天|夜间|最高温|最低温|风"]
+        for weather in self.weathers:
+            if dates is not None and weather.date not in dates:
+                continue
+            lines.append(f"{weather.date}|{weather.day_weather}|{weather.night_weather}|{weather.day_temp}|"
+                         f"{weather.night_temp}|{weather.wind_direction}{weather.wind_power}")
+        return "\n".join(lines)
+
+    def rehydrate_day(self, planned_day: PlannedDay, request: TripRequest) -> DayPlan:
+        """把只含短ID的单日规划还原为完整的 DayPlan，未知的ID会被丢弃"""
+        start = date.fromisoformat(request.start_date)
+        attractions = []
+        for attraction_id in planned_day.attraction_ids:
+            if attraction_id in self.attractions:
+                attractions.append(self.attractions[attraction_id])
+            else:
+                print(f"⚠️  行程规划引用了不存在的景点ID: {attraction_id}")
+        meals = []
+        for planned_meal in planned_day.meals:
+            if planned_meal.id not in self.meals:
+                print(f"⚠️  行程规划引用了不存在的美食ID: {planned_meal.id}")
+                continue
+            meals.append(self.meals[planned_meal.id].model_copy(update={
+                "type": planned_meal.type,
+                "description": planned_meal.description,
+                # Agent 没有给出费用时使用搜索结果中的人均消费
+                "estimated_cost": planned_meal.estimated_cost or self.meals[planned_meal.id].estimated_cost,
+            }))
+        if planned_day.hotel_id and planned_day.hotel_id not in self.hotels:
+            print(f"⚠️  行程规划引用了不存在的酒店ID: {planned_day.hotel_id}")
+        return DayPlan(
+            date=(start + timedelta(days=planned_day.day_index)).isoformat(),
+            day_index=planned_day.day_index,
+            description=planned_day.description,
+            transportation=request.transportation,
+            accommodation=request.accommodation,
+            hotel=self.hotels.get(planned_day.hotel_id) if planned_day.hotel_id else None,
+            attractions=attractions,
+            meals=meals,
+        )
+
+    def rehydrate(self, planner_output: PlannerOutput, request: TripRequest) -> TripPlan:
+        """把只含短ID的规划结果还原为完整的 TripPlan"""
+        return TripPlan(
+            city=request.city,
+            start_date=request.start_date,
+            end_date=request.end_date,
+            days=[self.rehydrate_day(planned_day, request) for planned_day in planner_output.days],
+            weather_info=self.weathers,
+            overall_suggestions=planner_output.overall_suggestions,
+            budget=planner_output.budget,
+        )
+
+
+def compare_token_counts(attractions, weathers, hotels, meals) -> dict:
+    """对比原始 repr 格式和紧凑编码的 token 数"""
+    catalog = PlannerCatalog(attractions, weathers, hotels, meals)
+    full = count_text_tokens("\n".join(str(items) for items in (attractions, weathers, hotels, meals)))
+    compact = count_text_tokens("\n".join((catalog.encode_attractions(), catalog.encode_weathers(),
+                                           catalog.encode_hotels(), catalog.encode_meals())))
+    return {"full": full, "compact": compact, "saved": round(1 - compact / full, 4) if full else 0.0}
+
+
+if __name__ == '__main__':
+    from parse_info import build_attraction, build_hotel, build_meal, build_weather
+
+    attraction = build_attraction({
+        "id": "B000A7O1CU", "name": "颐和园", "location": "116.275179,39.999617", "address": "新建宫门路19号",
+        "type": "风景名胜;风景名胜;世界遗产",
+        "photo": "http://store.is.autonavi.com/showpic/a4b326f43a84d36b581d7f6e856fe858", "cost": "",
+        "opentime2": "旺季:4月1日至10月31日:06:00-20:00(19:00停止进入)；淡季:11月1日至3月31日:06:30-19:00(18:00停止进入)",
+        "level": "AAAAA", "rating": "4.9"})
+    weather = build_weather({"date": "2025-12-15", "dayweather": "阴", "nightweather": "多云", "daytemp": "12",
+                             "nighttemp": "5", "daywind": "南", "daypower": "1-3"})
+    hotel = build_hotel({"name": "如家酒店(北京潘家园店)", "location": "116.452186,39.871213",
+                         "address": "华威南路弘善家园304号", "type": "住宿服务;宾馆酒店;经济型连锁酒店", "rating": "4.6"},
+                        "颐和园", "经济型")
+    meal = build_meal({"name": "景运门故宫餐厅", "location": "116.398455,39.918509",
+                       "address": "故宫博物院内(保和殿东侧景运门外、钟表馆对面)", "type": "餐饮服务;中餐厅;中餐厅",
+                       "rating": "3.9"})
+    n = 9
+    print(compare_token_counts([attraction] * n, [weather] * 3, [hotel] * 3, [meal] * n))
@@ -0,0 +1,134 @@
+"""
+脚本化的假聊天模型，用于压测(LLM_MODEL_ID=fake)：按规则匹配最后一条输入消息生成回复，
+首个 token 前等待固定延迟，之后按设定的速度流式输出，不访问任何 LLM 服务。
+
+默认规则覆盖按天规划(PLANNER_MODE=per_day)的单日行程、紧凑格式(PLANNER_PROMPT_FORMAT=compact)的整体行程、
+总体建议和旅行手册；FAKE_LLM_SCRIPT 指定的 JSON 文件 [{"pattern": 正则, "response": 回复}] 优先匹配。
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Any, Callable, List, Tuple, Union
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+Responder = Union[str, Callable[[re.Match, str], str]]
+
+
+def _short_ids(query: str, prefix: str) -> List[str]:
+    """从紧凑编码的表格(id|名称|...)中取出短ID"""
+    return re.findall(rf"^({prefix}\d+)\|", query, flags=re.MULTILINE)
+
+
+def _planned_day(day_index: int, attraction_ids, hotel_ids, meal_ids) -> dict:
+    meals = [{"type": meal_type, "id": meal_id, "description": "当地特色", "estimated_cost": 60}
+             for meal_type, meal_id in zip(("breakfast", "lunch", "dinner"), meal_ids)]
+    return {"day_index": day_index, "description": f"第{day_index + 1}天游览{len(attraction_ids)}个景点",
+            "hotel_id": hotel_ids[0] if hotel_ids else None, "attraction_ids": attraction_ids, "meals": meals}
+
+
+def _day_plan(match: re.Match, query: str) -> str:
+    return json.dumps(_planned_day(int(match.group(1)), _short_ids(query, "A")[:3], _short_ids(query, "H"),
+                                   _short_ids(query, "M")), ensure_ascii=False)
+
+
+def _trip_plan(match: re.Match, query: str) -> str:
+    travel_days = int(match.group(1))
+    attraction_ids, hotel_ids, meal_ids = _short_ids(query, "A"), _short_ids(query, "H"), _short_ids(query, "M")
+    # 按查询中的“每日景点”分组安排，没有时轮流分配
+    assigned = {int(day) - 1: re.findall(r"A\d+", ids)
+                for day, ids in re.findall(r"^第(\d+)天: (.*)$", query, flags=re.MULTILINE)}
+    days = [_planned_day(day, assigned.get(day, attraction_ids[day::travel_days][:3]),
+                         hotel_ids[day:day + 1] or hotel_ids[:1], meal_ids[day * 3:day * 3 + 3])
+            for day in range(travel_days)]
+    return "```json\n" + json.dumps({"days": days, "overall_suggestions": "注意天气变化，合理安排行程。"},
+                                    ensure_ascii=False) + "\n```"
+
+
+DEFAULT_RULES: List[Tuple[str, Responder]] = [
+    (r"day_index为(\d+)", _day_plan),
+    (r"的(\d+)天计划", _trip_plan),
+    (r"每日行程:", "注意天气变化，合理安排行程，热门景点建议提前预约。"),
+    (r"数据内容:", "```html\n<!DOCTYPE html><html><body><h1>旅行手册</h1></body></html>\n```"),
+]
+
+
+def load_rules(path: str) -> List[Tuple[str, Responder]]:
+    with open(path, encoding="utf-8") as file:
+        return [(rule["pattern"], rule["response"]) for rule in json.load(file)]
+
+
+class ScriptedChatModel(BaseChatModel):
+    """按规则生成回复的假聊天模型，绑定工具和 response_format 时原样返回自身"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    rules: List[Tuple[str, Any]] = DEFAULT_RULES
+    # 首个 token 前的等待秒数
+    latency: float = 1.0
+    # 流式输出速度(token/秒，按2个字符一个token估算)，为 0 时一次输出
+    tokens_per_second: float = 0.0
+    chunk_size: int = 8
+
+    @classmethod
+    def from_env(cls) -> "ScriptedChatModel":
+        """从 FAKE_LLM_LATENCY、FAKE_LLM_TOKENS_PER_SECOND、FAKE_LLM_SCRIPT 读取配置"""
+        rules = DEFAULT_RULES
+        if os.getenv("FAKE_LLM_SCRIPT"):
+            rules = load_rules(os.getenv("FAKE_LLM_SCRIPT")) + DEFAULT_RULES
+        return cls(rules=rules, latency=float(os.getenv("FAKE_LLM_LATENCY", 1.0)),
+                   tokens_per_second=float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", 0)))
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _reply(self, messages: List[BaseMessage]) -> AIMessage:
+        query = messages[-1].content if isinstance(messages[-1].content, str) else str(messages[-1].content)
+        content = "好的。"
+        for pattern, responder in self.rules:
+            match = re.search(pattern, query)
+            if match is not None:
+                content = responder if isinstance(responder, str) else responder(match, query)
+                break
+        input_tokens = sum(len(str(message.content)) for message in messages) // 2
+        output_tokens = max(1, len(content) // 2)
+        return AIMessage(content=content, usage_metadata={"input_tokens": input_tokens, "output_tokens": output_tokens,
+                                                          "total_tokens": input_tokens + output_tokens})
+
+    def _generation_seconds(self, message: AIMessage) -> float:
+        if self.tokens_per_second <= 0:
+            return 0.0
+        return message.usage_metadata["output_tokens"] / self.tokens_per_second
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._reply(messages)
+        time.sleep(self.latency + self._generation_seconds(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._reply(messages)
+        await asyncio.sleep(self.latency + self._generation_seconds(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._reply(messages)
+        await asyncio.sleep(self.latency)
+        content = message.content
+        chunk_seconds = self._generation_seconds(message) * self.chunk_size / max(1, len(content))
+        for i in range(0, len(content), self.chunk_size):
+            if chunk_seconds > 0:
+                await asyncio.sleep(chunk_seconds)
+            chunk = AIMessageChunk(content=content[i:i + self.chunk_size])
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=message.usage_metadata))
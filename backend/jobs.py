@@ -0,0 +1,134 @@
+import asyncio
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from data_model import TripJob, TripRequest
+
+
+@dataclass
+class Job:
+    """旅行规划任务"""
+    id: str
+    key: str
+    request: TripRequest
+    status: str = "pending"
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    subscribers: int = 1
+    result: Any = None
+    error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def to_model(self) -> TripJob:
+        return TripJob(
+            job_id=self.id,
+            status=self.status,
+            created_at=self.created_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            subscribers=self.subscribers,
+            result=self.result,
+            error=self.error,
+        )
+
+
+class JobManager:
+    """
+    异步任务管理：固定数量的 worker 从队列中取任务执行。
+    规范化后相同的请求（TripRequest.normalized_key）如果已有排队或执行中的任务，直接复用该任务（singleflight）。
+    """
+
+    def __init__(self, runner: Callable[[TripRequest], Awaitable[Any]], workers=None, retention_seconds=None):
+        """
+        Args:
+            runner: 执行单个请求的协程函数，返回旅行计划，失败时抛出异常
+            workers: worker 数量，默认读取 TRIP_WORKERS（默认 4）
+            retention_seconds: 已结束任务的保留时间，默认读取 TRIP_JOB_RETENTION_SECONDS（默认 3600）
+        """
+        self.runner = runner
+        self.workers = max(1, int(workers if workers is not None else os.getenv("TRIP_WORKERS", 4)))
+        self.retention_seconds = float(retention_seconds if retention_seconds is not None
+                                       else os.getenv("TRIP_JOB_RETENTION_SECONDS", 3600))
+        self.jobs: Dict[str, Job] = {}
+        self.deduplicated_count = 0
+        # 规范化请求指纹 -> 排队或执行中的任务
+        self._inflight: Dict[str, Job] = {}
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker_tasks = []
+
+    async def start(self):
+        self._worker_tasks = [asyncio.create_task(self._worker(), name=f"trip-worker-{i}")
+                              for i in range(self.workers)]
+        print(f"✅ 启动 {self.workers} 个旅行规划 worker")
+
+    async def close(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def submit(self, request: TripRequest) -> Job:
+        """提交任务；相同请求的任务仍在排队或执行时返回已有任务"""
+        self._prune()
+        key = request.normalized_key()
+        job = self._inflight.get(key)
+        if job is not None:
+            job.subscribers += 1
+            self.deduplicated_count += 1
+            print(f"♻️  复用进行中的任务 {job.id}")
+            return job
+
+        job = Job(id=uuid.uuid4().hex, key=key, request=request)
+        self.jobs[job.id] = job
+        self._inflight[key] = job
+        self._queue.put_nowait(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.result = await self.runner(job.request)
+                job.status = "succeeded"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "failed"
+            except asyncio.CancelledError:
+                # 服务关闭时 close() 取消 worker，CancelledError 不是 Exception，需要单独把任务标记为失败
+                job.error = "cancelled at shutdown"
+                job.status = "failed"
+                raise
+            finally:
+                job.finished_at = time.time()
+                self._inflight.pop(job.key, None)
+                self._queue.task_done()
+
+    def _prune(self):
+        """清理超过保留时间的已结束任务"""
+        expire_before = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job.finished and job.finished_at < expire_before]:
+            del self.jobs[job_id]
+
+    def stats(self) -> dict:
+        statuses = {}
+        for job in self.jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "deduplicated": self.deduplicated_count,
+            "jobs": statuses,
+        }
@@ -0,0 +1,212 @@
+"""
+压测：启动本地模拟的高德MCP Server(mock_amap_server.py)和使用假聊天模型(LLM_MODEL_ID=fake)的后端，
+按逐步增加的并发数持续发送 /trip 请求，输出每个并发数下的吞吐量、p50/p95/p99 延迟、
+/health 的响应延迟(反映事件循环是否被阻塞)和后端进程的内存峰值(RSS)，用于评估单个后端进程的容量。
+
+用法:
+    python loadtest.py [--levels 1,2,4,8,16,32] [--rounds 3] [--llm-latency 1] [--amap-latency 0.2]
+    python loadtest.py --url http://127.0.0.1:8000 --pid 12345    压测已启动的后端(--pid 用于读取内存)
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+import httpx
+
+# 模拟高德MCP Server的天气预报从今天开始，请求日期也从明天开始
+START_DATE = date.today() + timedelta(days=1)
+REQUEST = {
+    "city": "北京",
+    "start_date": START_DATE.isoformat(),
+    "end_date": (START_DATE + timedelta(days=2)).isoformat(),
+    "travel_days": 3,
+    "transportation": "公共交通",
+    "accommodation": "经济型",
+    "preferences": ["历史文化"],
+    "free_text_input": "",
+    "bypass_cache": True
+}
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def rss_mb(pid):
+    """进程的常驻内存(MB)，只支持 Linux，读取失败时返回 None"""
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+async def wait_until_ready(client, url, process=None, timeout=60):
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"后端进程已退出，退出码 {process.returncode}")
+        try:
+            if (await client.get(f"{url}/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} 在 {timeout} 秒内没有就绪")
+
+
+def wait_for_port(port, timeout=30):
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if port_in_use(port):
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f"端口 {port} 在 {timeout} 秒内没有就绪")
+
+
+def port_in_use(port) -> bool:
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+
+def start_services(args):
+    """启动模拟高德MCP Server和后端，返回 (进程列表, 后端地址, 后端进程)"""
+    for port in (args.mock_port, args.port):
+        if port_in_use(port):
+            raise RuntimeError(f"端口 {port} 已被占用，请用 --port/--mock-port 指定其他端口")
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    log = open(os.path.join(backend_dir, "loadtest.log"), "w")
+    mock = subprocess.Popen([sys.executable, "mock_amap_server.py", str(args.mock_port)], cwd=backend_dir,
+                            env={**os.environ, "MOCK_AMAP_LATENCY": str(args.amap_latency)},
+                            stdout=log, stderr=subprocess.STDOUT)
+    # 后端启动时就会连接MCP Server
+    wait_for_port(args.mock_port)
+    env = {
+        **os.environ,
+        "AMAP_MCP_URL": f"http://127.0.0.1:{args.mock_port}/sse",
+        "LLM_MODEL_ID": "fake",
+        "FAKE_LLM_LATENCY": str(args.llm_latency),
+        "FAKE_LLM_TOKENS_PER_SECOND": str(args.tokens_per_second),
+        # 不使用缓存，每个请求都完整执行规划
+        "TRIP_CACHE_PATH": "",
+        "TOOL_CACHE_PATH": "",
+    }
+    backend = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port),
+                                "--log-level", "warning"], cwd=backend_dir, env=env, stdout=log,
+                               stderr=subprocess.STDOUT)
+    return [backend, mock], f"http://127.0.0.1:{args.port}", backend
+
+
+async def run_level(client, url, concurrency, rounds, pid):
+    """concurrency 个客户端各自连续发送 rounds 个请求，同时探测 /health 延迟和后端内存"""
+    latencies, errors = [], []
+    health_latencies, rss_samples = [], []
+    stop = asyncio.Event()
+
+    async def worker():
+        for _ in range(rounds):
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{url}/trip", json=REQUEST)
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors.append(f"HTTP {response.status_code}")
+            except httpx.HTTPError as e:
+                errors.append(type(e).__name__)
+
+    async def probe():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                await client.get(f"{url}/health")
+                health_latencies.append(time.perf_counter() - start)
+            except httpx.HTTPError:
+                pass
+            if pid is not None and rss_mb(pid) is not None:
+                rss_samples.append(rss_mb(pid))
+            await asyncio.sleep(0.2)
+
+    probe_task = asyncio.create_task(probe())
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies) + len(errors),
+        "errors": len(errors),
+        "error_kinds": sorted(set(errors)),
+        "throughput": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "health_p99": percentile(health_latencies, 99),
+        "rss_peak": max(rss_samples) if rss_samples else None,
+    }
+
+
+def print_result(result):
+    rss = f"{result['rss_peak']:.0f}MB" if result["rss_peak"] is not None else "-"
+    print(f"{result['concurrency']:>6} {result['requests']:>6} {result['errors']:>5} {result['throughput']:>10.2f} "
+          f"{result['p50']:>8.2f}s {result['p95']:>8.2f}s {result['p99']:>8.2f}s "
+          f"{result['health_p99'] * 1000:>10.0f}ms {rss:>9}")
+    if result["error_kinds"]:
+        print(f"       错误: {', '.join(result['error_kinds'])}")
+
+
+async def main(args):
+    processes, url, pid = [], args.url, args.pid
+    if url is None:
+        processes, url, backend = start_services(args)
+        pid = backend.pid
+    try:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+            await wait_until_ready(client, url, processes[0] if processes else None)
+            print(f"压测 {url}，每个客户端连续发送 {args.rounds} 个请求"
+                  f"(LLM延迟 {args.llm_latency}s，高德工具延迟 {args.amap_latency}s)")
+            if pid is not None:
+                print(f"后端初始内存: {rss_mb(pid) or 0:.0f}MB")
+            print(f"{'并发数':>6} {'请求数':>6} {'错误':>5} {'吞吐量/秒':>10} {'p50':>9} {'p95':>9} {'p99':>9} "
+                  f"{'health p99':>12} {'内存峰值':>9}")
+            for concurrency in args.levels:
+                result = await run_level(client, url, concurrency, args.rounds, pid)
+                print_result(result)
+                if result["requests"] and result["errors"] / result["requests"] > 0.5:
+                    print("⚠️  超过一半的请求失败，停止增加并发")
+                    break
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="后端压测")
+    parser.add_argument("--levels", default="1,2,4,8,16,32",
+                        type=lambda value: [int(level) for level in value.split(",")], help="逐步增加的并发数")
+    parser.add_argument("--rounds", type=int, default=3, help="每个客户端连续发送的请求数")
+    parser.add_argument("--url", help="压测已启动的后端，不启动模拟服务")
+    parser.add_argument("--pid", type=int, help="已启动的后端的进程ID，用于读取内存")
+    parser.add_argument("--port", type=int, default=8100, help="启动的后端端口")
+    parser.add_argument("--mock-port", type=int, default=8765, help="启动的模拟高德MCP Server端口")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="假模型首个token前的延迟秒数")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="假模型的输出速度")
+    parser.add_argument("--amap-latency", type=float, default=0.2, help="模拟高德工具每次调用的延迟秒数")
+    asyncio.run(main(parser.parse_args()))
@@ -1,9 +1,15 @@
+import asyncio
 import os
-from datetime import datetime
-from typing import Any, List, Union
-from fastapi import FastAPI
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import Any, List, Optional, Union
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from sse_starlette.sse import EventSourceResponse
 from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.tools import load_mcp_tools
 from langchain.agents import create_agent
 from langchain.chat_models import init_chat_model
 from langchain_openai import ChatOpenAI
@@ -11,100 +17,210 @@ import json
 from dotenv import load_dotenv
 from playwright.async_api import async_playwright, Playwright
 from data_model import *
-from parse_info import parse_attraction_data, parse_weather_data, parse_hotel_data, parse_meal_data, parse_messages
-from prompts import PLANNER_AGENT_SYSTEM_PROMPT
-from cluster import greedy_cluster
+from parse_info import parse_attraction_data, parse_weather_data, parse_hotel_data, parse_meal_data, parse_messages, \
+    count_tokens, repair_json, planner_parse_stats
+from prompts import PLANNER_AGENT_SYSTEM_PROMPT, COMPACT_PLANNER_AGENT_SYSTEM_PROMPT, DAY_PLANNER_AGENT_SYSTEM_PROMPT, \
+    TRIP_SUGGESTIONS_SYSTEM_PROMPT
+from pydantic import BaseModel
+from cluster import MEAL_SLOTS, assign_meals, partition_days, partition_stats
+from pipeline import StageGraph
+from jobs import JobManager
+from cache import TripPlanCache
+from tool_cache import ToolCallCache
+from direct import DirectToolClient, tool_mode_stats
+from encoder import PlannerCatalog, compare_token_counts
+from budget import compute_budget
+from stream_parser import StreamingJsonParser, MalformedItemError
+from retry import RetryPolicy, RetryableError, DeadlineExceeded, deadline, is_empty_result, is_retryable_or_invalid, \
+    retry_stats, wrap_tools
+from cancellation import ClientDisconnected, cancellation_stats, run_until_disconnected
+from metrics import init_tracing, metrics, metrics_callback, stats_to_prometheus, traced
+from replay import RecordingChatModel, get_fixture, record_tools, replay_llm, replay_mode, replay_tools
+from route import RouteLegCache, RoutePlanner, close_route_leg_cache, get_route_leg_cache
+from spatial_index import PoiIndex, poi_dedup_stats
 
 load_dotenv()
 
+# 高德地图MCP Server名称
+MCP_SERVER_NAME = "amap-amap-sse"
+# 单次规划的截止秒数，请求中的 deadline_seconds 只能更短
+TRIP_DEADLINE_SECONDS = float(os.getenv("TRIP_DEADLINE_SECONDS", 600))
 
-async def get_tools():
-    print("  - 创建共享MCP工具...")
+
+def build_mcp_client():
     gaode_api_key = os.getenv("GAODE_API_KEY")
-    mcp_client = MultiServerMCPClient({
-        # 高德地图MCP Server
-        "amap-amap-sse": {
-            "url": f"https://mcp.amap.com/sse?key={gaode_api_key}",
+    return MultiServerMCPClient({
+        # 高德地图MCP Server，AMAP_MCP_URL 可以指向本地的 mock_amap_server.py(压测用)
+        MCP_SERVER_NAME: {
+            "url": os.getenv("AMAP_MCP_URL") or f"https://mcp.amap.com/sse?key={gaode_api_key}",
             "transport": "sse",
         }
     })
 
-    # 从MCP Server中获取可提供使用的全部工具
-    tools = await mcp_client.get_tools()
+
+async def get_tools(session=None, tool_cache=None):
+    """
+    获取高德地图MCP工具
+
+    Args:
+        session: 已建立的MCP会话，传入时所有工具复用该会话；为 None 时每次工具调用都会新建连接
+        tool_cache: ToolCallCache，传入时工具调用结果按工具名称和参数缓存（缓存未命中时才按重试策略调用工具）；
+            录制或回放时不使用，否则命中缓存的调用不会被录制，回放的结果也会写进真实的缓存
+
+    Returns:
+        工具列表
+    """
+    print("  - 创建共享MCP工具...")
+    if replay_mode() == "replay":
+        # 回放录制的工具调用结果，不连接MCP Server
+        tools = replay_tools(get_fixture())
+    elif session is not None:
+        tools = await load_mcp_tools(session, server_name=MCP_SERVER_NAME)
+    else:
+        # 从MCP Server中获取可提供使用的全部工具
+        tools = await build_mcp_client().get_tools()
+    if replay_mode() == "record":
+        tools = record_tools(tools, get_fixture())
     # print(type(tools))
+    tools = wrap_tools(tools, "TOOL", attempts=3, base_delay=0.3, max_delay=3, timeout=30)
+    if tool_cache is not None and not replay_mode():
+        tools = tool_cache.wrap(tools)
     return tools
 
 
+def build_llm():
+    """
+    创建聊天模型；TRIP_REPLAY_MODE=record 时录制每次调用的回复，replay 时回放录制的回复；
+    LLM_MODEL_ID=fake 时使用压测用的脚本化假模型
+    """
+    if replay_mode() == "replay":
+        return replay_llm(get_fixture())
+    if os.getenv("LLM_MODEL_ID") == "fake":
+        # 压测用的假模型只在需要时导入
+        from fake_llm import ScriptedChatModel
+        llm = ScriptedChatModel.from_env()
+    else:
+        llm = init_chat_model(
+            model=os.getenv("LLM_MODEL_ID"),
+            api_key=os.getenv("LLM_API_KEY"),
+            base_url=os.getenv("LLM_BASE_URL"),
+            temperature=0,
+            max_tokens=8000
+        )
+    if replay_mode() == "record":
+        llm = RecordingChatModel(inner=llm, fixture=get_fixture())
+    return llm
+
+
+class TripPlanningError(Exception):
+    """规划失败：某个阶段出错或行程规划输出重新生成后仍无法解析等，接口返回 502"""
+
+
 class MultiAgentTripPlanner:
     """多智能体旅行规划系统"""
 
-    def __init__(self, tools):
-        """初始化多智能体系统"""
+    def __init__(self, tools, llm=None):
+        """
+        初始化多智能体系统
+
+        Args:
+            tools: 高德地图MCP工具列表
+            llm: 共享的LLM客户端，为 None 时新建一个
+        """
         print("🔄 开始初始化多智能体旅行规划系统...")
         try:
-            self.llm = init_chat_model(
-                model=os.getenv("LLM_MODEL_ID"),
-                api_key=os.getenv("LLM_API_KEY"),
-                base_url=os.getenv("LLM_BASE_URL"),
-                temperature=0,
-                max_tokens=8000
-            )
+            self.llm = llm if llm is not None else build_llm()
+            self.hotel_search_concurrency = max(1, int(os.getenv("HOTEL_SEARCH_CONCURRENCY", 5)))
+            self._build_retry_policies()
+            # 结构化查询直接调用工具（direct）还是交给Agent（agent）
+            self.tool_mode = os.getenv("TRIP_TOOL_MODE", "direct")
+            self.direct_tools = DirectToolClient(tools)
+            if self.tool_mode == "direct" and not self.direct_tools.supports(
+                    "maps_text_search", "maps_search_detail", "maps_weather"):
+                print("⚠️  MCP工具不完整，使用Agent模式")
+                self.tool_mode = "agent"
 
             # 定义系统消息，指导如何使用工具
             system_message = SystemMessage(content=(
                 "你是一个AI助手，使用高德地图工具获取信息。"
             ))
             print("  - 创建景点搜索Agent...")
-            self.attraction_agent = create_agent(
+            self.attraction_agent = traced(create_agent(
                 name="景点搜索专家",
                 model=self.llm,
                 system_prompt=system_message,
                 tools=tools
-            )
+            ), "attractions")
 
             # 创建天气查询Agent
             print("  - 创建天气查询Agent...")
-            self.weather_agent = create_agent(
+            self.weather_agent = traced(create_agent(
                 name="天气查询专家",
                 model=self.llm,
                 system_prompt=system_message,
                 tools=tools
-            )
+            ), "weather")
 
             # 创建酒店推荐Agent
             print("  - 创建酒店推荐Agent...")
-            self.hotel_agent = create_agent(
+            self.hotel_agent = traced(create_agent(
                 name="酒店推荐专家",
                 model=self.llm,
                 system_prompt=system_message,
                 tools=tools
-            )
+            ), "hotels")
 
             # 创建吃饭地方推荐Agent
             print("  - 创建美食推荐Agent...")
-            self.meal_agent = create_agent(
+            self.meal_agent = traced(create_agent(
                 name="美食推荐专家",
                 model=self.llm,
                 system_prompt=system_message,
                 tools=tools
-            )
+            ), "meals")
 
             # 创建行程规划Agent(不需要工具)
+            # compact: 输入输出使用短ID的紧凑格式；full: 输入为原始数据，输出完整的TripPlan
+            self.planner_prompt_format = os.getenv("PLANNER_PROMPT_FORMAT", "compact")
+            # 调试用：紧凑格式时对比两种格式的规划输入 token 数(tiktoken 首次使用可能要下载编码文件)
+            self.planner_token_report = os.getenv("PLANNER_TOKEN_REPORT", "false").lower() == "true"
+            # json_object: JSON 模式；json_schema: 按数据模型的 JSON Schema 约束输出；off: 不约束
+            self.planner_structured_output = os.getenv("PLANNER_STRUCTURED_OUTPUT", "json_object")
             print("  - 创建行程规划Agent...")
-            self.planner_agent = create_agent(
+            self.planner_agent = traced(create_agent(
                 name="行程规划专家",
-                model=self.llm,
-                system_prompt=PLANNER_AGENT_SYSTEM_PROMPT,
+                model=self._structured_llm(PlannerOutput if self.planner_prompt_format == "compact" else TripPlan),
+                system_prompt=(COMPACT_PLANNER_AGENT_SYSTEM_PROMPT if self.planner_prompt_format == "compact"
+                               else PLANNER_AGENT_SYSTEM_PROMPT),
                 tools=[]
-            )
+            ), "planner")
+
+            # 每天最多安排的景点数，未设置时按景点数平均分到每天
+            self.attractions_per_day = int(os.getenv("ATTRACTIONS_PER_DAY", 0)) or None
+
+            # 每天的游览顺序在本地优化，amap: 再查询相邻两站的高德路线；local: 只按距离估算；off: 不规划路线
+            # 录制或回放时每段路线都要经过工具调用，不使用持久化的路线缓存
+            self.route_planner = RoutePlanner(self.direct_tools, RouteLegCache(path="", memory_size=0) if replay_mode()
+                                              else get_route_leg_cache())
+
+            # trip: 一次生成整个行程；per_day: 每天独立并发生成，再在本地合并
+            self.planner_mode = os.getenv("PLANNER_MODE", "per_day")
+            self.planner_day_concurrency = max(1, int(os.getenv("PLANNER_DAY_CONCURRENCY", 10)))
+            print("  - 创建单日行程规划Agent...")
+            self.day_planner_agent = traced(create_agent(
+                name="单日行程规划专家",
+                model=self._structured_llm(PlannedDay),
+                system_prompt=DAY_PLANNER_AGENT_SYSTEM_PROMPT,
+                tools=[]
+            ), "day_planner")
 
             print("   - 创建精美旅行手册Agent...")
-            self.create_travel_guide_agent = create_agent(
+            self.create_travel_guide_agent = traced(create_agent(
                 name="创建精美手册专家",
                 model=self.llm,
                 system_prompt="将下面这段json数据，使用html制作成网页，当做一个旅行助手的精美手册，只输出html代码，不要输出其他的内容。",
                 tools=[]
-            )
+            ), "travel_guide")
 
             print(f"✅ 多智能体系统初始化成功")
             print(f"   景点搜索Agent: {len(tools)} 个工具")
@@ -116,15 +232,55 @@ class MultiAgentTripPlanner:
             traceback.print_exc()
             raise
 
-    async def plan_trip(self, request: TripRequest) -> TripPlan:
+    def _structured_llm(self, model):
+        """
+        按 PLANNER_STRUCTURED_OUTPUT 给规划模型绑定结构化输出参数(OpenAI 兼容的 response_format)
+
+        Args:
+            model: 输出对应的数据模型，json_schema 模式下用它的 JSON Schema 约束生成
+        """
+        if self.planner_structured_output == "json_schema":
+            return self.llm.bind(response_format={
+                "type": "json_schema",
+                "json_schema": {"name": model.__name__, "schema": model.model_json_schema()},
+            })
+        if self.planner_structured_output == "json_object":
+            return self.llm.bind(response_format={"type": "json_object"})
+        return self.llm
+
+    def _build_retry_policies(self):
+        """各阶段和各次 LLM 生成的重试策略，以及整个请求的截止时间"""
+        self.trip_deadline_seconds = TRIP_DEADLINE_SECONDS
+        # 阶段只在结果为空时重试，工具调用的临时错误由 TOOL 策略重试
+        self.stage_retry_policies = {stage: RetryPolicy.from_env(stage, "STAGE", attempts=2, base_delay=1, max_delay=5,
+                                                                 retryable=is_empty_result)
+                                     for stage in ("attractions", "weather", "hotels", "meals")}
+        # 生成内容解析失败时立即重新生成，不需要等待
+        self.generation_retry_policies = {
+            name: RetryPolicy.from_env(name, "PLANNER", attempts=2, base_delay=0, retryable=is_retryable_or_invalid)
+            for name in ("planner", "day_planner", "html")}
+
+    async def plan_trip(self, request: TripRequest, on_event=None) -> TripPlan:
         """
         使用多智能体协作生成旅行计划
 
+        景点、天气、美食三个阶段互不依赖并发执行，酒店阶段在景点聚类完成后立即开始，
+        行程规划阶段等待全部结果，
+        最后在本地优化每天的游览顺序并查询相邻两站的路线。
+
         Args:
             request: 旅行请求
+            on_event: 事件回调 on_event(事件名称, 数据)。每个阶段完成时先发送以阶段名称命名的事件
+                (attractions/weather/clusters/hotels/meals/routes)及其结果，再发送 stage 事件及其 StageTiming；
+                行程规划阶段还会发送 planner_token、planner_retry、day_plan 事件，
+                完整格式(PLANNER_PROMPT_FORMAT=full)下还会发送每天的 weather_info 事件
 
         Returns:
             旅行计划
+
+        Raises:
+            DeadlineExceeded: 超过请求截止时间
+            TripPlanningError: 其他原因导致规划失败
         """
         try:
             print(f"\n{'='*60}")
@@ -135,78 +291,106 @@ class MultiAgentTripPlanner:
             print(f"偏好: {', '.join(request.preferences) if request.preferences else '无'}")
             print(f"{'='*60}\n")
 
-            retry_number = 2
-            count = 0
+            async def with_retry(stage, func, *args):
+                """按阶段的重试策略执行查询，结果为空时重试"""
+                async def attempt():
+                    response = await func(*args)
+                    if not any(response):
+                        raise RetryableError(f"{stage} 结果为空")
+                    return response
+                return await self.stage_retry_policies[stage].run(attempt)
 
             # 步骤1: 景点搜索Agent搜索景点
-            print("📍 步骤1: 搜索景点...")
-            attraction_response = []
-            for i in range(retry_number):
-                attraction_response = await self._get_attraction_response(request)
-                if attraction_response:
-                    print(f"搜索景点在第{i+1}次成功。。。。。。。。。。。。。。。")
-                    break
-            assert attraction_response != [], f"景点搜索结果:[]，没有搜索到景点结果"
+            async def attraction_stage(results):
+                print("📍 步骤1: 搜索景点...")
+                return await with_retry("attractions", self._get_attraction_response, request)
 
             # 步骤2: 天气查询Agent查询天气
-            print("🌤️  步骤2: 查询天气...")
-            weather_response = []
-            for i in range(retry_number):
-                weather_response = await self._get_weather_response(request)
-                if weather_response:
-                    print(f"查询天气在第{i+1}次成功。。。。。。。。。。。。。。。")
-                    break
-            assert weather_response != [], f"天气搜索结果:[]，没有搜索到天气结果"
+            async def weather_stage(results):
+                print("🌤️  步骤2: 查询天气...")
+                return await with_retry("weather", self._get_weather_response, request)
+
+            # 本次请求的全部景点、酒店、美食依次加入同一个去重索引：景点(分组前) -> 酒店 -> 美食(规划前)，
+            # 加入顺序固定，去重结果不受各阶段完成先后的影响
+            poi_index = PoiIndex()
+
+            # 景点去重后按经纬度分到每一天(恰好 travel_days 组，组内距离尽量近)，在每组的中心景点附近寻找酒店
+            async def cluster_stage(results):
+                attractions = poi_index.dedupe("attraction", results["attractions"])
+                attraction_locations = [[attraction.location.longitude, attraction.location.latitude]
+                                        for attraction in attractions]
+                clusters = partition_days(attraction_locations, request.travel_days, self.attractions_per_day)
+
+                # 中心景点(每组的 medoid)
+                central_attraction_names = [attractions[cluster[0]].name for cluster in clusters]
+                return {"attractions": attractions, "clusters": clusters,
+                        "central_attraction_names": central_attraction_names}
 
             # 步骤3: 酒店推荐Agent搜索酒店
-            print("🏨 步骤3: 搜索酒店...")
-            # 根据景点经纬度，寻找附近的酒店
-            # 对景点进行距离划分，随机选取一个景点，再和离该景点最近的两个组成一组
-            locations2name = dict()
-            attraction_locations = []
-            for single_attraction in attraction_response:
-                location = single_attraction.location
-                attraction_locations.append([location.longitude, location.latitude])
-
-                location = ','.join([str(location.longitude), str(location.latitude)])
-                locations2name[location] = single_attraction.name
-            clusters = greedy_cluster(attraction_locations)
-
-            # 中心景点
-            central_attraction_names = []
-            for cluster in clusters:
-                longitude, latitude = attraction_locations[cluster[0]]
-                location = ','.join([str(longitude), str(latitude)])
-                central_attraction_names.append(locations2name[location])
-
-            hotel_response = []
-            for i in range(retry_number):
-                hotel_response = await self._get_hotel_response(request, central_attraction_names)
-                if hotel_response:
-                    print(f"搜索酒店在第{i+1}次成功。。。。。。。。。。。。。。。")
-                    break
-            assert hotel_response != [], f"酒店搜索结果:[]，没有搜索到酒店结果"
+            async def hotel_stage(results):
+                print("🏨 步骤3: 搜索酒店...")
+                # 每个聚类单独重试，不会因为个别聚类失败而重新搜索所有聚类
+                hotels = await self._get_hotel_response(request, results["clusters"]["central_attraction_names"])
+                if not any(hotels):
+                    raise RetryableError("hotels 结果为空")
+                # 多个分组搜到同一家酒店时使用同一个对象
+                return [poi_index.add("hotel", hotel) if hotel is not None else None for hotel in hotels]
 
             # 步骤4: 美食推荐Agent搜索美食
-            print("🏨 步骤4: 搜索美食...")
-            # meal_query = (f"帮我搜索{request.city}的美食，并推荐每一个景点附近一公里内的3个美食地点，"
-            #               f"景点的经纬度列表如下:[{[attraction.location for attraction in attraction_response]}]")
-            # meal_query = f"帮我搜索{request.city}分别适合在早、中、晚三餐吃的美食，要有{request.travel_days}天的美食内容"
-            meal_query = f"帮我搜索{request.city}的特色美食，并按照早中晚三餐进行安排{request.travel_days}天的餐饮情况，提供给我最终美食地点的详细信息"
-            meal_response = await self.meal_agent.ainvoke(
-                {"messages": [{'role': 'user', 'content': meal_query}]})
-            meal_response_messages = meal_response["messages"]
-            meal_response = parse_meal_data(meal_response_messages)
-            assert meal_response != [], f"美食搜索结果:[]，没有搜索到美食结果"
-            print(f"美食搜索结果: {meal_response}...\n")
+            async def meal_stage(results):
+                print("🏨 步骤4: 搜索美食...")
+                meal_response = await with_retry("meals", self._get_meal_response, request)
+                print(f"美食搜索结果: {meal_response}...\n")
+                return meal_response
 
             # 步骤5: 行程规划Agent整合信息生成计划
-            print("📋 步骤5: 生成行程计划...")
-            trip_plan = self._build_trip_plan(request, attraction_response, weather_response, hotel_response, meal_response)
+            async def planner_stage(results):
+                print("📋 步骤5: 生成行程计划...")
+                attractions = results["clusters"]["attractions"]
+                meals = poi_index.dedupe("meal", results["meals"])
+                meal_plan = self._assign_meals(request, attractions, results["clusters"]["clusters"],
+                                               results["hotels"], meals)
+                if self.planner_mode == "per_day":
+                    return await self._build_trip_plan_per_day(request, attractions, results["weather"],
+                                                               results["clusters"]["clusters"], results["hotels"],
+                                                               meals, meal_plan, on_event)
+                hotel_response = list({id(hotel): hotel for hotel in results["hotels"] if hotel is not None}.values())
+                return await self._build_trip_plan(request, attractions, results["weather"],
+                                                   hotel_response, meals, on_event,
+                                                   results["clusters"]["clusters"], meal_plan)
+
+            # 步骤6: 在本地优化每天的游览顺序，只为相邻两站查询路线
+            async def route_stage(results):
+                print("🧭 步骤6: 规划每日路线...")
+                return await self.route_planner.plan(results["planner"], request.transportation, request.city)
+
+            def on_stage_end(timing, result):
+                if on_event is None:
+                    return
+                if timing.name != "planner":
+                    on_event(timing.name, result)
+                on_event("stage", timing)
+
+            graph = StageGraph()
+            graph.add("attractions", attraction_stage)
+            graph.add("weather", weather_stage)
+            graph.add("meals", meal_stage)
+            graph.add("clusters", cluster_stage, deps=["attractions"])
+            graph.add("hotels", hotel_stage, deps=["clusters"])
+            graph.add("planner", planner_stage, deps=["weather", "meals", "hotels"])
+            if self.route_planner.mode != "off":
+                graph.add("routes", route_stage, deps=["planner"])
+            # 所有阶段、工具调用和重试都继承同一个截止时间
+            with deadline(self.trip_deadline_seconds):
+                results = await graph.run(on_stage_end)
+            trip_plan = results["planner"]
+            # 预算由本地根据最终的每日行程计算
+            trip_plan.budget = compute_budget(trip_plan, request)
+            print(f"预算: {trip_plan.budget}")
 
             # 解析最终计划
             # print("📲 步骤6: 生成html代码...")
-            # html_code = self._build_html_code(f"```json\n{trip_plan}\n```", request)
+            # html_code = await self._build_html_code(f"```json\n{trip_plan}\n```", request)
             # output_file_name = f"{request.city}旅行手册.html"
             # self._write_html(html_code, output_file_name)
 
@@ -225,11 +409,14 @@ class MultiAgentTripPlanner:
 
             return trip_plan
 
+        except (DeadlineExceeded, asyncio.CancelledError):
+            raise
         except Exception as e:
             print(f"❌ 生成旅行计划失败: {str(e)}")
             import traceback
             traceback.print_exc()
             # return self._create_fallback_plan(request)
+            raise TripPlanningError(f"生成旅行计划失败: {str(e) or type(e).__name__}") from e
 
     def _create_fallback_plan(self, request: TripRequest) -> TripPlan:
         """创建备用计划(当Agent失败时)"""
@@ -291,53 +478,195 @@ class MultiAgentTripPlanner:
         query = f"帮我搜一下{request.city}的{keywords}相关景点，然后挑选已经搜索出来的{request.travel_days*3}个景点的详情信息"
         return query
 
+    async def _query_tools(self, stage, by_direct, by_agent, parse):
+        """
+        执行一次工具查询：TRIP_TOOL_MODE=direct（默认）时先直接调用工具，结果为空或出错时回退到 Agent；
+        TRIP_TOOL_MODE=agent 时只使用 Agent。两种模式的耗时和 token 用量都记录到 tool_mode_stats。
+        超过截止时间(DeadlineExceeded)或被取消时直接抛出，不回退到 Agent。
+
+        Args:
+            stage: 阶段名称
+            by_direct: 直接调用工具的协程函数，返回 ToolMessage 列表
+            by_agent: 调用 Agent 的协程函数，返回 Agent 的消息列表
+            parse: 解析消息列表的函数
+        """
+        if self.tool_mode == "direct":
+            start = time.perf_counter()
+            try:
+                result = parse(await by_direct())
+            except (DeadlineExceeded, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                print(f"⚠️  {stage} 直接调用工具失败，回退到Agent: {str(e)}")
+                result = []
+            tool_mode_stats.record(stage, "direct", time.perf_counter() - start, 0)
+            if result:
+                return result
+            tool_mode_stats.fallback(stage)
+
+        start = time.perf_counter()
+        messages = await by_agent()
+        tool_mode_stats.record(stage, "agent", time.perf_counter() - start, count_tokens(messages))
+        return parse(messages)
+
     async def _get_attraction_response(self, request: TripRequest):
-        attraction_query = self._build_attraction_query(request)
-        attraction_response = await self.attraction_agent.ainvoke(
-            input={"messages": [{'role': 'user', 'content': attraction_query}]},
-            # stream_mode="values"
-        )
-        attraction_response_messages = attraction_response['messages']
-        # attraction_response = attraction_response_messages[1].content
-        # parse_messages(attraction_response_messages)
-        attraction_response = parse_attraction_data(attraction_response_messages)
+        keywords = request.preferences[0] if request.preferences else "景点"
+
+        async def by_direct():
+            return await self.direct_tools.search_details(keywords, request.city, request.travel_days * 3)
+
+        async def by_agent():
+            attraction_query = self._build_attraction_query(request)
+            attraction_response = await self.attraction_agent.ainvoke(
+                input={"messages": [{'role': 'user', 'content': attraction_query}]},
+                # stream_mode="values"
+            )
+            # parse_messages(attraction_response['messages'])
+            return attraction_response['messages']
+
+        attraction_response = await self._query_tools("attractions", by_direct, by_agent, parse_attraction_data)
         for single_attraction in attraction_response:
             print(f"景点搜索结果: {single_attraction}\n")
         return attraction_response
 
     async def _get_weather_response(self, request: TripRequest):
-        weather_query = f"帮我查询{request.city}的天气信息"
-        weather_response = await self.weather_agent.ainvoke(
-            {"messages": [{'role': 'user', 'content': weather_query}]})
-        weather_response_messages = weather_response["messages"]
-        # weather_response = weather_response["messages"][1].content
-        weather_response = parse_weather_data(weather_response_messages, request.start_date, request.end_date)
+        async def by_direct():
+            return await self.direct_tools.weather(request.city)
+
+        async def by_agent():
+            weather_query = f"帮我查询{request.city}的天气信息"
+            weather_response = await self.weather_agent.ainvoke(
+                {"messages": [{'role': 'user', 'content': weather_query}]})
+            # parse_messages(weather_response["messages"])
+            return weather_response["messages"]
+
+        weather_response = await self._query_tools(
+            "weather", by_direct, by_agent,
+            lambda messages: parse_weather_data(messages, request.start_date, request.end_date))
         for single_weather in weather_response:
             print(f"天气查询结果: {single_weather}\n")
-        # parse_messages(weather_response_messages)
         return weather_response
 
+    async def _get_meal_response(self, request: TripRequest):
+        async def by_direct():
+            return await self.direct_tools.search_details(f"{request.city}特色美食", request.city,
+                                                          request.travel_days * 3)
+
+        async def by_agent():
+            # meal_query = (f"帮我搜索{request.city}的美食，并推荐每一个景点附近一公里内的3个美食地点，"
+            #               f"景点的经纬度列表如下:[{[attraction.location for attraction in attraction_response]}]")
+            # meal_query = f"帮我搜索{request.city}分别适合在早、中、晚三餐吃的美食，要有{request.travel_days}天的美食内容"
+            meal_query = f"帮我搜索{request.city}的特色美食，并按照早中晚三餐进行安排{request.travel_days}天的餐饮情况，提供给我最终美食地点的详细信息"
+            meal_response = await self.meal_agent.ainvoke(
+                {"messages": [{'role': 'user', 'content': meal_query}]})
+            return meal_response["messages"]
+
+        return await self._query_tools("meals", by_direct, by_agent, parse_meal_data)
+
     @staticmethod
     def _build_hotel_query(request, central_attraction_name):
         return f"请搜索{request.city}的{central_attraction_name}周围1公里的{request.accommodation}酒店，然后挑选已经搜索出来的1个酒店的详情信息"
 
-    async def _get_hotel_response(self, request: TripRequest, central_attraction_names):
-        hotel_response = []
-        for central_attraction_name in central_attraction_names:
+    async def _get_single_hotel_response(self, request: TripRequest, central_attraction_name, semaphore):
+        """
+        搜索单个中心景点附近的酒店，结果为空时按 hotels 阶段的重试策略只重新搜索这一个聚类；
+        重试后仍失败时返回 None，不影响其他聚类。超过截止时间时直接抛出
+        """
+        async def by_direct():
+            return await self.direct_tools.search_details(f"{central_attraction_name}附近{request.accommodation}酒店",
+                                                          request.city, 1)
+
+        async def by_agent():
             hotel_query = self._build_hotel_query(request, central_attraction_name)
             single_hotel_response = await self.hotel_agent.ainvoke(
                 {"messages": [{'role': 'user', 'content': hotel_query}]})
-            single_hotel_response_messages = single_hotel_response["messages"]
-            # single_hotel_response = single_hotel_response["messages"][1].content
-            single_hotel_response = parse_hotel_data(single_hotel_response_messages,
-                                                     central_attraction_name,
-                                                     request.accommodation)[0]
-            print(f"酒店搜索结果: {single_hotel_response}\n")
-            hotel_response.append(single_hotel_response)
-        return hotel_response
+            return single_hotel_response["messages"]
+
+        async def attempt():
+            # 退避等待期间不占用并发名额
+            async with semaphore:
+                hotels = await self._query_tools(
+                    "hotels", by_direct, by_agent,
+                    lambda messages: parse_hotel_data(messages, central_attraction_name, request.accommodation))
+            if not hotels:
+                raise RetryableError(f"{central_attraction_name} 附近没有搜索到酒店")
+            return hotels[0]
+
+        try:
+            hotel = await self.stage_retry_policies["hotels"].run(attempt)
+        except (DeadlineExceeded, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            print(f"⚠️  {central_attraction_name} 附近酒店搜索失败: {str(e)}")
+            return None
+        print(f"酒店搜索结果: {hotel}\n")
+        return hotel
+
+    async def _get_hotel_response(self, request: TripRequest, central_attraction_names):
+        """
+        各聚类的酒店并发搜索，并发数由 HOTEL_SEARCH_CONCURRENCY 限制，每个聚类单独重试
+
+        Returns:
+            与聚类一一对应的酒店列表，搜索失败的聚类为 None
+        """
+        semaphore = asyncio.Semaphore(self.hotel_search_concurrency)
+        return list(await asyncio.gather(*(
+            self._get_single_hotel_response(request, central_attraction_name, semaphore)
+            for central_attraction_name in central_attraction_names
+        )))
+
+    @staticmethod
+    def _assign_meals(request, attraction_response, clusters, hotel_response, meal_response) -> List[List[Meal]]:
+        """
+        按位置把美食分配到每天的早、中、晚三餐(cluster.assign_meals)：午餐靠近当天的景点，早餐和晚餐靠近当天的酒店。
+        第 i 天的景点为 clusters[i]，酒店为 hotel_response[i]，没有找到酒店时沿用前一天的酒店
+
+        Returns:
+            每天 [早餐, 午餐, 晚餐] 的美食，没有美食时为空列表
+        """
+        meals = [meal for meal in meal_response if meal.location is not None]
+        day_points, day_hotels = [], []
+        hotel = None
+        for day_index in range(request.travel_days):
+            cluster = clusters[day_index] if day_index < len(clusters) else []
+            day_points.append([[attraction_response[i].location.longitude, attraction_response[i].location.latitude]
+                               for i in cluster])
+            if day_index < len(hotel_response) and hotel_response[day_index] is not None:
+                hotel = hotel_response[day_index]
+            day_hotels.append([hotel.location.longitude, hotel.location.latitude]
+                              if hotel is not None and hotel.location is not None else None)
+        assignment = assign_meals([[meal.location.longitude, meal.location.latitude] for meal in meals],
+                                  day_points, day_hotels)
+        return [[meals[i] for i in slots] for slots in assignment]
+
+    @staticmethod
+    def _apply_meal_ids(planned_day: PlannedDay, meal_ids) -> PlannedDay:
+        """三餐固定为本地分配的美食(按早、中、晚的顺序)，只保留Agent写的描述和预估费用"""
+        if not meal_ids:
+            return planned_day
+        written = {meal.type: meal for meal in planned_day.meals}
+        meals = [PlannedMeal(type=slot, id=meal_id,
+                             description=written[slot].description if slot in written else None,
+                             estimated_cost=written[slot].estimated_cost if slot in written else 0)
+                 for slot, meal_id in zip(MEAL_SLOTS, meal_ids)]
+        return planned_day.model_copy(update={"meals": meals})
+
+    @staticmethod
+    def _apply_meals(day_plan: DayPlan, meals: List[Meal]) -> DayPlan:
+        """完整格式下的 _apply_meal_ids：餐厅信息来自搜索结果，不用Agent输出的名称和坐标"""
+        if not meals:
+            return day_plan
+        written = {meal.type: meal for meal in day_plan.meals}
+        day_plan.meals = [meal.model_copy(update={
+            "type": slot,
+            "description": written[slot].description if slot in written else meal.description,
+            "estimated_cost": (written[slot].estimated_cost if slot in written else 0) or meal.estimated_cost,
+        }) for slot, meal in zip(MEAL_SLOTS, meals)]
+        return day_plan
 
     @staticmethod
-    def _build_planner_query(request, attraction_response, weather_response, hotel_response, meal_response):
+    def _build_planner_query(request, attraction_response, weather_response, hotel_response, meal_response,
+                             day_assignment=None, meal_assignment=None):
         query = f"""
 请根据以下信息生成{request.city}的{request.travel_days}天计划
 
@@ -363,6 +692,15 @@ class MultiAgentTripPlanner:
 
 请生成详细的旅行计划,包括每天的景点安排、餐饮推荐、住宿信息、天气情况和预算明细，必须按照上述信息生成，不能随意捏造数据！！！。
 """
+        if day_assignment:
+            # 景点已在本地按地理位置分到每一天，作为固定输入
+            lines = [f"第{day_index + 1}天: {', '.join(attractions)}" for day_index, attractions in enumerate(day_assignment)]
+            query += "\n**每日景点(已按地理位置分好组，不要调换):**\n" + "\n".join(lines) + "\n"
+        if meal_assignment:
+            # 三餐已在本地按离当天景点和酒店的距离分配
+            lines = [f"第{day_index + 1}天餐饮: 早餐 {meals[0]}, 午餐 {meals[1]}, 晚餐 {meals[2]}"
+                     for day_index, meals in enumerate(meal_assignment) if meals]
+            query += "\n**每日餐饮(已按离景点和酒店的距离安排好，按此输出):**\n" + "\n".join(lines) + "\n"
         if request.free_text_input:
             query += f"\n**额外要求:** {request.free_text_input}"
 
@@ -419,7 +757,7 @@ class MultiAgentTripPlanner:
             # print(f"   将使用备用方案生成计划")
             # return self._create_fallback_plan(request)
 
-    def _parse_response(self, response: str, data_type: str, request: TripRequest) -> Union[TripPlan, str]:
+    def _parse_response(self, response: str, data_type: str, request: TripRequest, model=TripPlan) -> Union[BaseModel, str]:
         """
         解析Agent响应
         
@@ -427,6 +765,7 @@ class MultiAgentTripPlanner:
             response: Agent响应文本
             data_type: 数据类型 ("```json" 或 "```html")
             request: 原始请求
+            model: json数据对应的模型，默认为 TripPlan
             
         Returns:
             旅行计划或HTML字符串
@@ -471,9 +810,18 @@ class MultiAgentTripPlanner:
             
             # 根据数据类型解析内容
             if data_type == "```json":
-                data = json.loads(str_content)
-                # 转换为TripPlan对象
-                return TripPlan(**data)
+                try:
+                    data = json.loads(str_content)
+                    outcome = "parsed"
+                except json.JSONDecodeError as e:
+                    # 小的语法错误先尝试本地修复，修复不了再由调用方重新生成
+                    print(f"⚠️  JSON解析失败，尝试修复: {str(e)}")
+                    data = json.loads(repair_json(str_content))
+                    outcome = "repaired"
+                # 转换为TripPlan(或指定模型)对象
+                result = model(**data)
+                planner_parse_stats.record(outcome)
+                return result
             if data_type == "```html" and "<!DOCTYPE html>" in str_content and "</html>" in str_content:
                 return str_content
             else:
@@ -481,49 +829,244 @@ class MultiAgentTripPlanner:
                 
         except json.JSONDecodeError as e:
             print(f"⚠️  JSON解析失败: {str(e)}")
+            planner_parse_stats.record("failed")
             raise ValueError(f"无法解析JSON数据: {str(e)}")
         except Exception as e:
             print(f"⚠️  解析响应失败: {str(e)}")
+            if data_type == "```json":
+                planner_parse_stats.record("failed")
             raise ValueError(f"解析响应时发生错误: {str(e)}")
 
-    def _build_trip_plan(self, request, attraction_response, weather_response, hotel_response, meal_response) -> str:
-        planner_query = self._build_planner_query(request,
-                                                  attraction_response,
-                                                  weather_response,
-                                                  hotel_response,
-                                                  meal_response)
+    async def _invoke_planner(self, planner_query, on_event=None, on_item=None, agent=None, item_models=None,
+                              on_token=None) -> str:
+        """
+        流式调用行程规划Agent，边生成边用 StreamingJsonParser 解析：每天的行程(完整格式下还有每天的天气)
+        一闭合就校验并交给 on_item(key, item)；小的语法错误先在本地修复，修复后仍格式错误时立即中止生成并抛出 MalformedItemError，
+        由调用方重新生成，不必等整个响应生成完。有事件回调时每个 token 发送一个 planner_token 事件
+
+        Args:
+            agent: 调用的 Agent，默认为整个行程的规划Agent
+            item_models: 逐个解析的顶层数组 -> 元素的数据模型，默认按 PLANNER_PROMPT_FORMAT 取 days(和 weather_info)
+            on_token: 每个 token 的回调，默认发送 planner_token 事件
+        """
+        planner_input = {"messages": [{'role': 'user', 'content': planner_query}]}
+        if item_models is None:
+            item_models = ({"days": PlannedDay} if self.planner_prompt_format == "compact"
+                           else {"days": DayPlan, "weather_info": WeatherInfo})
+        if on_token is None and on_event is not None:
+            on_token = lambda text: on_event("planner_token", text)
+        parser = StreamingJsonParser(item_models)
+        stream = (agent or self.planner_agent).astream(planner_input, stream_mode="messages")
+        try:
+            async for chunk, metadata in stream:
+                if not isinstance(chunk.content, str) or not chunk.content:
+                    continue
+                if on_token is not None:
+                    on_token(chunk.content)
+                for key, item in parser.feed(chunk.content):
+                    if on_item is not None:
+                        on_item(key, item)
+        except MalformedItemError as e:
+            print(f"⚠️  行程规划输出格式错误，提前中止生成: {str(e)}")
+            planner_parse_stats.record("failed")
+            raise
+        finally:
+            planner_parse_stats.record("items_repaired", parser.repaired_count)
+            await stream.aclose()
+        return parser.text
+
+    async def _build_trip_plan(self, request, attraction_response, weather_response, hotel_response, meal_response,
+                               on_event=None, clusters=None, meal_plan=None) -> TripPlan:
+        """
+        一次生成整个行程；clusters 为 partition_days 的按天分组结果，meal_plan 为 _assign_meals 分配的每天三餐，
+        都作为固定输入交给行程规划Agent，Agent 只需选酒店、写描述，不再做景点的空间划分和餐厅搭配
+        """
+        catalog = None
+        meal_plan = meal_plan or []
+        if self.planner_prompt_format == "compact":
+            # 紧凑编码，规划结果只引用短ID，在本地还原
+            catalog = PlannerCatalog(attraction_response, weather_response, hotel_response, meal_response)
+            day_assignment = [[catalog.short_id(attraction_response[i]) for i in cluster] for cluster in clusters or []]
+            meal_assignment = [[catalog.short_id(meal) for meal in meals] for meals in meal_plan]
+            planner_query = self._build_planner_query(request,
+                                                      catalog.encode_attractions(),
+                                                      catalog.encode_weathers(),
+                                                      catalog.encode_hotels(),
+                                                      catalog.encode_meals(),
+                                                      day_assignment,
+                                                      meal_assignment)
+            if self.planner_token_report:
+                token_counts = await asyncio.to_thread(compare_token_counts, attraction_response, weather_response,
+                                                       hotel_response, meal_response)
+                print(f"规划输入 token 数: 紧凑格式 {token_counts['compact']}，原始格式 {token_counts['full']}")
+        else:
+            day_assignment = [[attraction_response[i].name for i in cluster] for cluster in clusters or []]
+            meal_assignment = [[meal.name for meal in meals] for meals in meal_plan]
+            planner_query = self._build_planner_query(request,
+                                                      attraction_response,
+                                                      weather_response,
+                                                      hotel_response,
+                                                      meal_response,
+                                                      day_assignment,
+                                                      meal_assignment)
+        model = PlannerOutput if catalog is not None else TripPlan
         print(f"{'=' * 60}")
         print(f"✅ 汇总信息: {planner_query}\n")
         print(f"{'=' * 60}\n")
-        planner_response = self.planner_agent.invoke(
-            {"messages": [{'role': 'user', 'content': planner_query}]})
-        planner_response = planner_response["messages"][1].content
-        try:
-            trip_plan = self._parse_response(planner_response, "```json", request)
-        except ValueError as e:
+
+        def fix_meals(day):
+            """三餐固定为本地分配的餐厅"""
+            if not 0 <= day.day_index < len(meal_plan):
+                return day
+            if catalog is not None:
+                return self._apply_meal_ids(day, meal_assignment[day.day_index])
+            return self._apply_meals(day, meal_plan[day.day_index])
+
+        def on_item(key, item):
+            # 每天的行程生成完立即推送，不等整个计划
+            if on_event is None:
+                return
+            if key == "days":
+                item = fix_meals(item)
+                on_event("day_plan", catalog.rehydrate_day(item, request) if catalog is not None else item)
+            else:
+                on_event("weather_info", item)
+
+        async def generate():
+            planner_response = await self._invoke_planner(planner_query, on_event, on_item)
+            return planner_response, self._parse_response(planner_response, "```json", request, model)
+
+        def on_retry(attempt, error):
             print(f"重新生成旅行规划 json 数据。。。。。。。。。。。。。。。。。。。。。。。。。。。。")
-            planner_response = self.planner_agent.invoke(
-                {"messages": [{'role': 'user', 'content': planner_query}]})
-            planner_response = planner_response["messages"][1].content
-            trip_plan = self._parse_response(planner_response, "```json", request)
+            planner_parse_stats.record("regenerated")
+            if on_event is not None:
+                on_event("planner_retry", str(error))
+
+        planner_response, trip_plan = await self.generation_retry_policies["planner"].run(generate, on_retry=on_retry)
         print(f"行程规划结果: {planner_response}...\n")
+        trip_plan.days = [fix_meals(day) for day in trip_plan.days]
+        if catalog is not None:
+            trip_plan = catalog.rehydrate(trip_plan, request)
         return trip_plan
 
-    def _build_html_code(self, trip_plan, request) -> str:
+    @staticmethod
+    def _build_day_planner_query(request, catalog, day_index, day_date, attraction_ids, hotel_ids, meal_ids):
+        query = f"""
+请根据以下信息生成{request.city}第{day_index + 1}天({day_date})的行程，day_index为{day_index}
+
+**基本信息:**
+- 城市: {request.city}
+- 交通方式: {request.transportation}
+- 住宿: {request.accommodation}
+- 偏好: {', '.join(request.preferences) if request.preferences else '无'}
+
+**当天景点:**
+{catalog.encode_attractions(attraction_ids)}
+
+**当天天气:**
+{catalog.encode_weathers([day_date])}
+
+**可选酒店:**
+{catalog.encode_hotels(hotel_ids)}
+
+**当天三餐:**
+{catalog.encode_meals(meal_ids)}
+{', '.join(f'{label} {meal_id}' for label, meal_id in zip(('早餐', '午餐', '晚餐'), meal_ids))}
+
+必须按照上述信息生成，不能随意捏造数据！！！。
+"""
+        if request.free_text_input:
+            query += f"\n**额外要求:** {request.free_text_input}"
+        return query
+
+    async def _plan_single_day(self, request, catalog, day_index, attraction_ids, hotel_ids, meal_ids, semaphore,
+                               on_event=None) -> PlannedDay:
+        day_date = (date.fromisoformat(request.start_date) + timedelta(days=day_index)).isoformat()
+        day_query = self._build_day_planner_query(request, catalog, day_index, day_date,
+                                                  attraction_ids, hotel_ids, meal_ids)
+
+        # 各天并发生成，token 事件带上第几天，客户端才能分开显示
+        on_token = None
+        if on_event is not None:
+            on_token = lambda text: on_event("day_planner_token", {"day_index": day_index, "token": text})
+
+        async def generate():
+            # 与整个行程的规划一样流式解析，某一餐格式错误时提前中止生成
+            day_response = await self._invoke_planner(day_query, agent=self.day_planner_agent,
+                                                      item_models={"meals": PlannedMeal}, on_token=on_token)
+            return self._parse_response(day_response, "```json", request, PlannedDay)
+
+        def on_retry(attempt, error):
+            print(f"重新生成第{day_index + 1}天行程 json 数据。。。。。。。。。。。。。。。。。")
+            planner_parse_stats.record("regenerated")
+            if on_event is not None:
+                on_event("planner_retry", f"第{day_index + 1}天: {str(error)}")
+
+        async with semaphore:
+            planned_day = await self.generation_retry_policies["day_planner"].run(generate, on_retry=on_retry)
+        planned_day = self._apply_meal_ids(planned_day.model_copy(update={
+            "day_index": day_index,
+            "hotel_id": planned_day.hotel_id or (hotel_ids[0] if hotel_ids else None),
+        }), meal_ids)
+        print(f"第{day_index + 1}天行程规划结果: {planned_day}\n")
+        if on_event is not None:
+            on_event("day_plan", catalog.rehydrate_day(planned_day, request))
+        return planned_day
+
+    async def _build_overall_suggestions(self, request, catalog, planned_days) -> str:
+        """根据每天的行程概述单独生成总体建议，输出很短"""
+        day_summaries = "\n".join(f"第{planned_day.day_index + 1}天: {planned_day.description}"
+                                  for planned_day in planned_days)
+        suggestions_query = (f"城市: {request.city}\n日期: {request.start_date} 至 {request.end_date}\n"
+                             f"交通方式: {request.transportation}\n"
+                             f"偏好: {', '.join(request.preferences) if request.preferences else '无'}\n"
+                             f"天气:\n{catalog.encode_weathers()}\n每日行程:\n{day_summaries}")
+        response = await self.llm.ainvoke([SystemMessage(content=TRIP_SUGGESTIONS_SYSTEM_PROMPT),
+                                           HumanMessage(content=suggestions_query)],
+                                          config={"callbacks": [metrics_callback], "metadata": {"agent": "suggestions"}})
+        return response.content.strip()
+
+    async def _build_trip_plan_per_day(self, request, attraction_response, weather_response, clusters, hotel_response,
+                                       meal_response, meal_plan, on_event=None) -> TripPlan:
+        """
+        按天并发生成行程：partition_days 分给第 i 天的景点及其酒店、_assign_meals 分给第 i 天的三餐分配给第 i 天，
+        每天独立调用单日规划Agent，最后在本地合并，并单独生成总体建议。耗时基本不随天数增长。
+        """
+        hotels = list({id(hotel): hotel for hotel in hotel_response if hotel is not None}.values())
+        catalog = PlannerCatalog(attraction_response, weather_response, hotels, meal_response)
+
+        semaphore = asyncio.Semaphore(self.planner_day_concurrency)
+        day_tasks = []
+        hotel_id = None
+        for day_index in range(request.travel_days):
+            cluster = clusters[day_index] if day_index < len(clusters) else []
+            attraction_ids = [catalog.short_id(attraction_response[i]) for i in cluster]
+            if day_index < len(hotel_response) and hotel_response[day_index] is not None:
+                hotel_id = catalog.short_id(hotel_response[day_index])
+            # 没有找到酒店的聚类沿用前一天的酒店，仍然没有时提供全部酒店
+            hotel_ids = [hotel_id] if hotel_id else list(catalog.hotels)
+            day_meal_ids = [catalog.short_id(meal) for meal in meal_plan[day_index]]
+            day_tasks.append(self._plan_single_day(request, catalog, day_index, attraction_ids, hotel_ids,
+                                                   day_meal_ids, semaphore, on_event))
+        planned_days = list(await asyncio.gather(*day_tasks))
+
+        overall_suggestions = await self._build_overall_suggestions(request, catalog, planned_days)
+        return catalog.rehydrate(PlannerOutput(days=planned_days, overall_suggestions=overall_suggestions), request)
+
+    async def _build_html_code(self, trip_plan, request) -> str:
         travel_guider_query = f"数据内容:\n{trip_plan}"
-        travel_guider_response = self.create_travel_guide_agent.invoke(
-            {"messages": [{'role': 'user', 'content': travel_guider_query}]})
-        html_content = travel_guider_response["messages"][-1].content
-        print(f"html_content: {html_content}\n")
-        try:
-            html_code = self._parse_response(html_content, "```html", request)
-        except ValueError as e:
-            print("重新生成手册的 html 代码。。。。。。。。。。。。。。。。。。。。。。。。。。。。。")
-            travel_guider_response = self.create_travel_guide_agent.invoke(
+
+        async def generate():
+            travel_guider_response = await self.create_travel_guide_agent.ainvoke(
                 {"messages": [{'role': 'user', 'content': travel_guider_query}]})
             html_content = travel_guider_response["messages"][-1].content
-            html_code = self._parse_response(html_content, "```html", request)
-        return html_code
+            print(f"html_content: {html_content}\n")
+            return self._parse_response(html_content, "```html", request)
+
+        def on_retry(attempt, error):
+            print("重新生成手册的 html 代码。。。。。。。。。。。。。。。。。。。。。。。。。。。。。")
+
+        return await self.generation_retry_policies["html"].run(generate, on_retry=on_retry)
 
 
     def _write_html(self, html_code, output_file_name):
@@ -534,15 +1077,259 @@ class MultiAgentTripPlanner:
         except IOError as e:
             print(f"写入文件时发生错误: {e}")
 
-app = FastAPI()
+class TripPlannerRegistry:
+    """
+    进程级共享资源：MCP会话、工具、LLM客户端和多智能体系统只创建一次，供所有请求复用。
+
+    MCP SSE 会话在独立的后台任务中保持打开（anyio 要求在同一个任务里进入和退出会话上下文），
+    每次 acquire 时按间隔 ping 一次，连接断开则加锁重建。各 Agent 没有 checkpointer，
+    本身无状态，可以被并发请求安全共享。
+    TRIP_REPLAY_MODE=replay 时工具来自录制文件，不建立MCP会话也不 ping；录制和回放时都不使用工具调用缓存。
+    """
+
+    def __init__(self, health_check_interval=None, ping_timeout=None):
+        self.health_check_interval = float(health_check_interval if health_check_interval is not None
+                                           else os.getenv("MCP_HEALTH_CHECK_INTERVAL", 30))
+        self.ping_timeout = float(ping_timeout if ping_timeout is not None
+                                  else os.getenv("MCP_PING_TIMEOUT", 5))
+        self.llm = None
+        # 在 start() 中创建(会打开 SQLite 文件)，导入 main 时不产生任何文件
+        self.tool_cache: Optional[ToolCallCache] = None
+        self.session = None
+        self.tools = []
+        self.planner = None
+        self.startup_seconds = 0.0
+        self.reconnect_count = 0
+        self._lock = asyncio.Lock()
+        self._session_task = None
+        self._session_stop = None
+        self._last_healthy = 0.0
+
+    async def start(self):
+        start = time.perf_counter()
+        if not replay_mode():
+            self.tool_cache = ToolCallCache()
+        self.llm = build_llm()
+        await self._connect()
+        self.startup_seconds = time.perf_counter() - start
+        print(f"✅ 共享资源初始化完成，用时 {self.startup_seconds:.3f} 秒")
+
+    async def close(self):
+        async with self._lock:
+            await self._disconnect()
+        if self.tool_cache is not None:
+            self.tool_cache.close()
+            self.tool_cache = None
+
+    async def _run_session(self, ready: asyncio.Future, stop: asyncio.Event):
+        try:
+            async with build_mcp_client().session(MCP_SERVER_NAME) as session:
+                tools = await get_tools(session, self.tool_cache)
+                ready.set_result((session, tools))
+                await stop.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                print(f"⚠️  MCP会话已断开: {str(e)}")
+
+    async def _connect(self):
+        if replay_mode() == "replay":
+            self.tools = await get_tools()
+            self.planner = MultiAgentTripPlanner(self.tools, self.llm)
+            return
+        ready = asyncio.get_running_loop().create_future()
+        self._session_stop = asyncio.Event()
+        self._session_task = asyncio.create_task(self._run_session(ready, self._session_stop))
+        self.session, self.tools = await ready
+        self.planner = MultiAgentTripPlanner(self.tools, self.llm)
+        self._last_healthy = time.monotonic()
+
+    async def _disconnect(self):
+        if self._session_task is None:
+            return
+        self._session_stop.set()
+        _, pending = await asyncio.wait({self._session_task}, timeout=self.ping_timeout)
+        for task in pending:
+            task.cancel()
+        self._session_task = None
+        self.session = None
+
+    async def is_healthy(self) -> bool:
+        if replay_mode() == "replay":
+            return self.planner is not None
+        if self.session is None or self._session_task is None or self._session_task.done():
+            return False
+        if time.monotonic() - self._last_healthy < self.health_check_interval:
+            return True
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout=self.ping_timeout)
+        except Exception as e:
+            print(f"⚠️  MCP健康检查失败: {str(e)}")
+            return False
+        self._last_healthy = time.monotonic()
+        return True
+
+    async def acquire(self) -> "MultiAgentTripPlanner":
+        """获取共享的多智能体系统，MCP会话不可用时先重连"""
+        if await self.is_healthy():
+            return self.planner
+        async with self._lock:
+            # 其他请求可能已经完成了重连
+            if await self.is_healthy():
+                return self.planner
+            print("🔄 重新连接MCP会话...")
+            await self._disconnect()
+            await self._connect()
+            self.reconnect_count += 1
+            return self.planner
+
+    def stats(self) -> dict:
+        return {
+            "startup_seconds": round(self.startup_seconds, 3),
+            "reconnect_count": self.reconnect_count,
+            "tool_count": len(self.tools),
+            "session_alive": self._session_task is not None and not self._session_task.done(),
+            "tool_cache": self.tool_cache.stats() if self.tool_cache is not None else {},
+        }
+
+
+async def plan_trip_cached(request: TripRequest, on_event=None) -> TripPlan:
+    """
+    先查结果缓存，未命中（或请求要求跳过缓存）时执行规划并写入缓存。
+    录制或回放时不读也不写缓存：命中缓存的请求不会录制任何调用，回放的结果也不应写进真实的缓存
+    """
+    key = request.normalized_key()
+    trip_plan_cache = get_trip_plan_cache()
+    if request.bypass_cache or replay_mode():
+        trip_plan_cache.counters["bypasses"] += 1
+    else:
+        trip_plan = await trip_plan_cache.get(key)
+        if trip_plan is not None:
+            print(f"✅ 命中旅行计划缓存")
+            return trip_plan
+
+    # 端到端截止时间：超过后取消正在进行的阶段、LLM 调用和工具调用
+    deadline_seconds = TRIP_DEADLINE_SECONDS
+    if request.deadline_seconds:
+        deadline_seconds = min(deadline_seconds, request.deadline_seconds)
+    try:
+        async with asyncio.timeout(deadline_seconds):
+            with deadline(deadline_seconds):
+                setup_start = time.perf_counter()
+                multi_agent_trip_planner = await registry.acquire()
+                print(f"请求准备用时 {time.perf_counter() - setup_start:.4f} 秒")
+                trip_plan = await multi_agent_trip_planner.plan_trip(request, on_event)
+    except (TimeoutError, DeadlineExceeded) as e:
+        # 截止时间可能先在重试策略内部触发(退避会超过剩余时间、单次尝试的超时)，同样计数
+        cancellation_stats.record("deadline_exceeded")
+        print(f"🛑 超过截止时间 {deadline_seconds:g} 秒，取消规划")
+        if isinstance(e, DeadlineExceeded):
+            raise
+        raise DeadlineExceeded(f"规划超过截止时间 {deadline_seconds:g} 秒") from e
+    if not replay_mode():
+        await trip_plan_cache.put(key, trip_plan)
+    return trip_plan
+
+
+_trip_plan_cache: Optional[TripPlanCache] = None
+
+
+def get_trip_plan_cache() -> TripPlanCache:
+    """旅行计划缓存在第一次使用时创建(会打开 SQLite 文件)，服务关闭时由 close_trip_plan_cache 关闭"""
+    global _trip_plan_cache
+    if _trip_plan_cache is None:
+        _trip_plan_cache = TripPlanCache()
+    return _trip_plan_cache
+
+
+def close_trip_plan_cache():
+    global _trip_plan_cache
+    if _trip_plan_cache is not None:
+        _trip_plan_cache.close()
+        _trip_plan_cache = None
+
+
+registry = TripPlannerRegistry()
+job_manager = JobManager(plan_trip_cached)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_tracing()
+    get_trip_plan_cache()
+    await registry.start()
+    await job_manager.start()
+    yield
+    await job_manager.close()
+    await registry.close()
+    close_trip_plan_cache()
+    close_route_leg_cache()
+    if replay_mode() == "record":
+        # 录制数据只在内存中累积，服务关闭时一次写入文件
+        await asyncio.to_thread(get_fixture().save)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/health")
+async def health():
+    return {"healthy": await registry.is_healthy(), **registry.stats(), "jobs": job_manager.stats(),
+            "trip_plan_cache": get_trip_plan_cache().stats(), "tool_modes": tool_mode_stats.stats(),
+            "planner_parse": planner_parse_stats.stats(), "retries": retry_stats.stats(),
+            "cancellations": cancellation_stats.stats(), "routes": get_route_leg_cache().stats(),
+            "poi_dedup": poi_dedup_stats.stats(), "partition": partition_stats.stats()}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 格式的指标：各阶段/Agent步骤/工具调用/LLM调用耗时直方图、token 用量，以及各组件的统计"""
+    text = "".join((
+        metrics.render(),
+        stats_to_prometheus("trip_retry", retry_stats.stats(), label="policy"),
+        stats_to_prometheus("trip_cancellations", cancellation_stats.stats()),
+        stats_to_prometheus("trip_planner_parse", planner_parse_stats.stats()),
+        stats_to_prometheus("trip_plan_cache", get_trip_plan_cache().stats()),
+        stats_to_prometheus("trip_tool_cache", registry.stats()["tool_cache"].get("tools", {}), label="tool"),
+        stats_to_prometheus("trip_jobs", job_manager.stats()["jobs"]),
+        stats_to_prometheus("trip_routes", get_route_leg_cache().stats()),
+        stats_to_prometheus("trip_poi_dedup", poi_dedup_stats.stats()),
+        stats_to_prometheus("trip_partition", partition_stats.stats()),
+    ))
+    return Response(content=text, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.post("/trips", response_model=TripJob, status_code=202)
+async def create_trip_job(request: TripRequest):
+    """提交异步规划任务，立即返回任务ID；相同请求正在执行时复用已有任务"""
+    return job_manager.submit(request).to_model()
+
+
+@app.get("/trips/{job_id}", response_model=TripJob)
+async def get_trip_job(job_id: str):
+    """查询任务状态，任务成功后 result 为旅行计划"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在或已过期")
+    return job.to_model()
+
+
 @app.post("/trip", response_model=TripPlan)
-async def read_root(request: TripRequest):
+async def read_root(request: TripRequest, http_request: Request):
     print(f"开始为您规划，用时大约 10 分钟")
 
     start_time = datetime.now()
-    tools = await get_tools()
-    multi_agent_trip_planner = MultiAgentTripPlanner(tools)
-    trip_plan = await multi_agent_trip_planner.plan_trip(request)
+    try:
+        # 客户端断开后不再继续规划
+        trip_plan = await run_until_disconnected(plan_trip_cached(request), http_request.is_disconnected,
+                                                 float(os.getenv("DISCONNECT_POLL_INTERVAL", 1)))
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except TripPlanningError as e:
+        raise HTTPException(status_code=502, detail=str(e))
     print(trip_plan)
     end_time = datetime.now()
     minutes = (end_time - start_time).total_seconds() / 60
@@ -553,4 +1340,43 @@ async def read_root(request: TripRequest):
     #     end_date="2026-01-03",
     #     overall_suggestions="别来"
     # )
-    return trip_plan
\ No newline at end of file
+    return trip_plan
+
+
+@app.post("/trip/stream")
+async def stream_trip(request: TripRequest):
+    """
+    以 SSE 流式返回旅行计划：每个阶段完成立即推送该阶段的结果，行程规划阶段推送生成的 token
+    和每天的行程，最后推送完整的 trip_plan 事件（失败时推送 error 事件）。
+    """
+    queue = asyncio.Queue()
+
+    def on_event(event, data):
+        queue.put_nowait((event, data))
+
+    async def run():
+        try:
+            trip_plan = await plan_trip_cached(request, on_event)
+            on_event("trip_plan", trip_plan)
+        except (DeadlineExceeded, TripPlanningError) as e:
+            on_event("error", str(e))
+        except Exception as e:
+            # 获取共享资源、各阶段或缓存出错时也要通知客户端，而不是直接结束事件流
+            print(f"❌ 流式规划失败: {str(e)}")
+            on_event("error", str(e) or type(e).__name__)
+        finally:
+            queue.put_nowait(None)
+
+    async def event_generator():
+        task = asyncio.create_task(run())
+        try:
+            while (item := await queue.get()) is not None:
+                event, data = item
+                yield {"event": event, "data": json.dumps(jsonable_encoder(data), ensure_ascii=False)}
+        finally:
+            # 客户端断开时停止规划
+            if not task.done():
+                cancellation_stats.record("client_disconnected")
+                task.cancel()
+
+    return EventSourceResponse(event_generator())
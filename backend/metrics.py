@@ -0,0 +1,269 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for name, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Histogram:
+    """Prometheus 风格的直方图：按标签分别统计各桶的累计次数、总和和次数"""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # 标签 -> [各桶次数..., 总和, 次数]
+        self._series: Dict[Tuple[Tuple[str, str], ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-2]:.6g}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series[-1]}")
+        return lines
+
+
+class Counter:
+    """Prometheus 风格的计数器"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_format_labels(labels)} {value:g}" for labels, value in sorted(self._values.items()))
+        return lines
+
+
+class Metrics:
+    """规划过程的各类 span 耗时、LLM token 用量，以 Prometheus 文本格式输出"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.span_duration = Histogram("trip_span_duration_seconds",
+                                       "各阶段/Agent步骤/工具调用/LLM调用的耗时", DURATION_BUCKETS)
+        self.llm_call_tokens = Histogram("trip_llm_call_tokens", "单次 LLM 调用的 token 数", TOKEN_BUCKETS)
+        self.llm_tokens = Counter("trip_llm_tokens_total", "LLM token 用量")
+        self.spans = Counter("trip_spans_total", "span 次数(按结果)")
+
+    def observe_span(self, kind: str, name: str, seconds: float, status: str = "ok"):
+        with self._lock:
+            self.span_duration.observe(seconds, kind=kind, name=name)
+            self.spans.inc(kind=kind, name=name, status=status)
+
+    def observe_tokens(self, agent: str, model: str, input_tokens: int, output_tokens: int):
+        with self._lock:
+            self.llm_tokens.inc(input_tokens, agent=agent, model=model, type="input")
+            self.llm_tokens.inc(output_tokens, agent=agent, model=model, type="output")
+            self.llm_call_tokens.observe(input_tokens + output_tokens, agent=agent)
+
+    def render(self) -> str:
+        with self._lock:
+            lines = []
+            for metric in (self.span_duration, self.spans, self.llm_tokens, self.llm_call_tokens):
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def stats_to_prometheus(prefix: str, stats: Dict[str, Any], label: Optional[str] = None) -> str:
+    """
+    把各组件 stats() 返回的统计字典转换为 Prometheus 文本格式，只输出数值
+
+    Args:
+        prefix: 指标名前缀
+        stats: 统计字典；指定 label 时为 {标签值: {指标: 数值}}，否则为 {指标: 数值}
+        label: 标签名
+    """
+    lines = []
+    for key, value in stats.items():
+        if label is not None and isinstance(value, dict):
+            for metric, metric_value in value.items():
+                if isinstance(metric_value, (int, float)) and not isinstance(metric_value, bool):
+                    lines.append(f"{prefix}_{metric}{_format_labels(((label, key),))} {metric_value:g}")
+        elif label is None and isinstance(value, (int, float)):
+            lines.append(f"{prefix}_{key} {float(value):g}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+# ---------------------- OpenTelemetry(可选) ----------------------
+_tracer = None
+
+
+def init_tracing():
+    """
+    OTEL_TRACES_ENABLED=true 时把 span 导出为 OpenTelemetry trace(OTLP，地址等使用 OTEL_EXPORTER_OTLP_* 标准环境变量)。
+    需要另外安装 opentelemetry-sdk 和 opentelemetry-exporter-otlp，未安装时只输出 Prometheus 指标
+    """
+    global _tracer
+    if os.getenv("OTEL_TRACES_ENABLED", "false").lower() != "true":
+        return
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError as e:
+        print(f"⚠️  未安装 OpenTelemetry，不导出 trace: {str(e)}")
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "trip-planner")}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("trip-planner")
+    print("✅ 已启用 OpenTelemetry trace 导出")
+
+
+@contextmanager
+def span(kind: str, name: str, **attributes):
+    """
+    记录一个 span：耗时计入 trip_span_duration_seconds，启用 OpenTelemetry 时同时导出为 trace 的 span
+
+    Args:
+        kind: 类型，如 stage/tool/llm/agent_step
+        name: 名称，如阶段名、工具名
+        attributes: 附加到 trace span 的属性
+    """
+    start = time.perf_counter()
+    status = "ok"
+    otel_span = None
+    if _tracer is not None:
+        otel_span = _tracer.start_as_current_span(f"{kind}:{name}", attributes={"kind": kind, **attributes})
+        otel_span.__enter__()
+    try:
+        yield
+    except BaseException as e:
+        status = "cancelled" if e.__class__.__name__ == "CancelledError" else "error"
+        raise
+    finally:
+        metrics.observe_span(kind, name, time.perf_counter() - start, status)
+        if otel_span is not None:
+            otel_span.__exit__(None, None, None)
+
+
+def _token_usage(response: LLMResult) -> Tuple[int, int]:
+    """从 usage_metadata 或 response_metadata['token_usage'] 中取出输入、输出 token 数"""
+    input_tokens = output_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            usage = getattr(message, "usage_metadata", None)
+            if usage:
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+                continue
+            token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+            input_tokens += token_usage.get("prompt_tokens", 0)
+            output_tokens += token_usage.get("completion_tokens", 0)
+    return input_tokens, output_tokens
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain 回调：记录 Agent 每个 ReAct 步骤(model/tools 节点)、Agent 内的工具调用和每次 LLM 调用的耗时与 token 用量，
+    agent 标签取自运行配置的 metadata["agent"]
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        # run_id -> (kind, name, agent, 开始时间, OpenTelemetry span)
+        self._runs: Dict[UUID, tuple] = {}
+
+    def _start(self, run_id: UUID, kind: str, name: str, metadata: Optional[dict]):
+        agent = (metadata or {}).get("agent", "")
+        otel_span = None
+        if _tracer is not None:
+            otel_span = _tracer.start_span(f"{kind}:{name}", attributes={"kind": kind, "agent": agent})
+        self._runs[run_id] = (kind, name, agent, time.perf_counter(), otel_span)
+
+    def _end(self, run_id: UUID, status: str = "ok"):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return None
+        kind, name, agent, start, otel_span = run
+        metrics.observe_span(kind, f"{agent}:{name}" if agent else name, time.perf_counter() - start, status)
+        if otel_span is not None:
+            otel_span.end()
+        return run
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, "llm", (metadata or {}).get("ls_model_name") or "chat_model", metadata)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, "llm", (metadata or {}).get("ls_model_name") or "llm", metadata)
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs):
+        run = self._end(run_id)
+        if run is not None:
+            input_tokens, output_tokens = _token_usage(response)
+            metrics.observe_tokens(run[2], run[1], input_tokens, output_tokens)
+            if run[4] is not None:
+                run[4].set_attributes({"input_tokens": input_tokens, "output_tokens": output_tokens})
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, "error")
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, name=None, **kwargs):
+        # 只记录 Agent 图中的节点(model: 一次推理，tools: 一轮工具调用)，即 ReAct 的每一步
+        node = (metadata or {}).get("langgraph_node")
+        if node is not None and node == name:
+            self._start(run_id, "agent_step", node, metadata)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, "error")
+
+    def on_tool_start(self, serialized, input_str, *, run_id, metadata=None, name=None, **kwargs):
+        self._start(run_id, "agent_tool", name or (serialized or {}).get("name", "tool"), metadata)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, "error")
+
+
+metrics_callback = MetricsCallbackHandler()
+
+
+def traced(runnable, agent: str):
+    """给 Agent 加上指标回调，并在 metadata 中标记 Agent 名称"""
+    return runnable.with_config(callbacks=[metrics_callback], metadata={"agent": agent})
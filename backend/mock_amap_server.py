@@ -0,0 +1,192 @@
+"""
+本地模拟的高德地图 MCP Server(SSE)，用于压测：工具名称和返回的 JSON 结构与高德 MCP 相同
+(maps_text_search、maps_search_detail、maps_weather、maps_distance、maps_direction_transit_integrated)，数据按关键字确定性生成，可以设置每次调用的延迟。
+
+用法: python mock_amap_server.py [端口]
+      然后以 AMAP_MCP_URL=http://127.0.0.1:端口/sse 启动后端
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+from datetime import date, timedelta
+from typing import Dict
+
+from mcp.server.fastmcp import FastMCP
+
+# 常见城市的中心点，其他城市按名称生成
+CITY_CENTERS = {
+    "北京": (116.397428, 39.90923),
+    "上海": (121.473701, 31.230416),
+    "广州": (113.264385, 23.129112),
+    "深圳": (114.057868, 22.543099),
+    "杭州": (120.15507, 30.274084),
+    "成都": (104.065735, 30.659462),
+    "西安": (108.948024, 34.263161),
+}
+WEATHERS = ("晴", "多云", "阴", "小雨")
+WINDS = ("北", "东北", "东", "南", "西北")
+
+# 每次工具调用的延迟秒数和随机抖动比例
+LATENCY = float(os.getenv("MOCK_AMAP_LATENCY", 0.2))
+JITTER = float(os.getenv("MOCK_AMAP_JITTER", 0.5))
+# 每次搜索返回的POI数量
+POI_COUNT = int(os.getenv("MOCK_AMAP_POI_COUNT", 20))
+
+mcp = FastMCP("amap-mock", host=os.getenv("MOCK_AMAP_HOST", "127.0.0.1"), port=int(os.getenv("MOCK_AMAP_PORT", 8765)))
+# 搜索生成的POI，详情查询时按ID返回
+_pois: Dict[str, dict] = {}
+
+
+def _seed(*parts) -> int:
+    return int(hashlib.md5("|".join(parts).encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _city_name(city: str) -> str:
+    return city[:-1] if city.endswith("市") else city
+
+
+def _city_center(city: str):
+    city = _city_name(city)
+    if city in CITY_CENTERS:
+        return CITY_CENTERS[city]
+    rng = random.Random(_seed(city))
+    return rng.uniform(100, 120), rng.uniform(22, 40)
+
+
+def _poi_kind(keywords: str) -> str:
+    if "酒店" in keywords or "住宿" in keywords:
+        return "hotel"
+    if "美食" in keywords or "餐" in keywords:
+        return "meal"
+    return "attraction"
+
+
+def _center_for(keywords: str, city: str):
+    """酒店搜索的关键字为 “景点名附近X酒店”，以该景点为中心；其他以城市中心为中心"""
+    if "附近" in keywords:
+        name = keywords.split("附近")[0]
+        for poi in _pois.values():
+            if poi["name"] == name:
+                return tuple(float(value) for value in poi["location"].split(","))
+    return _city_center(city)
+
+
+def _build_poi(kind: str, keywords: str, city: str, index: int) -> dict:
+    rng = random.Random(_seed(kind, keywords, city, str(index)))
+    longitude, latitude = _center_for(keywords, city)
+    spread = 0.01 if kind == "hotel" else 0.12
+    poi_id = f"B0MOCK{_seed(kind, keywords, city, str(index)):08X}"
+    poi = {
+        "id": poi_id,
+        "location": f"{longitude + rng.uniform(-spread, spread):.6f},{latitude + rng.uniform(-spread, spread):.6f}",
+        "address": f"{_city_name(city)}模拟路{rng.randint(1, 300)}号",
+        "business_area": "",
+        "city": f"{_city_name(city)}市",
+        "alias": "",
+        "photo": "",
+        "opentime2": "08:00-18:00",
+        "rating": f"{rng.uniform(3.5, 5.0):.1f}",
+        "open_time": "",
+    }
+    if kind == "hotel":
+        poi.update(name=f"{keywords.split('附近')[0]}模拟酒店{index + 1}", type="住宿服务;宾馆酒店;经济型连锁酒店",
+                   cost="", star="", lowest_price="", hotel_ordering="1")
+    elif kind == "meal":
+        poi.update(name=f"{_city_name(city)}模拟餐厅{index + 1}", type="餐饮服务;中餐厅;特色/地方风味餐厅",
+                   cost=f"{rng.randint(30, 200)}.00", meal_ordering="1")
+    else:
+        poi.update(name=f"{_city_name(city)}模拟景点{index + 1}", type="风景名胜;风景名胜;国家级景点",
+                   cost=str(rng.choice((20, 40, 60, 120))) if rng.random() < 0.5 else "",
+                   level=rng.choice(("AAAAA", "AAAA", "")), ticket_ordering="0")
+    return poi
+
+
+async def _delay():
+    if LATENCY > 0:
+        await asyncio.sleep(random.uniform(LATENCY * (1 - JITTER), LATENCY * (1 + JITTER)))
+
+
+@mcp.tool()
+async def maps_text_search(keywords: str, city: str = "", types: str = "") -> str:
+    """关键字搜索 API 根据用户输入的关键字进行 POI 搜索，并返回相关的信息"""
+    await _delay()
+    kind = _poi_kind(keywords)
+    pois = []
+    for index in range(POI_COUNT):
+        poi = _build_poi(kind, keywords, city, index)
+        _pois[poi["id"]] = poi
+        pois.append({"id": poi["id"], "name": poi["name"], "address": poi["address"], "typecode": "", "photos": {}})
+    return json.dumps({"suggestion": {"keywords": "", "ciytes": {"suggestion": []}}, "pois": pois}, ensure_ascii=False)
+
+
+@mcp.tool()
+async def maps_search_detail(id: str) -> str:
+    """查询关键词搜或者周边搜获取到的 POI ID 的详细信息"""
+    await _delay()
+    poi = _pois.get(id)
+    if poi is None:
+        raise ValueError(f"INVALID_PARAMS: 未知的POI {id}")
+    return json.dumps(poi, ensure_ascii=False)
+
+
+@mcp.tool()
+async def maps_weather(city: str) -> str:
+    """根据城市名称或者标准adcode查询指定城市的天气"""
+    await _delay()
+    rng = random.Random(_seed("weather", city))
+    today = date.today()
+    forecasts = []
+    # 高德只返回今天起4天的预报，压测请求的日期可能更远，这里返回60天
+    for offset in range(0, 60):
+        day = today + timedelta(days=offset)
+        day_temp = rng.randint(0, 30)
+        forecasts.append({
+            "date": day.isoformat(), "week": str(day.isoweekday()),
+            "dayweather": rng.choice(WEATHERS), "nightweather": rng.choice(WEATHERS),
+            "daytemp": str(day_temp), "nighttemp": str(day_temp - rng.randint(3, 10)),
+            "daywind": rng.choice(WINDS), "nightwind": rng.choice(WINDS), "daypower": "1-3", "nightpower": "1-3",
+        })
+    return json.dumps({"city": f"{_city_name(city)}市", "forecasts": forecasts}, ensure_ascii=False)
+
+
+def _straight_distance(origin: str, destination: str) -> float:
+    """两个 "经度,纬度" 之间的球面距离(米)"""
+    (lon1, lat1), (lon2, lat2) = ([math.radians(float(value)) for value in point.split(",")]
+                                  for point in (origin, destination))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+
+@mcp.tool()
+async def maps_distance(origins: str, destination: str, type: str = "1") -> str:
+    """测量多个起点到终点的距离，起点用 | 分隔，type 为 0 直线、1 驾车、3 步行"""
+    await _delay()
+    speed = {"0": 1.0, "1": 8.5, "3": 1.2}.get(type, 8.5)
+    results = []
+    for index, origin in enumerate(origins.split("|")):
+        distance = _straight_distance(origin, destination) * (1.0 if type == "0" else 1.3)
+        results.append({"origin_id": str(index + 1), "dest_id": "1", "distance": str(round(distance)),
+                        "duration": str(0 if type == "0" else round(distance / speed))})
+    return json.dumps({"results": results}, ensure_ascii=False)
+
+
+@mcp.tool()
+async def maps_direction_transit_integrated(origin: str, destination: str, city: str, cityd: str) -> str:
+    """公交路线规划 API 可以根据用户起终点经纬度坐标规划综合各类公共交通方式的通勤方案"""
+    await _delay()
+    distance = round(_straight_distance(origin, destination) * 1.3)
+    transits = [{"duration": str(round(distance / 5.5) + 300), "walking_distance": "600", "segments": []}]
+    return json.dumps({"origin": origin, "destination": destination, "distance": str(distance),
+                       "transits": transits}, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        mcp.settings.port = int(sys.argv[1])
+    print(f"🗺️  模拟高德MCP Server: http://{mcp.settings.host}:{mcp.settings.port}/sse，"
+          f"每次调用延迟 {LATENCY}s(±{JITTER:.0%})")
+    mcp.run(transport="sse")
@@ -16,7 +16,8 @@ def build_attraction(content: dict) -> Attraction:
         category=content.get("type", ''),  # 默认
         rating=float(content.get("rating", 0)),
         image_url=content.get("photo", ""),
-        ticket_price=ticket_price
+        ticket_price=ticket_price,
+        id=content.get("id")
     )
 
 
@@ -160,11 +161,13 @@ def parse_weather_data(messages, start_date, end_date):
     return weathers
 
 
-def build_hotel(content, central_attraction_name, accommodation):
-    hotel_price_config = {"经济型": {"price_range": "200以内", "estimated_cost": 160},
-                          "舒适型": {"price_range": "200-400", "estimated_cost": 300},
-                          "豪华型": {"price_range": "400-1000", "estimated_cost": 600}}
+# 各住宿类型的价格区间和每晚预估费用(元)
+HOTEL_PRICE_CONFIG = {"经济型": {"price_range": "200以内", "estimated_cost": 160},
+                      "舒适型": {"price_range": "200-400", "estimated_cost": 300},
+                      "豪华型": {"price_range": "400-1000", "estimated_cost": 600}}
+
 
+def build_hotel(content, central_attraction_name, accommodation):
     lon_str, lat_str = content["location"].split(",")
     return Hotel(
         name=content["name"],
@@ -173,8 +176,9 @@ def build_hotel(content, central_attraction_name, accommodation):
         rating=content.get("rating", "暂无评分"),
         type=content["type"],
         description=content.get("description", f"距离{central_attraction_name}景点 1 公里内"),
-        price_range=hotel_price_config[accommodation]["price_range"],
-        estimated_cost=hotel_price_config[accommodation]["estimated_cost"],
+        price_range=HOTEL_PRICE_CONFIG[accommodation]["price_range"],
+        estimated_cost=HOTEL_PRICE_CONFIG[accommodation]["estimated_cost"],
+        id=content.get("id"),
     )
 
 
@@ -225,6 +229,8 @@ def build_meal(content):
         location=Location(longitude=float(lon_str), latitude=float(lat_str)),
         type=content["type"],
         rating=content["rating"],
+        estimated_cost=round(float(content.get("cost") or 0)),
+        id=content.get("id"),
     )
 
 
@@ -267,6 +273,108 @@ def parse_meal_data(messages):
     return meals
 
 
+def count_tokens(messages: List[Any]) -> int:
+    """统计消息列表中所有 AIMessage 的 LLM token 用量"""
+    total = 0
+    for msg in messages:
+        if msg.__class__.__name__ not in ('AIMessage', 'AIMessageChunk'):
+            continue
+        usage_metadata = getattr(msg, 'usage_metadata', None)
+        if usage_metadata:
+            total += usage_metadata.get('total_tokens', 0)
+            continue
+        token_usage = getattr(msg, 'response_metadata', {}).get('token_usage', {})
+        total += token_usage.get('total_tokens', 0)
+    return total
+
+
+def _strip_trailing_comma(chars: List[str]):
+    while chars and chars[-1].isspace():
+        chars.pop()
+    if chars and chars[-1] == ",":
+        chars.pop()
+
+
+def repair_json(text: str) -> str:
+    """
+    修复 LLM 输出中常见的小的 JSON 语法错误，避免整体重新生成：
+    去掉代码块标记和 JSON 前后多余的文字、对象/数组末尾多余的逗号、字符串中未转义的换行，
+    补全被截断的字符串和缺失或不匹配的右括号
+
+    Args:
+        text: LLM 输出的 JSON 文本
+
+    Returns:
+        修复后的 JSON 文本(不保证一定合法)
+    """
+    start = min((index for index in (text.find("{"), text.find("[")) if index != -1), default=-1)
+    if start == -1:
+        return text
+    chars = []
+    # 尚未闭合的括号对应的右括号
+    closers = []
+    in_string = False
+    escaped = False
+    for char in text[start:]:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            elif char == "\n":
+                chars.append("\\n")
+                continue
+            chars.append(char)
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+        elif char in "}]":
+            _strip_trailing_comma(chars)
+            chars.append(closers.pop())
+            if not closers:
+                # JSON 已经完整，忽略后面的文字
+                break
+            continue
+        chars.append(char)
+
+    # 输出被截断：补全字符串和括号
+    if in_string:
+        chars.append('"')
+    _strip_trailing_comma(chars)
+    if chars and chars[-1] == ":":
+        chars.append("null")
+    chars.extend(reversed(closers))
+    return "".join(chars)
+
+
+class ParseStats:
+    """
+    记录规划结果的 JSON 解析情况：直接解析成功、修复后成功、解析失败以及因此重新生成的次数，
+    以及流式解析时修复后才通过校验的元素数(items_repaired)
+    """
+
+    def __init__(self):
+        self.counters = {"parsed": 0, "repaired": 0, "failed": 0, "regenerated": 0, "items_repaired": 0}
+
+    def record(self, outcome: str, count: int = 1):
+        self.counters[outcome] += count
+
+    def stats(self) -> dict:
+        responses = self.counters["parsed"] + self.counters["repaired"] + self.counters["failed"]
+        return {
+            **self.counters,
+            "repair_rate": round(self.counters["repaired"] / responses, 4) if responses else 0.0,
+            "regeneration_rate": round(self.counters["regenerated"] / responses, 4) if responses else 0.0,
+        }
+
+
+planner_parse_stats = ParseStats()
+
+
 def parse_messages(messages: List[Any]) -> None:
     """
     解析消息列表，打印 HumanMessage、AIMessage 和 ToolMessage 的详细信息
@@ -0,0 +1,96 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from metrics import span
+
+
+@dataclass
+class StageTiming:
+    """单个阶段的执行时间（start/end 为相对流水线开始的秒数）"""
+    name: str
+    start: float
+    end: float
+    started_at: float = 0.0  # 开始时的 unix 时间戳
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[[Dict[str, Any]], Awaitable[Any]]
+    deps: Sequence[str] = field(default_factory=tuple)
+
+
+class StageGraph:
+    """
+    阶段依赖图：每个阶段在其依赖全部完成后立即开始，互不依赖的阶段并发执行，
+    总耗时为关键路径的耗时而不是所有阶段之和。
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, Stage] = {}
+        self.timings: List[StageTiming] = []
+
+    def add(self, name: str, func: Callable[[Dict[str, Any]], Awaitable[Any]], deps: Sequence[str] = ()):
+        """
+        添加阶段
+
+        Args:
+            name: 阶段名称
+            func: 异步函数，参数为已完成阶段的结果字典 {阶段名称: 结果}
+            deps: 依赖的阶段名称
+        """
+        for dep in deps:
+            if dep not in self._stages:
+                raise ValueError(f"阶段 {name} 依赖的阶段 {dep} 不存在，请先添加依赖阶段")
+        self._stages[name] = Stage(name, func, tuple(deps))
+        return self
+
+    async def run(self, on_stage_end: Optional[Callable[[StageTiming, Any], None]] = None) -> Dict[str, Any]:
+        """
+        执行全部阶段
+
+        Args:
+            on_stage_end: 每个阶段完成时的回调，参数为阶段耗时和阶段结果
+
+        Returns:
+            全部阶段的结果字典 {阶段名称: 结果}
+        """
+        origin = time.perf_counter()
+        wall_origin = time.time()
+        results: Dict[str, Any] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+        self.timings = []
+
+        async def run_stage(stage: Stage):
+            if stage.deps:
+                await asyncio.gather(*(tasks[dep] for dep in stage.deps))
+            start = time.perf_counter() - origin
+            with span("stage", stage.name):
+                result = await stage.func(results)
+            end = time.perf_counter() - origin
+            results[stage.name] = result
+            timing = StageTiming(stage.name, start, end, wall_origin + start)
+            self.timings.append(timing)
+            print(f"⏱️  阶段 {stage.name}: {timing.start:.2f}s -> {timing.end:.2f}s (用时 {timing.duration:.2f}s)")
+            if on_stage_end is not None:
+                on_stage_end(timing, result)
+            return result
+
+        # 按添加顺序创建任务，依赖一定先于被依赖者创建
+        for name, stage in self._stages.items():
+            tasks[name] = asyncio.create_task(run_stage(stage), name=f"stage-{name}")
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            # 任一阶段失败或外部取消时，取消尚未完成的阶段
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+        return results
@@ -0,0 +1,234 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import BaseTool, StructuredTool
+from pydantic import ConfigDict
+
+from tool_cache import ToolCallCache
+
+
+def replay_mode() -> str:
+    """TRIP_REPLAY_MODE：空(默认，访问真实服务)、record(录制)、replay(回放)"""
+    return os.getenv("TRIP_REPLAY_MODE", "").strip().lower()
+
+
+def _latency_setting(env_name: str):
+    """合成延迟：秒数，或 recorded 表示使用录制时的实际耗时"""
+    value = os.getenv(env_name, "0").strip().lower()
+    return "recorded" if value == "recorded" else float(value)
+
+
+def _message_key(messages: List[BaseMessage]) -> str:
+    """LLM 输入的指纹：只取类型、内容、工具调用和 tool_call_id，忽略每次运行都不同的消息ID"""
+    normalized = []
+    for message in messages:
+        normalized.append({
+            "type": message.type,
+            "content": message.content,
+            "tool_calls": [[tool_call["name"], tool_call["args"]] for tool_call in getattr(message, "tool_calls", [])],
+            "tool_call_id": getattr(message, "tool_call_id", None),
+        })
+    text = json.dumps(normalized, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class Fixture:
+    """
+    录制的数据：请求、工具定义、每次工具调用的结果和每次 LLM 调用的回复(含录制时的耗时)，保存为 JSON 文件。
+    工具调用按 工具名 + 规范化参数 索引，LLM 调用按输入消息的指纹索引，回放与调用顺序和并发无关。
+    录制时数据只保存在内存中，由调用方在录制结束时调用一次 save()(benchmark.py record 结束时、服务关闭时)，
+    不会在每次调用后同步重写整个文件。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = {"request": None, "tools": [], "tool_calls": {}, "llm_calls": {}}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                self.data.update(json.load(file))
+
+    def save(self):
+        """原子地写入整个文件，在事件循环中调用时应放到线程中执行"""
+        with self._lock:
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as file:
+                json.dump(self.data, file, ensure_ascii=False, indent=1)
+            os.replace(temp_path, self.path)
+
+    def record_tools(self, tools: List[BaseTool]):
+        self.data["tools"] = [{
+            "name": tool.name,
+            "description": tool.description,
+            "args_schema": tool.args_schema if isinstance(tool.args_schema, dict) else tool.args_schema.model_json_schema(),
+        } for tool in tools]
+
+    def record_tool_call(self, tool_name: str, arguments: dict, result, seconds: float):
+        self.data["tool_calls"][ToolCallCache.cache_key(tool_name, arguments)] = {
+            "tool": tool_name, "arguments": arguments, "result": result, "seconds": seconds}
+
+    def tool_call(self, tool_name: str, arguments: dict) -> dict:
+        entry = self.data["tool_calls"].get(ToolCallCache.cache_key(tool_name, arguments))
+        if entry is None:
+            raise KeyError(f"录制数据中没有 {tool_name}({arguments}) 的调用结果，请重新录制")
+        return entry
+
+    def record_llm_call(self, messages: List[BaseMessage], message: BaseMessage, seconds: float):
+        self.data["llm_calls"][_message_key(messages)] = {"message": message_to_dict(message), "seconds": seconds}
+
+    def llm_call(self, messages: List[BaseMessage]) -> dict:
+        entry = self.data["llm_calls"].get(_message_key(messages))
+        if entry is None:
+            raise KeyError(f"录制数据中没有该 LLM 调用(最后一条消息: {str(messages[-1].content)[:80]})，请重新录制")
+        return entry
+
+
+_fixture: Optional[Fixture] = None
+
+
+def get_fixture() -> Fixture:
+    """TRIP_FIXTURE 指定的录制文件(默认 trip_fixture.json)，进程内只加载一次"""
+    global _fixture
+    if _fixture is None:
+        _fixture = Fixture(os.getenv("TRIP_FIXTURE", "trip_fixture.json"))
+    return _fixture
+
+
+async def _sleep(latency, recorded_seconds: float):
+    seconds = recorded_seconds if latency == "recorded" else latency
+    if seconds > 0:
+        await asyncio.sleep(seconds)
+
+
+# ---------------------- 工具 ----------------------
+def record_tools(tools: List[BaseTool], fixture: Fixture) -> List[BaseTool]:
+    """录制模式：工具调用照常执行，同时保存结果和耗时"""
+    fixture.record_tools(tools)
+    return [_recording_tool(tool, fixture) if isinstance(tool, StructuredTool) and tool.coroutine else tool
+            for tool in tools]
+
+
+def _recording_tool(tool: StructuredTool, fixture: Fixture) -> StructuredTool:
+    call_tool = tool.coroutine
+
+    async def recording_call(**arguments):
+        start = time.perf_counter()
+        result = await call_tool(**arguments)
+        fixture.record_tool_call(tool.name, arguments, result, time.perf_counter() - start)
+        return result
+
+    return StructuredTool(name=tool.name, description=tool.description, args_schema=tool.args_schema,
+                          coroutine=recording_call, response_format=tool.response_format, metadata=tool.metadata)
+
+
+def replay_tools(fixture: Fixture) -> List[BaseTool]:
+    """回放模式：按录制的工具定义创建工具，调用时返回录制的结果，延迟由 TRIP_REPLAY_TOOL_LATENCY 设置"""
+    latency = _latency_setting("TRIP_REPLAY_TOOL_LATENCY")
+
+    def replay_tool(definition):
+        async def replay_call(**arguments):
+            entry = fixture.tool_call(definition["name"], arguments)
+            await _sleep(latency, entry["seconds"])
+            content, artifact = entry["result"]
+            return content, artifact
+
+        return StructuredTool(name=definition["name"], description=definition["description"],
+                              args_schema=definition["args_schema"], coroutine=replay_call,
+                              response_format="content_and_artifact")
+
+    return [replay_tool(definition) for definition in fixture.data["tools"]]
+
+
+# ---------------------- LLM ----------------------
+class RecordingChatModel(BaseChatModel):
+    """录制模式：调用真实的聊天模型，同时按输入消息的指纹保存回复和耗时"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    inner: Any
+    fixture: Any
+    bound: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording"
+
+    def bind_tools(self, tools, **kwargs):
+        return RecordingChatModel(inner=self.inner, fixture=self.fixture, bound=self.inner.bind_tools(tools, **kwargs))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        start = time.perf_counter()
+        message = (self.bound or self.inner).invoke(messages, stop=stop, **kwargs)
+        self.fixture.record_llm_call(messages, message, time.perf_counter() - start)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        start = time.perf_counter()
+        message = await (self.bound or self.inner).ainvoke(messages, stop=stop, **kwargs)
+        self.fixture.record_llm_call(messages, message, time.perf_counter() - start)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class ReplayChatModel(BaseChatModel):
+    """回放模式：按输入消息的指纹返回录制的回复，延迟由 TRIP_REPLAY_LLM_LATENCY 设置；流式调用时按片段返回"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    fixture: Any
+    latency: Any = 0.0
+    chunk_size: int = 16
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def bind_tools(self, tools, **kwargs):
+        # 回复已经录制好，工具定义不影响结果
+        return self
+
+    def _reply(self, messages) -> Dict[str, Any]:
+        entry = self.fixture.llm_call(messages)
+        return {"message": messages_from_dict([entry["message"]])[0], "seconds": entry["seconds"]}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        reply = self._reply(messages)
+        seconds = reply["seconds"] if self.latency == "recorded" else self.latency
+        if seconds > 0:
+            time.sleep(seconds)
+        return ChatResult(generations=[ChatGeneration(message=reply["message"])])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        reply = self._reply(messages)
+        await _sleep(self.latency, reply["seconds"])
+        return ChatResult(generations=[ChatGeneration(message=reply["message"])])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        reply = self._reply(messages)
+        await _sleep(self.latency, reply["seconds"])
+        message: AIMessage = reply["message"]
+        if message.tool_calls or not isinstance(message.content, str):
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content=message.content, usage_metadata=message.usage_metadata,
+                tool_call_chunks=[{"name": tool_call["name"], "args": json.dumps(tool_call["args"], ensure_ascii=False),
+                                   "id": tool_call["id"], "index": i}
+                                  for i, tool_call in enumerate(message.tool_calls)]))
+            return
+        content = message.content
+        for i in range(0, len(content), self.chunk_size):
+            chunk = AIMessageChunk(content=content[i:i + self.chunk_size])
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=message.usage_metadata))
+
+
+def replay_llm(fixture: Fixture) -> ReplayChatModel:
+    return ReplayChatModel(fixture=fixture, latency=_latency_setting("TRIP_REPLAY_LLM_LATENCY"))
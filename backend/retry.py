@@ -0,0 +1,286 @@
+import asyncio
+import contextvars
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.tools import BaseTool, StructuredTool
+
+from metrics import span
+
+# 当前请求的截止时间(time.monotonic)，asyncio 创建任务时会复制上下文，后续阶段和工具调用都会继承
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("trip_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """超过请求的截止时间"""
+
+
+class RetryableError(Exception):
+    """结果不可用但重试可能成功，例如搜索结果为空"""
+
+
+@contextmanager
+def deadline(seconds: Optional[float]):
+    """
+    为当前上下文(以及其中创建的任务)设置截止时间；外层已有更早的截止时间时保留外层的
+
+    Args:
+        seconds: 距离现在的秒数，为空或不大于 0 时不设置
+    """
+    if not seconds or seconds <= 0:
+        yield
+        return
+    expires_at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(expires_at if current is None else min(current, expires_at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """距离当前请求截止时间的秒数，没有截止时间时返回 None"""
+    expires_at = _deadline.get()
+    return None if expires_at is None else expires_at - time.monotonic()
+
+
+# 按异常类名判断的可重试错误(openai、httpx、anyio、mcp 的超时、限流、连接错误)，避免直接依赖这些库
+_RETRYABLE_ERROR_NAMES = ("Timeout", "RateLimit", "Connection", "ServiceUnavailable", "InternalServer",
+                          "ClosedResource", "BrokenResource", "McpError")
+# 高德接口超出 QPS 等临时错误只体现在错误信息里
+_RETRYABLE_MESSAGES = ("exceeded", "qps", "timeout", "timed out", "temporarily", "too many requests")
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    错误分类：超时、连接错误、限流、5xx 和 RetryableError 可以重试；
+    参数错误、4xx、数据校验错误等重试也不会成功，直接失败
+    """
+    if isinstance(error, (DeadlineExceeded, asyncio.CancelledError)):
+        return False
+    if isinstance(error, (RetryableError, TimeoutError, ConnectionError)):
+        return True
+    status_code = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status_code, int):
+        return status_code in (408, 409, 429) or status_code >= 500
+    if any(name in type(error).__name__ for name in _RETRYABLE_ERROR_NAMES):
+        return True
+    message = str(error).lower()
+    return any(text in message for text in _RETRYABLE_MESSAGES)
+
+
+def is_retryable_or_invalid(error: BaseException) -> bool:
+    """LLM 生成内容解析或校验失败(ValueError)时重新生成也可能成功"""
+    return isinstance(error, ValueError) or is_retryable(error)
+
+
+def is_empty_result(error: BaseException) -> bool:
+    """
+    阶段级重试只重试结果为空(RetryableError)：超时、连接错误、限流等已经由每次工具调用的 TOOL 策略重试过，
+    阶段再整体重试会让重试次数成倍增加(阶段 × 工具 × 回退到 Agent)
+    """
+    return isinstance(error, RetryableError)
+
+
+class RetryStats:
+    """按策略名称记录调用次数、重试次数、重试耗时(失败的尝试 + 退避等待)和对冲请求次数"""
+
+    def __init__(self):
+        self.records: Dict[str, Dict[str, float]] = {}
+
+    def record_for(self, name: str) -> Dict[str, float]:
+        return self.records.setdefault(name, {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "retry_seconds": 0.0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "failures": 0,
+            "deadline_exceeded": 0,
+        })
+
+    def stats(self) -> dict:
+        return {name: {**record, "retry_seconds": round(record["retry_seconds"], 3)}
+                for name, record in self.records.items()}
+
+
+retry_stats = RetryStats()
+
+
+class RetryPolicy:
+    """
+    重试策略：指数退避 + 随机抖动，只重试可重试的错误，每次尝试和退避都受当前请求截止时间约束。
+    可选对冲请求：一次尝试超过历史耗时的指定分位数仍未返回时，再发一个相同的请求，取先成功的结果。
+    """
+
+    def __init__(self, name: str, attempts=3, base_delay=0.5, max_delay=8.0, jitter=0.5, timeout=None,
+                 hedge_percentile=None, hedge_min_samples=20, retryable: Callable[[BaseException], bool] = is_retryable):
+        """
+        Args:
+            name: 策略名称，用于统计
+            attempts: 最多尝试次数(含第一次)
+            base_delay: 第一次重试前的等待秒数，之后每次翻倍，不超过 max_delay
+            max_delay: 最长等待秒数
+            jitter: 抖动比例，实际等待时间在 [delay * (1 - jitter), delay] 之间随机
+            timeout: 单次尝试的超时秒数，为空时只受截止时间限制
+            hedge_percentile: 对冲请求的耗时分位数(如 95)，为空时不发对冲请求
+            hedge_min_samples: 至少有多少个耗时样本才开始对冲
+            retryable: 判断错误是否可以重试的函数
+        """
+        self.name = name
+        self.attempts = max(1, int(attempts))
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.jitter = float(jitter)
+        self.timeout = float(timeout) if timeout else None
+        self.hedge_percentile = float(hedge_percentile) if hedge_percentile else None
+        self.hedge_min_samples = int(hedge_min_samples)
+        self.retryable = retryable
+        self._latencies = deque(maxlen=200)
+
+    @classmethod
+    def from_env(cls, name: str, prefix: str, **defaults) -> "RetryPolicy":
+        """从环境变量 {prefix}_RETRY_ATTEMPTS、{prefix}_RETRY_BASE_DELAY、{prefix}_RETRY_MAX_DELAY、
+        {prefix}_TIMEOUT、{prefix}_HEDGE_PERCENTILE 读取配置，未设置时使用 defaults"""
+        settings = {
+            "attempts": f"{prefix}_RETRY_ATTEMPTS",
+            "base_delay": f"{prefix}_RETRY_BASE_DELAY",
+            "max_delay": f"{prefix}_RETRY_MAX_DELAY",
+            "timeout": f"{prefix}_TIMEOUT",
+            "hedge_percentile": f"{prefix}_HEDGE_PERCENTILE",
+        }
+        for key, env_name in settings.items():
+            if os.getenv(env_name):
+                defaults[key] = os.getenv(env_name)
+        return cls(name, **defaults)
+
+    def backoff(self, attempt: int) -> float:
+        """第 attempt 次失败后的等待秒数"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(delay * (1 - self.jitter), delay)
+
+    def hedge_delay(self) -> Optional[float]:
+        """发出对冲请求前的等待秒数，样本不足或未启用时返回 None"""
+        if self.hedge_percentile is None or len(self._latencies) < self.hedge_min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100))]
+
+    async def run(self, func, *args, on_retry=None, **kwargs):
+        """
+        按策略执行 func(*args, **kwargs)
+
+        Args:
+            func: 协程函数
+            on_retry: 重试前的回调 on_retry(第几次失败, 异常)
+
+        Raises:
+            DeadlineExceeded: 超过请求截止时间
+            Exception: 不可重试的错误或最后一次尝试的错误
+        """
+        record = retry_stats.record_for(self.name)
+        record["calls"] += 1
+        for attempt in range(1, self.attempts + 1):
+            remaining = remaining_time()
+            if remaining is not None and remaining <= 0:
+                record["deadline_exceeded"] += 1
+                record["failures"] += 1
+                raise DeadlineExceeded(f"{self.name} 超过请求截止时间")
+            record["attempts"] += 1
+            attempt_start = time.monotonic()
+            try:
+                return await self._attempt(func, args, kwargs, remaining, record)
+            except Exception as e:
+                remaining = remaining_time()
+                if isinstance(e, TimeoutError) and remaining is not None and remaining <= 0:
+                    # 单次尝试的超时来自请求截止时间，不是这次调用本身超时
+                    record["deadline_exceeded"] += 1
+                    record["failures"] += 1
+                    raise DeadlineExceeded(f"{self.name} 超过请求截止时间") from e
+                if attempt == self.attempts or not self.retryable(e):
+                    record["failures"] += 1
+                    raise
+                delay = self.backoff(attempt)
+                remaining = remaining_time()
+                if remaining is not None and delay >= remaining:
+                    record["deadline_exceeded"] += 1
+                    record["failures"] += 1
+                    raise DeadlineExceeded(f"{self.name} 重试前超过请求截止时间") from e
+                print(f"🔁 {self.name} 第{attempt}次失败({type(e).__name__}: {str(e)[:200]})，{delay:.2f}秒后重试")
+                if on_retry is not None:
+                    on_retry(attempt, e)
+                record["retries"] += 1
+                await asyncio.sleep(delay)
+                record["retry_seconds"] += time.monotonic() - attempt_start
+
+    async def _attempt(self, func, args, kwargs, remaining, record):
+        timeouts = [timeout for timeout in (self.timeout, remaining) if timeout is not None]
+        hedge_after = self.hedge_delay()
+        start = time.monotonic()
+        if hedge_after is None:
+            result = await asyncio.wait_for(func(*args, **kwargs), min(timeouts) if timeouts else None)
+        else:
+            result = await asyncio.wait_for(self._hedged(func, args, kwargs, hedge_after, record),
+                                            min(timeouts) if timeouts else None)
+        self._latencies.append(time.monotonic() - start)
+        return result
+
+    @staticmethod
+    async def _hedged(func, args, kwargs, hedge_after, record):
+        tasks = [asyncio.ensure_future(func(*args, **kwargs))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                record["hedges"] += 1
+                tasks.append(asyncio.ensure_future(func(*args, **kwargs)))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            record["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def wrap_tools(tools: List[BaseTool], prefix="TOOL", **defaults) -> List[BaseTool]:
+    """
+    给每个异步工具调用加上独立的重试策略(名称为 tool:工具名，对冲请求按各工具自己的耗时分布计算)，
+    配置读取 {prefix}_RETRY_ATTEMPTS 等环境变量
+    """
+    return [_wrap_tool(tool, RetryPolicy.from_env(f"tool:{tool.name}", prefix, **defaults))
+            if isinstance(tool, StructuredTool) and tool.coroutine else tool
+            for tool in tools]
+
+
+def _wrap_tool(tool: StructuredTool, policy: RetryPolicy) -> StructuredTool:
+    call_tool = tool.coroutine
+
+    async def call_once(**arguments):
+        # 每次尝试记录一个 tool span
+        with span("tool", tool.name):
+            return await call_tool(**arguments)
+
+    async def call_with_retry(**arguments):
+        return await policy.run(call_once, **arguments)
+
+    return StructuredTool(
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+        coroutine=call_with_retry,
+        response_format=tool.response_format,
+        metadata=tool.metadata,
+    )
@@ -0,0 +1,341 @@
+"""
+单日路线规划：每天的游览顺序在本地求解(最近邻 + 2-opt，从前一晚的酒店出发，回到当晚的酒店)，
+不需要 LLM 决定顺序，也不需要两两查询路线；只为最终路线上相邻的两站查询高德路线，
+同一天、同一目的地的多段合并为一次 maps_distance 查询，结果按 (出行方式, 起点, 终点) 缓存。
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from budget import ROUTE_DETOUR_FACTOR, day_hotels
+from cache import DAY, LRUCache, SqliteStore
+from cluster import build_distance_matrix
+from data_model import DayPlan, Location, RouteLeg, TripPlan
+from direct import DirectToolClient
+
+# 各交通方式对应的高德路线查询(工具名称, maps_distance 的 type)和无法查询时估算用的平均速度(米/秒)
+ROUTE_MODES = {
+    "公共交通": {"tool": "maps_direction_transit_integrated", "type": None, "speed": 5.5},
+    "自驾": {"tool": "maps_distance", "type": "1", "speed": 8.5},
+    "出租车": {"tool": "maps_distance", "type": "1", "speed": 8.5},
+    "步行": {"tool": "maps_distance", "type": "3", "speed": 1.2},
+}
+# 路线结果的有效期与 tool_cache 中对应工具的默认有效期一致
+ROUTE_TTLS = {"maps_distance": 7 * DAY, "maps_direction_transit_integrated": 1 * DAY}
+
+Stop = Tuple[str, Location]
+
+
+def _route_length(path: List[int], dist: List[List[float]]) -> float:
+    return sum(dist[a][b] for a, b in zip(path, path[1:]))
+
+
+def _nearest_neighbour(nodes: List[int], first: int, dist: List[List[float]]) -> List[int]:
+    """从 first 出发，每次走到最近的未访问点"""
+    path = [first]
+    remaining = [node for node in nodes if node != first]
+    while remaining:
+        current = path[-1]
+        nearest = min(remaining, key=lambda node: (dist[current][node], node))
+        remaining.remove(nearest)
+        path.append(nearest)
+    return path
+
+
+def _two_opt(path: List[int], dist: List[List[float]], fixed_start: bool, fixed_end: bool) -> List[int]:
+    """
+    2-opt 局部搜索：反转一段路线能缩短总长度就反转，直到没有改进。起点/终点固定时不参与反转，
+    不固定时允许反转包含端点的一段(相当于换一个端点)
+    """
+    path = list(path)
+    lo = 1 if fixed_start else 0
+    hi = len(path) - 2 if fixed_end else len(path) - 1
+    improved = True
+    while improved:
+        improved = False
+        for i in range(lo, hi):
+            for j in range(i + 1, hi + 1):
+                before = dist[path[i - 1]][path[i]] if i > 0 else 0.0
+                after = dist[path[j]][path[j + 1]] if j + 1 < len(path) else 0.0
+                new_before = dist[path[i - 1]][path[j]] if i > 0 else 0.0
+                new_after = dist[path[i]][path[j + 1]] if j + 1 < len(path) else 0.0
+                if new_before + new_after < before + after - 1e-6:
+                    path[i:j + 1] = reversed(path[i:j + 1])
+                    improved = True
+    return path
+
+
+def order_stops(points, start=None, end=None) -> List[int]:
+    """
+    求单日的游览顺序：最近邻构造初始路线，再用 2-opt 优化，距离为球面距离
+    :param points: 景点经纬度列表，格式[[lon1, lat1], [lon2, lat2], ...]
+    :param start: 出发点经纬度 [lon, lat]，为 None 时从任意景点出发
+    :param end: 结束点经纬度 [lon, lat]，为 None 时在任意景点结束
+    :return: 景点下标的游览顺序
+    """
+    n = len(points)
+    if n <= 1:
+        return list(range(n))
+    nodes = list(points)
+    start_node = end_node = None
+    if start is not None:
+        start_node = len(nodes)
+        nodes.append(start)
+    if end is not None:
+        end_node = len(nodes)
+        nodes.append(end)
+    dist = build_distance_matrix(nodes).tolist()
+
+    if start_node is not None:
+        first = start_node
+    elif end_node is not None:
+        # 没有出发点时从离结束点最远的景点出发
+        first = max(range(n), key=lambda node: (dist[end_node][node], -node))
+    else:
+        # 都没有时从离其他景点最远(总距离最大)的景点出发
+        first = max(range(n), key=lambda node: (sum(dist[node][:n]), -node))
+    path = _nearest_neighbour(list(range(n)) + ([start_node] if start_node is not None else []), first, dist)
+    if end_node is not None:
+        path.append(end_node)
+    path = _two_opt(path, dist, start_node is not None, end_node is not None)
+    return [node for node in path if node < n]
+
+
+def estimate_leg(origin: Stop, destination: Stop, transportation: str) -> RouteLeg:
+    """按球面距离 × 绕行系数和交通方式的平均速度估算一段路线"""
+    (origin_name, origin_location), (destination_name, destination_location) = origin, destination
+    distance = build_distance_matrix([[origin_location.longitude, origin_location.latitude],
+                                      [destination_location.longitude, destination_location.latitude]])[0, 1]
+    distance = float(distance) * ROUTE_DETOUR_FACTOR
+    speed = ROUTE_MODES.get(transportation, ROUTE_MODES["公共交通"])["speed"]
+    return RouteLeg(origin=origin_name, destination=destination_name, distance=round(distance),
+                    duration=round(distance / speed), source="estimate")
+
+
+def _format_location(location: Location) -> str:
+    return f"{location.longitude:.6f},{location.latitude:.6f}"
+
+
+class RouteLegCache:
+    """
+    路线结果缓存：进程内 LRU + SQLite 持久化(与工具调用缓存同一个文件，TOOL_CACHE_PATH 为空时只用进程内缓存)，
+    键为 (工具, 参数, 起点, 终点)，与查询时合并了哪些起点无关
+    """
+
+    def __init__(self, path=None, memory_size=None, disk_size=None):
+        path = path if path is not None else os.getenv("TOOL_CACHE_PATH", "tool_cache.sqlite3")
+        self.memory = LRUCache(int(memory_size if memory_size is not None
+                                   else os.getenv("ROUTE_CACHE_MEMORY_SIZE", 10000)))
+        disk_size = int(disk_size if disk_size is not None else os.getenv("TOOL_CACHE_SIZE", 50000))
+        self.store = SqliteStore(path, disk_size, table="route_legs") if path else None
+        self.counters = {"hits": 0, "misses": 0, "amap_calls": 0, "failures": 0}
+
+    @staticmethod
+    def cache_key(tool: str, option: Optional[str], origin: str, destination: str) -> str:
+        return f"{tool}:{option or ''}:{origin}->{destination}"
+
+    async def get(self, key: str) -> Optional[Tuple[int, int]]:
+        """返回 (距离米, 用时秒)"""
+        value = self.memory.get(key)
+        if value is None and self.store is not None:
+            entry = await asyncio.to_thread(self.store.get, key)
+            if entry is not None:
+                value = tuple(json.loads(entry[0]))
+                self.memory.put(key, value, entry[1])
+        self.counters["hits" if value is not None else "misses"] += 1
+        return value
+
+    async def put(self, key: str, value: Tuple[int, int], ttl: float):
+        expires_at = time.time() + ttl
+        self.memory.put(key, value, expires_at)
+        if self.store is not None:
+            await asyncio.to_thread(self.store.put, key, json.dumps(value), expires_at)
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {**self.counters, "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self.memory)}
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+
+class RoutePlanner:
+    """按最终行程中每天的酒店和景点优化游览顺序，并查询相邻两站之间的路线"""
+
+    def __init__(self, direct_tools: DirectToolClient, cache: RouteLegCache, mode=None, concurrency=None):
+        """
+        Args:
+            direct_tools: 直接调用高德工具的客户端
+            cache: 路线结果缓存
+            mode: amap: 查询高德路线，查询失败的段按距离估算；local: 只在本地排序和估算
+            concurrency: 同时进行的路线查询数
+        """
+        self.direct_tools = direct_tools
+        self.cache = cache
+        self.mode = mode or os.getenv("ROUTE_MODE", "amap")
+        self.semaphore = asyncio.Semaphore(max(1, int(concurrency or os.getenv("ROUTE_QUERY_CONCURRENCY", 5))))
+        # 公共交通时直线距离不超过该值(米)的段按步行查询，0 表示不按步行
+        self.walk_distance = float(os.getenv("ROUTE_WALK_DISTANCE", 800))
+
+    @staticmethod
+    def order_day(day: DayPlan, start: Optional[Stop], end: Optional[Stop]) -> List[Stop]:
+        """按游览顺序重排当天的景点(原地修改)，返回路线上依次经过的各站"""
+        located = [attraction for attraction in day.attractions if attraction.location is not None]
+        order = order_stops([[attraction.location.longitude, attraction.location.latitude] for attraction in located],
+                            [start[1].longitude, start[1].latitude] if start is not None else None,
+                            [end[1].longitude, end[1].latitude] if end is not None else None)
+        ordered = [located[i] for i in order]
+        # 没有坐标的景点无法排序，放在最后
+        day.attractions = ordered + [attraction for attraction in day.attractions if attraction.location is None]
+        stops = [(attraction.name, attraction.location) for attraction in ordered]
+        return ([start] if start is not None else []) + stops + ([end] if end is not None else [])
+
+    async def plan(self, trip_plan: TripPlan, transportation: str, city: str) -> List[List[RouteLeg]]:
+        """
+        原地重排每天的景点并填写 DayPlan.route
+
+        Returns:
+            每天的路线(按 trip_plan.days 的顺序)
+        """
+        days = sorted(trip_plan.days, key=lambda day: day.day_index)
+        legs: List[Tuple[DayPlan, Stop, Stop]] = []
+        for day, (start_hotel, end_hotel) in zip(days, day_hotels(days)):
+            start = (start_hotel.name, start_hotel.location) if start_hotel and start_hotel.location else None
+            end = (end_hotel.name, end_hotel.location) if end_hotel and end_hotel.location else None
+            stops = self.order_day(day, start, end)
+            legs.extend((day, origin, destination) for origin, destination in zip(stops, stops[1:])
+                        if _format_location(origin[1]) != _format_location(destination[1]))
+
+        queried = await self.query_legs([(origin, destination) for _, origin, destination in legs],
+                                        transportation, city)
+        for day in days:
+            day.route = []
+        for (day, origin, destination), leg in zip(legs, queried):
+            day.route.append(leg)
+        return [day.route for day in trip_plan.days]
+
+    async def query_legs(self, pairs: List[Tuple[Stop, Stop]], transportation: str, city: str) -> List[RouteLeg]:
+        """
+        查询各段路线：先查缓存，未命中的合并查询，查询失败或不支持时按距离估算。
+        maps_distance 把到同一终点的多段合并为一次查询；公共交通不支持多个起点，起终点相同的段只查一次，
+        直线距离不超过 ROUTE_WALK_DISTANCE 的短途按步行与其他步行段合并查询。所有查询共用 ROUTE_QUERY_CONCURRENCY 的并发限制
+        """
+        results: Dict[int, Tuple[int, int]] = {}
+        modes = [self._leg_mode(origin, destination, transportation) for origin, destination in pairs]
+        # 未命中缓存的段：(工具, 参数) -> 终点 -> [(段下标, 起点)]
+        pending: Dict[Tuple[str, Optional[str]], Dict[str, List[Tuple[int, str]]]] = {}
+        for i, (origin, destination) in enumerate(pairs):
+            config = ROUTE_MODES[modes[i]]
+            tool = config["tool"]
+            option = city if tool == "maps_direction_transit_integrated" else config["type"]
+            origin_key, destination_key = _format_location(origin[1]), _format_location(destination[1])
+            cached = await self.cache.get(self.cache.cache_key(tool, option, origin_key, destination_key))
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.setdefault((tool, option), {}).setdefault(destination_key, []).append((i, origin_key))
+
+        if self.mode == "amap":
+            batches = []
+            for (tool, option), by_destination in pending.items():
+                if not self.direct_tools.supports(tool):
+                    continue
+                for destination, items in by_destination.items():
+                    if tool == "maps_distance":
+                        batches.append((tool, option, destination, items))
+                        continue
+                    by_origin: Dict[str, List[Tuple[int, str]]] = {}
+                    for item in items:
+                        by_origin.setdefault(item[1], []).append(item)
+                    batches.extend((tool, option, destination, group) for group in by_origin.values())
+            await asyncio.gather(*(self._query_batch(tool, option, destination, items, results)
+                                   for tool, option, destination, items in batches))
+
+        return [RouteLeg(origin=origin[0], destination=destination[0], distance=results[i][0],
+                         duration=results[i][1], source="amap")
+                if i in results else estimate_leg(origin, destination, modes[i])
+                for i, (origin, destination) in enumerate(pairs)]
+
+    def _leg_mode(self, origin: Stop, destination: Stop, transportation: str) -> str:
+        """实际查询用的交通方式：公共交通的短途按步行"""
+        transportation = transportation if transportation in ROUTE_MODES else "公共交通"
+        if transportation != "公共交通" or self.walk_distance <= 0:
+            return transportation
+        distance = build_distance_matrix([[origin[1].longitude, origin[1].latitude],
+                                          [destination[1].longitude, destination[1].latitude]])[0, 1]
+        return "步行" if distance <= self.walk_distance else transportation
+
+    async def _query_batch(self, tool: str, option: Optional[str], destination: str, items: List[Tuple[int, str]],
+                           results: Dict[int, Tuple[int, int]]):
+        """
+        查询到同一终点的一批路线，结果写入 results 和缓存；失败时不写入(按距离估算)。
+        公共交通的一批为起点相同的段，只查询一次
+        """
+        origins = [origin for _, origin in items]
+        async with self.semaphore:
+            self.cache.counters["amap_calls"] += 1
+            try:
+                if tool == "maps_distance":
+                    message = await self.direct_tools.distance(origins, destination, option)
+                    values = _parse_distance(message, len(origins))
+                else:
+                    message = await self.direct_tools.transit(origins[0], destination, option)
+                    values = [_parse_transit(message)] * len(items)
+            except Exception as e:
+                self.cache.counters["failures"] += 1
+                print(f"⚠️  查询路线 {'|'.join(dict.fromkeys(origins))} -> {destination} 失败: {str(e)}")
+                return
+        stored = set()
+        for (i, origin), value in zip(items, values):
+            if value is None:
+                continue
+            results[i] = value
+            if origin not in stored:
+                stored.add(origin)
+                await self.cache.put(self.cache.cache_key(tool, option, origin, destination), value, ROUTE_TTLS[tool])
+
+
+def _tool_content(message) -> dict:
+    return json.loads(message.content[0].get('text'))
+
+
+def _parse_distance(message, count: int) -> List[Optional[Tuple[int, int]]]:
+    """maps_distance 的结果：results 中 origin_id 为起点的序号(从1开始)"""
+    values: List[Optional[Tuple[int, int]]] = [None] * count
+    for result in _tool_content(message).get("results", []):
+        index = int(result.get("origin_id", 0)) - 1
+        if 0 <= index < count and result.get("distance") not in (None, ""):
+            values[index] = (int(float(result["distance"])), int(float(result.get("duration") or 0)))
+    return values
+
+
+def _parse_transit(message) -> Optional[Tuple[int, int]]:
+    """maps_direction_transit_integrated 的结果：取第一个换乘方案的用时"""
+    content = _tool_content(message)
+    content = content.get("route", content)
+    transits = content.get("transits") or []
+    if not transits or content.get("distance") in (None, ""):
+        return None
+    return int(float(content["distance"])), int(float(transits[0].get("duration") or 0))
+
+
+_route_leg_cache: Optional[RouteLegCache] = None
+
+
+def get_route_leg_cache() -> RouteLegCache:
+    """进程内共享的路线缓存，第一次使用时创建(会打开 SQLite 文件)，服务关闭时由 close_route_leg_cache 关闭"""
+    global _route_leg_cache
+    if _route_leg_cache is None:
+        _route_leg_cache = RouteLegCache()
+    return _route_leg_cache
+
+
+def close_route_leg_cache():
+    global _route_leg_cache
+    if _route_leg_cache is not None:
+        _route_leg_cache.close()
+        _route_leg_cache = None
@@ -0,0 +1,217 @@
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from cluster import haversine_distance
+
+
+# 每度纬度对应的距离（米）
+METERS_PER_DEGREE = 111320
+
+
+class GridIndex:
+    """
+    按经纬度网格分桶的邻近点索引：格子的南北和东西边长都不小于 radius，
+    距离在 radius 以内的点一定落在相邻的 3×3 个格子里，插入和查询的耗时与已有点数无关
+    """
+
+    def __init__(self, radius: float = 50.0):
+        """
+        Args:
+            radius: 邻近的距离阈值（米）
+        """
+        self.radius = float(radius)
+        self.lat_step = self.radius / METERS_PER_DEGREE
+        # (行, 列) -> 点下标
+        self.buckets: Dict[Tuple[int, int], List[int]] = {}
+        self.points: List[Tuple[float, float]] = []
+
+    def _column(self, longitude: float, row: int) -> int:
+        # 每一行按该行离赤道最远的纬度计算经度方向的格宽，整行的东西边长都不小于 radius
+        latitude = min(89.9, max(abs(row), abs(row + 1)) * self.lat_step)
+        return math.floor(longitude * math.cos(math.radians(latitude)) / self.lat_step)
+
+    def add(self, longitude: float, latitude: float) -> int:
+        """插入一个点，返回其下标"""
+        index = len(self.points)
+        self.points.append((longitude, latitude))
+        row = math.floor(latitude / self.lat_step)
+        self.buckets.setdefault((row, self._column(longitude, row)), []).append(index)
+        return index
+
+    def nearby(self, longitude: float, latitude: float) -> List[Tuple[float, int]]:
+        """
+        距离在 radius 以内的已有点
+
+        Returns:
+            [(距离米, 点下标)]，按距离升序
+        """
+        row = math.floor(latitude / self.lat_step)
+        found = []
+        for neighbour_row in (row - 1, row, row + 1):
+            column = self._column(longitude, neighbour_row)
+            for neighbour_column in (column - 1, column, column + 1):
+                for index in self.buckets.get((neighbour_row, neighbour_column), ()):
+                    other_longitude, other_latitude = self.points[index]
+                    distance = float(haversine_distance(latitude, longitude, other_latitude, other_longitude))
+                    if distance <= self.radius:
+                        found.append((distance, index))
+        return sorted(found)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+
+class KDTree:
+    """
+    单位球面坐标(cluster.to_unit_vectors)上的 KD 树：弦长与球面距离单调对应，按弦长找到的近邻与按球面距离排序的结果相同。
+    按跨度最大的坐标轴在中位数处递归切分，只保留叶子节点的点和包围盒
+    """
+
+    def __init__(self, vectors, leaf_size: int = 32):
+        """
+        Args:
+            vectors: n×3 单位球面坐标
+            leaf_size: 叶子节点最多包含的点数
+        """
+        self.vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, 3)
+        self.leaf_size = max(1, int(leaf_size))
+        # 叶子节点 -> 点下标(升序)
+        self.leaves: List[np.ndarray] = []
+        if len(self.vectors):
+            self._split(np.arange(len(self.vectors)))
+        # 各叶子节点包围盒的下界和上界(叶子数 × 3)
+        self.lower = np.array([self.vectors[leaf].min(axis=0) for leaf in self.leaves]).reshape(-1, 3)
+        self.upper = np.array([self.vectors[leaf].max(axis=0) for leaf in self.leaves]).reshape(-1, 3)
+
+    def _split(self, indices: np.ndarray):
+        if len(indices) <= self.leaf_size:
+            self.leaves.append(np.sort(indices))
+            return
+        coords = self.vectors[indices]
+        axis = int(np.argmax(coords.max(axis=0) - coords.min(axis=0)))
+        half = len(indices) // 2
+        order = np.argpartition(coords[:, axis], half)
+        self._split(indices[order[:half]])
+        self._split(indices[order[half:]])
+
+    def _squared_chords(self, rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        block = np.zeros((len(rows), len(columns)))
+        for axis in range(3):
+            block += (self.vectors[rows, axis, None] - self.vectors[None, columns, axis]) ** 2
+        return block
+
+    def k_nearest(self, k: int) -> np.ndarray:
+        """
+        每个点最近的 k 个其他点。逐个叶子节点查询：先在包围盒最近的几个叶子里取够 k+1 个点得到距离上界，
+        再只计算包围盒在上界以内的叶子里的点，不需要 n×n 距离矩阵
+
+        Args:
+            k: 近邻数量，超过 n-1 时取 n-1
+
+        Returns:
+            n×k 点下标数组，每行按距离升序，距离相同时按下标升序
+        """
+        n = len(self.vectors)
+        k = max(0, min(int(k), n - 1))
+        result = np.empty((n, k), dtype=np.int64)
+        if k == 0:
+            return result
+        sizes = np.array([len(leaf) for leaf in self.leaves])
+        for leaf, members in enumerate(self.leaves):
+            # 叶子包围盒之间的最小平方距离，不超过两个叶子中任意两点的平方弦长
+            gaps = np.maximum(0, np.maximum(self.lower - self.upper[leaf], self.lower[leaf] - self.upper))
+            box_distances = np.einsum("ij,ij->i", gaps, gaps)
+            order = np.argsort(box_distances, kind="stable")
+            count = int(np.searchsorted(np.cumsum(sizes[order]), k + 1)) + 1
+            nearby = np.concatenate([self.leaves[i] for i in order[:count]])
+            radius = np.partition(self._squared_chords(members, nearby), k, axis=1)[:, k].max()
+            candidates = np.sort(np.concatenate([self.leaves[i] for i in np.flatnonzero(box_distances <= radius + 1e-12)]))
+            distances = self._squared_chords(members, candidates)
+            distances[members[:, None] == candidates[None, :]] = np.inf
+            result[members] = candidates[np.argsort(distances, axis=1, kind="stable")[:, :k]]
+        return result
+
+
+class PoiDedupStats:
+    """全部请求中POI去重的累计次数"""
+
+    def __init__(self):
+        self.counters = {"added": 0, "merged_by_id": 0, "merged_nearby": 0, "overlaps": 0}
+
+    def record(self, outcome: str):
+        self.counters[outcome] += 1
+
+    def stats(self) -> dict:
+        return dict(self.counters)
+
+
+poi_dedup_stats = PoiDedupStats()
+
+
+def _same_name(name: str, other: str) -> bool:
+    """名称相同或互相包含，如“故宫博物院”和“故宫博物院-午门”"""
+    name, other = name.strip(), other.strip()
+    return bool(name) and bool(other) and (name in other or other in name)
+
+
+class PoiIndex:
+    """
+    一次请求中全部景点、酒店、美食的去重索引(每个请求一个)：
+    - 同类且高德POI ID 相同的是同一个POI，只保留第一次出现的对象
+    - 同类、距离在 radius 以内且名称互相包含的也视为重复(同一地点的不同POI，如景区和景区的某个门)
+    - 其他位置重合的POI(景区内的餐厅、同一商场里的多家餐厅、和酒店同一栋楼的餐厅)都保留，只计入重合次数
+    """
+
+    def __init__(self, radius: Optional[float] = None):
+        self.grid = GridIndex(float(radius if radius is not None else os.getenv("POI_DEDUP_RADIUS", 50)))
+        # (类别, 高德POI ID) -> POI
+        self.by_id: Dict[Tuple[str, str], Any] = {}
+        # 与 grid 中的点一一对应：(类别, POI)
+        self.entries: List[Tuple[str, Any]] = []
+
+    def add(self, kind: str, poi) -> Any:
+        """
+        加入一个POI
+
+        Args:
+            kind: 类别，attraction/hotel/meal
+            poi: Attraction/Hotel/Meal
+
+        Returns:
+            去重后的POI：重复时返回先加入的对象，否则返回 poi 本身
+        """
+        poi_id = getattr(poi, "id", None)
+        if poi_id and (kind, poi_id) in self.by_id:
+            poi_dedup_stats.record("merged_by_id")
+            return self.by_id[(kind, poi_id)]
+        if poi.location is not None:
+            nearby = self.grid.nearby(poi.location.longitude, poi.location.latitude)
+            for _, index in nearby:
+                other_kind, other = self.entries[index]
+                if other_kind == kind and _same_name(poi.name, other.name):
+                    poi_dedup_stats.record("merged_nearby")
+                    print(f"🔁 {poi.name} 与 {other.name} 位置重合，视为同一个地点")
+                    if poi_id:
+                        self.by_id[(kind, poi_id)] = other
+                    return other
+            if nearby:
+                poi_dedup_stats.record("overlaps")
+            self.grid.add(poi.location.longitude, poi.location.latitude)
+            self.entries.append((kind, poi))
+        if poi_id:
+            self.by_id[(kind, poi_id)] = poi
+        poi_dedup_stats.record("added")
+        return poi
+
+    def dedupe(self, kind: str, pois: list) -> list:
+        """加入一组POI，返回去重后的列表(保持原来的顺序)"""
+        unique, seen = [], set()
+        for poi in pois:
+            poi = self.add(kind, poi)
+            if id(poi) not in seen:
+                seen.add(id(poi))
+                unique.append(poi)
+        return unique
@@ -0,0 +1,133 @@
+import json
+from typing import Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+from parse_info import repair_json
+
+
+class MalformedItemError(ValueError):
+    """流式输出中某个元素修复后仍不是合法的 JSON 或没有通过数据模型校验"""
+
+    def __init__(self, key: str, index: int, message: str):
+        super().__init__(f"{key}[{index}] 格式错误: {message}")
+        self.key = key
+        self.index = index
+
+
+class _Container:
+    def __init__(self, kind: str, key: Optional[str] = None):
+        # "{" 或 "["
+        self.kind = kind
+        # 该容器在父对象中的键
+        self.key = key
+        # 对象中当前正在解析的键
+        self.current_key = None
+        self.item_count = 0
+
+
+class StreamingJsonParser:
+    """
+    增量 JSON 解析器：逐段喂入 LLM 生成的 token，跟踪字符串、转义和括号嵌套，
+    顶层对象中指定数组(如 days、weather_info)的每个元素对象一闭合就立即解析并用对应的数据模型校验，
+    不需要等待整个响应生成完毕。第一个 { 之前的文字(如 ```json 标记)会被忽略。
+    元素校验失败时先用 repair_json 修复小的语法错误(多余的逗号、字符串中未转义的换行等)再校验一次。
+    """
+
+    def __init__(self, item_models: Dict[str, Type[BaseModel]]):
+        """
+        Args:
+            item_models: 顶层数组的键 -> 数组元素的数据模型，如 {"days": DayPlan, "weather_info": WeatherInfo}
+        """
+        self.item_models = item_models
+        self.buffer = []
+        self._position = 0
+        self._stack: List[_Container] = []
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._last_string = None
+        self._item_start = None
+        self.finished = False
+        # 修复后才通过校验的元素数
+        self.repaired_count = 0
+
+    def feed(self, text: str) -> List[Tuple[str, BaseModel]]:
+        """
+        喂入一段文本
+
+        Returns:
+            本段文本中闭合的元素列表 [(数组的键, 校验后的对象)]
+
+        Raises:
+            MalformedItemError: 某个元素修复后仍不是合法的 JSON 或校验失败，调用方可以据此提前中止生成
+        """
+        items = []
+        for char in text:
+            self.buffer.append(char)
+            position = self._position
+            self._position += 1
+            if self.finished:
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = "".join(self.buffer[self._string_start:position + 1])
+                continue
+            if not self._stack and char != "{":
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = position
+            elif char == ":" and self._stack and self._stack[-1].kind == "{":
+                try:
+                    self._stack[-1].current_key = json.loads(self._last_string)
+                except (TypeError, ValueError):
+                    self._stack[-1].current_key = None
+            elif char in "{[":
+                parent = self._stack[-1] if self._stack else None
+                key = parent.current_key if parent is not None and parent.kind == "{" else None
+                if self._is_watched_array(parent) and char == "{":
+                    self._item_start = position
+                self._stack.append(_Container(char, key))
+            elif char in "}]":
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                parent = self._stack[-1] if self._stack else None
+                if self._is_watched_array(parent) and char == "}" and self._item_start is not None:
+                    items.append(self._validate(parent, "".join(self.buffer[self._item_start:position + 1])))
+                    self._item_start = None
+                if not self._stack:
+                    self.finished = True
+        return items
+
+    def _is_watched_array(self, container: Optional[_Container]) -> bool:
+        """是否为需要逐个解析元素的顶层数组(根对象的直接子数组)"""
+        return (container is not None and container.kind == "[" and len(self._stack) == 2
+                and container.key in self.item_models)
+
+    def _validate(self, container: _Container, text: str) -> Tuple[str, BaseModel]:
+        index = container.item_count
+        container.item_count += 1
+        model = self.item_models[container.key]
+        try:
+            return container.key, model.model_validate_json(text)
+        except ValidationError:
+            pass
+        try:
+            item = model.model_validate_json(repair_json(text))
+        except ValidationError as e:
+            raise MalformedItemError(container.key, index, str(e)) from e
+        self.repaired_count += 1
+        return container.key, item
+
+    @property
+    def text(self) -> str:
+        """目前为止收到的全部文本"""
+        return "".join(self.buffer)
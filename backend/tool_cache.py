@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+from langchain_core.tools import BaseTool, StructuredTool
+
+from cache import DAY, HOUR, SqliteStore
+
+# 各高德工具结果的默认有效期（秒），未列出的工具使用 TOOL_CACHE_DEFAULT_TTL
+DEFAULT_TOOL_TTLS = {
+    "maps_weather": 1 * HOUR,
+    "maps_text_search": 1 * DAY,
+    "maps_around_search": 1 * DAY,
+    "maps_search_detail": 7 * DAY,
+    "maps_geo": 30 * DAY,
+    "maps_regeocode": 30 * DAY,
+    "maps_ip_location": 1 * DAY,
+    "maps_distance": 7 * DAY,
+    "maps_direction_walking": 7 * DAY,
+    "maps_direction_bicycling": 7 * DAY,
+    "maps_direction_driving": 1 * DAY,
+    "maps_direction_transit_integrated": 1 * DAY,
+}
+
+
+# 各工具结果中表示有数据的字段(搜索、详情、天气、距离、公交路线)
+RESULT_FIELDS = ("pois", "location", "forecasts", "results", "transits")
+
+
+def is_cacheable_result(result) -> bool:
+    """
+    只缓存有数据的结果：不是 JSON 对象的文本(通常是错误信息)、带 error 字段、或数据字段都为空的结果不缓存，
+    否则阶段重试会在整个有效期内拿到同一个空结果
+    """
+    content = result[0] if isinstance(result, (tuple, list)) and len(result) == 2 else result
+    if isinstance(content, list):
+        texts = [item.get("text", "") for item in content if isinstance(item, dict) and item.get("type") == "text"]
+        content = texts[0] if texts else ""
+    try:
+        data = json.loads(content) if isinstance(content, str) else None
+    except ValueError:
+        return False
+    if not isinstance(data, dict) or not data or data.get("error"):
+        return False
+    fields = [field for field in RESULT_FIELDS if field in data]
+    return not fields or any(data[field] for field in fields)
+
+
+def canonicalize_arguments(arguments: Dict[str, Any]) -> str:
+    """参数规范化：忽略 None 值、字符串首尾空白和键的顺序"""
+    normalized = {key: value.strip() if isinstance(value, str) else value
+                  for key, value in arguments.items() if value is not None}
+    return json.dumps(normalized, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def parse_ttls(text: str) -> Dict[str, float]:
+    """解析 "maps_weather=3600,maps_search_detail=604800" 格式的有效期配置"""
+    ttls = {}
+    for item in text.split(","):
+        if "=" in item:
+            name, ttl = item.split("=", 1)
+            ttls[name.strip()] = float(ttl)
+    return ttls
+
+
+class ToolCallCache:
+    """
+    高德MCP工具调用结果的持久化缓存：键为工具名称 + 规范化后的参数，
+    结果存入 SQLite，按工具设置有效期，超出容量时淘汰最久未访问的条目。命中时不发起任何网络请求。
+    """
+
+    def __init__(self, path=None, max_entries=None, default_ttl=None, ttls=None):
+        path = path if path is not None else os.getenv("TOOL_CACHE_PATH", "tool_cache.sqlite3")
+        max_entries = int(max_entries if max_entries is not None else os.getenv("TOOL_CACHE_SIZE", 50000))
+        # TOOL_CACHE_PATH 为空时不缓存
+        self.store = SqliteStore(path, max_entries, table="tool_calls") if path else None
+        self.default_ttl = float(default_ttl if default_ttl is not None
+                                 else os.getenv("TOOL_CACHE_DEFAULT_TTL", DAY))
+        self.ttls = {**DEFAULT_TOOL_TTLS, **(ttls if ttls is not None else parse_ttls(os.getenv("TOOL_CACHE_TTLS", "")))}
+        # 工具名称 -> {"hits": 命中次数, "misses": 未命中次数, "uncached": 结果为空或出错而没有缓存的次数}
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self.evictions = 0
+
+    def ttl_for(self, tool_name: str) -> float:
+        return self.ttls.get(tool_name, self.default_ttl)
+
+    @staticmethod
+    def cache_key(tool_name: str, arguments: Dict[str, Any]) -> str:
+        digest = hashlib.sha256(canonicalize_arguments(arguments).encode("utf-8")).hexdigest()
+        return f"{tool_name}:{digest}"
+
+    def _count(self, tool_name: str, outcome: str):
+        counter = self.counters.setdefault(tool_name, {"hits": 0, "misses": 0, "uncached": 0})
+        counter[outcome] += 1
+
+    def wrap(self, tools: List[BaseTool]) -> List[BaseTool]:
+        """返回带缓存的工具列表；未启用缓存或不支持异步调用的工具原样返回"""
+        if self.store is None:
+            return tools
+        return [self._wrap_tool(tool) if isinstance(tool, StructuredTool) and tool.coroutine else tool
+                for tool in tools]
+
+    def _wrap_tool(self, tool: StructuredTool) -> StructuredTool:
+        call_tool = tool.coroutine
+        tool_name = tool.name
+
+        async def cached_call(**arguments):
+            key = self.cache_key(tool_name, arguments)
+            entry = await asyncio.to_thread(self.store.get, key)
+            if entry is not None:
+                self._count(tool_name, "hits")
+                content, artifact = json.loads(entry[0])
+                return content, artifact
+
+            self._count(tool_name, "misses")
+            result = await call_tool(**arguments)
+            if not is_cacheable_result(result):
+                self._count(tool_name, "uncached")
+                return result
+            try:
+                value = json.dumps(result, ensure_ascii=False)
+            except TypeError:
+                # 结果无法序列化（例如返回了 ToolMessage），不缓存
+                return result
+            self.evictions += await asyncio.to_thread(self.store.put, key, value,
+                                                      time.time() + self.ttl_for(tool_name))
+            return result
+
+        return StructuredTool(
+            name=tool.name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            coroutine=cached_call,
+            response_format=tool.response_format,
+            metadata=tool.metadata,
+        )
+
+    def stats(self) -> dict:
+        tools = {}
+        for tool_name, counter in self.counters.items():
+            lookups = counter["hits"] + counter["misses"]
+            tools[tool_name] = {**counter, "hit_rate": round(counter["hits"] / lookups, 4) if lookups else 0.0}
+        return {
+            "enabled": self.store is not None,
+            "entries": len(self.store) if self.store is not None else 0,
+            "evictions": self.evictions,
+            "tools": tools,
+        }
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
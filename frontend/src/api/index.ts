@@ -37,3 +37,56 @@ export const createTripPlan = async (request: TripRequest): Promise<TripPlan> =>
   return api.post<TripPlan>('/trip', request) as unknown as Promise<TripPlan>
 }
 
+
+/**
+ * 流式创建旅行计划（SSE）
+ * 每个阶段完成后立即回调 onEvent，例如 attractions 事件到达即可在地图上展示景点，
+ * 最终的 trip_plan 事件携带完整的旅行计划
+ */
+export const streamTripPlan = async (
+  request: TripRequest,
+  onEvent: (event: string, data: any) => void
+): Promise<TripPlan> => {
+  const response = await fetch('/api/trip/stream', {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'Accept': 'text/event-stream'
+    },
+    body: JSON.stringify(request)
+  })
+  if (!response.ok || !response.body) {
+    throw new Error(`请求失败: ${response.status}`)
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+  let tripPlan: TripPlan | null = null
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+    const blocks = buffer.split(/\r?\n\r?\n/)
+    buffer = blocks.pop() || ''
+    for (const block of blocks) {
+      let event = 'message'
+      const dataLines: string[] = []
+      for (const line of block.split(/\r?\n/)) {
+        if (line.startsWith('event:')) event = line.slice(6).trim()
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trimStart())
+      }
+      if (dataLines.length === 0) continue
+      const data = JSON.parse(dataLines.join('\n'))
+      if (event === 'error') throw new Error(data || '生成旅行计划失败')
+      if (event === 'trip_plan') tripPlan = data
+      onEvent(event, data)
+    }
+  }
+
+  if (!tripPlan) {
+    throw new Error('流式响应中没有完整的旅行计划')
+  }
+  return tripPlan
+}
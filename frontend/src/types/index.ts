@@ -60,6 +60,16 @@ export interface DayPlan {
   hotels?: Hotel[]  // 支持多个酒店
   attractions: Attraction[]
   meals: Meal[]
+  route?: RouteLeg[]  // 按游览顺序的路线
+}
+
+// 路线中相邻两站之间的一段
+export interface RouteLeg {
+  origin: string
+  destination: string
+  distance: number  // 米
+  duration: number  // 秒
+  source: 'amap' | 'estimate'
 }
 
 // 天气信息